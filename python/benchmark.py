@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  e-Stat API Adaptor ベンチマーク
+#  (c) 2016 National Statistics Center
+#  License: MIT
+#
+#  ローカルのスタブサーバー(estat_stub.py)を相手に主要な処理の所要時間・スループット・
+#  ピークメモリを計測し、結果をJSONに保存する。--compareで以前の結果と比較できる。
+#
+#  python benchmark.py --rows 100000 --output after.json --compare before.json
+#
+# # # # # # # # # # # # # # # # # # # # # # # #
+
+import os
+import sys
+import gc
+import json
+import time
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import pandas as pd
+import e_Stat_API_Adaptor
+from estat_stub import EStatStub
+
+
+# 計測結果に影響する条件(比較時に異なれば警告する)
+WORKLOAD = ('rows', 'limit', 'catalog', 'tables', 'latency', 'special', 'concurrency', 'workers', 'aggregate', 'query')
+
+
+def _nbytes(out):
+    """出力のバイト数(文字列・バイト列以外は出力側で数えた値をそのまま使う)"""
+    if isinstance(out, str):
+        return len(out.encode('utf-8'))
+    if isinstance(out, (bytes, bytearray)):
+        return len(out)
+    if isinstance(out, int) and not isinstance(out, bool):
+        return out
+    return None
+
+
+def _consume(chunks):
+    return sum(len(c.encode('utf-8') if isinstance(c, str) else c) for c in chunks)
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+class Benchmark:
+    """スタブサーバーと一時ディレクトリ上のアダプターで各処理を計測"""
+
+    def __init__(self, args):
+        self.args = args
+        self.results = []
+        self.stub = EStatStub(args.rows, args.catalog, args.latency, args.special).start()
+        self.directory = args.directory or tempfile.mkdtemp(prefix='estat-bench-')
+        self.adaptor = e_Stat_API_Adaptor.e_Stat_API_Adaptor({
+            'appId': 'benchmark',
+            'limit': str(args.limit),
+            'next_key': True,
+            'directory': os.path.join(self.directory, ''),
+            'ver': '2.0',
+            'host': self.stub.host,
+            'concurrency': args.concurrency,
+            # スタブは流量を制限しないため、アダプター自体の性能を計測する
+            'rate_limit': 0,
+            'index_workers': args.workers,
+            # convert_raw_json_to_csvを繰り返し計測するためにページを保持する
+            'page_retention': 3600
+        })
+        self.ids = ['%010d' % (i + 1) for i in range(max(args.tables, 1))]
+
+    def close(self):
+        self.stub.stop()
+        if not self.args.directory:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    # fnをrepeat回計測(setupは計測の対象外)し、最後にtracemallocを有効にしてピークメモリを計測
+    def measure(self, name, fn, setup=None, rows=None, repeat=None):
+        if self.args.only and not any(s in name for s in self.args.only):
+            return None
+        repeat = self.args.repeat if repeat is None else repeat
+        times = []
+        out = None
+        hits = self.stub.hits
+        for _ in range(repeat):
+            if setup:
+                setup()
+            gc.collect()
+            start = time.perf_counter()
+            out = fn()
+            times.append(time.perf_counter() - start)
+        requests = (self.stub.hits - hits) // repeat
+
+        peak = None
+        if self.args.memory:
+            if setup:
+                setup()
+            gc.collect()
+            tracemalloc.start()
+            try:
+                out = fn()
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        median = statistics.median(times)
+        nbytes = _nbytes(out)
+        result = {
+            'name': name,
+            'runs': repeat,
+            'min': min(times),
+            'median': median,
+            'mean': statistics.mean(times),
+            'max': max(times),
+            'rows': rows,
+            'rows_per_sec': rows / median if rows and median else None,
+            'bytes': nbytes,
+            'mb_per_sec': nbytes / median / 1e6 if nbytes and median else None,
+            'peak_memory_bytes': peak,
+            'upstream_requests': requests
+        }
+        self.results.append(result)
+        print(self.format_result(result), flush=True)
+        return result
+
+    @staticmethod
+    def format_result(r):
+        parts = [f"{r['name']:<40} {r['median'] * 1000:10.2f} ms"]
+        if r['rows_per_sec']:
+            parts.append(f"{r['rows_per_sec']:12,.0f} rows/s")
+        if r['mb_per_sec']:
+            parts.append(f"{r['mb_per_sec']:8.2f} MB/s")
+        if r['peak_memory_bytes'] is not None:
+            parts.append(f"peak {r['peak_memory_bytes'] / 1e6:8.2f} MB")
+        return '  '.join(parts)
+
+    def _reset_table(self, statsDataId):
+        self.adaptor.evict_cached_data(statsDataId)
+        self.adaptor._cleanup_temp_files(statsDataId)
+
+    def run(self):
+        a = self.adaptor
+        args = self.args
+        sid = self.ids[0]
+
+        # 統計表IDのダウンロードとインデックスの作成
+        self.measure('catalog/load_all_ids', a.load_all_ids, rows=args.catalog)
+        self.measure('catalog/build_indexes', lambda: a.build_indexes(workers=args.workers), rows=args.catalog)
+
+        # 検索(初回はインデックスの読み込みを含む)
+        if os.path.exists(a.path['dictionary-index']):
+            self.measure('search/search_id:cold', lambda: a.search_id(args.query, a.path['dictionary-index']),
+                         setup=lambda: os.utime(a.path['dictionary-index']))
+            self.measure('search/search_id', lambda: a.search_id(args.query, a.path['dictionary-index']))
+            self.measure('search/search_id:index', lambda: a.search_id('index', a.path['dictionary-index']),
+                         rows=args.catalog)
+        if os.path.exists(a.path['dictionary-detail-index']):
+            self.measure('search/search_detailed_index:cold', lambda: a.search_detailed_index(args.query),
+                         setup=lambda: os.utime(a.path['dictionary-detail-index']))
+            self.measure('search/search_detailed_index', lambda: a.search_detailed_index(args.query))
+        if os.path.exists(a.path['dictionary-index']):
+            indexes = [a.path[p] for p in ('dictionary-index', 'dictionary-detail-index') if os.path.exists(a.path[p])]
+            self.measure('search/search_ranked:cold', lambda: a.search_ranked(args.query),
+                         setup=lambda: [os.utime(p) for p in indexes])
+            self.measure('search/search_ranked', lambda: a.search_ranked(args.query))
+
+        # データのダウンロードと変換
+        self.measure('data/download_all_data', lambda: a.download_all_data(sid),
+                     setup=lambda: self._reset_table(sid), rows=args.rows)
+        a.download_all_data(sid)
+        self.measure('data/convert_raw_json_to_csv', lambda: a.convert_raw_json_to_csv(sid), rows=args.rows)
+        self.measure('data/get_csv:cold', lambda: a.get_csv('get', sid),
+                     setup=lambda: self._reset_table(sid), rows=args.rows)
+        self.measure('data/get_csv:warm', lambda: a.get_csv('get', sid), rows=args.rows)
+        self.measure('data/get_csv:head', lambda: a.get_csv('head', sid))
+        self.measure('data/get_csv:tail', lambda: a.get_csv('tail', sid))
+        self.measure('data/get_csv:range', lambda: a.get_csv('range', sid, args.rows // 2, 100), rows=100)
+        self.measure('data/load_table', lambda: a.load_table(sid), rows=args.rows)
+
+        # 出力形式ごとの変換(CSV文字列・DataFrame・キャッシュからのストリーミング)
+        text = a.get_csv('get', sid)
+        frame = a.load_table(sid)
+        for output_type in ('csv', 'rjson', 'cjson'):
+            self.measure(f'output/get_output:{output_type}', lambda: a.get_output(text, output_type),
+                         rows=args.rows)
+            self.measure(f'output/get_output:{output_type}:frame', lambda: a.get_output(frame, output_type),
+                         rows=args.rows)
+            self.measure(f'output/iter_table_output:{output_type}',
+                         lambda: _consume(a.iter_table_output('get', sid, output_type)), rows=args.rows)
+        del text, frame
+
+        # 次元の索引による絞り込みと列の選択(1都道府県・1都道府県と1年)
+        for output_type in ('csv', 'rjson', 'cjson'):
+            self.measure(f'output/iter_selection:area:{output_type}', lambda: _consume(
+                a.iter_table_output('get', sid, output_type, where={'area': ['13000']})))
+        self.measure('output/iter_selection:area,time,cols:rjson', lambda: _consume(
+            a.iter_table_output('get', sid, 'rjson', where={'area': ['13000'], 'time': ['2020000000']},
+                                cols=['time', '$'])))
+
+        # 複数の統計表の結合(ダウンロードは計測の対象外)
+        if args.tables > 1:
+            ids = ','.join(self.ids)
+            for sub in self.ids[1:]:
+                a.get_csv('head', sub)
+            rows = args.rows * len(self.ids)
+            self.measure('merge/merge_data:all', lambda: a.merge_data(ids, 'all', ''), rows=rows)
+            self.measure(f'merge/merge_data:area,{args.aggregate}',
+                         lambda: a.merge_data(ids, 'area', args.aggregate), rows=rows)
+            self.measure(f'merge/merge_data:area,time,{args.aggregate}',
+                         lambda: a.merge_data(ids, 'area,time', args.aggregate), rows=rows)
+
+        return self.report()
+
+    def report(self):
+        return {
+            'meta': {
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'revision': _git_revision(),
+                'python': platform.python_version(),
+                'pandas': pd.__version__,
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'params': {k: v for k, v in vars(self.args).items() if k not in ('output', 'compare', 'directory', 'only')}
+            },
+            'results': self.results
+        }
+
+
+# 以前の結果と比較(中央値の比が1より小さければ速くなっている)
+def compare(current, previous):
+    before = {r['name']: r for r in previous['results']}
+    print()
+    print(f"{'name':<40} {'before':>10} {'after':>10} {'ratio':>7} {'peak':>7}")
+    for r in current['results']:
+        p = before.get(r['name'])
+        if p is None:
+            continue
+        ratio = r['median'] / p['median'] if p['median'] else float('nan')
+        peak = ''
+        if r['peak_memory_bytes'] and p.get('peak_memory_bytes'):
+            peak = f"{r['peak_memory_bytes'] / p['peak_memory_bytes']:.2f}"
+        print(f"{r['name']:<40} {p['median'] * 1000:8.2f}ms {r['median'] * 1000:8.2f}ms {ratio:7.2f} {peak:>7}")
+    params = [current['meta']['params'], previous['meta'].get('params', {})]
+    if any(params[0].get(k) != params[1].get(k) for k in WORKLOAD):
+        print('(parameters differ from the previous run)')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='e-Stat API Adaptorのベンチマーク')
+    parser.add_argument('--rows', type=int, default=100000, help='統計表1つあたりのデータ件数')
+    parser.add_argument('--limit', type=int, default=10000, help='1ページあたりのデータ件数')
+    parser.add_argument('--catalog', type=int, default=10000, help='getStatsListの統計表数')
+    parser.add_argument('--tables', type=int, default=3, help='merge_dataで結合する統計表数')
+    parser.add_argument('--latency', type=float, default=0.0, help='スタブの1リクエストあたりの遅延(秒)')
+    parser.add_argument('--special', type=int, default=0, help="n件に1件の値を'-'にする")
+    parser.add_argument('--concurrency', type=int, default=4, help='ページの並列ダウンロード数')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='インデックス作成のワーカー数')
+    parser.add_argument('--aggregate', default='sum', help='merge_dataの集約方法')
+    parser.add_argument('--query', default='人口', help='検索語')
+    parser.add_argument('--repeat', type=int, default=3, help='各処理の計測回数')
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help='ピークメモリを計測しない')
+    parser.add_argument('--only', action='append', help='名前に指定した文字列を含むものだけを計測(複数可)')
+    parser.add_argument('--directory', help='作業ディレクトリ(省略時は一時ディレクトリを作成して削除)')
+    parser.add_argument('--output', default='benchmark.json', help='結果を保存するJSONファイル')
+    parser.add_argument('--compare', help='比較する以前の結果(JSON)')
+    args = parser.parse_args(argv)
+
+    # 計測中はアダプターのINFOログを出力しない
+    logging.getLogger().setLevel(logging.WARNING)
+    bench = Benchmark(args)
+    try:
+        result = bench.run()
+    finally:
+        bench.close()
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(f"Saved results to: {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(result, json.load(f))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
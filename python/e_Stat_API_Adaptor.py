@@ -10,28 +10,1211 @@
 # # # # # # # # # # # # # # # # # # # # # # # #
 
 import os
-import subprocess
+import sys
+import copy
 import unicodedata
-import requests
+import importlib
+import importlib.util
 import json
 import csv
 import re
 import io
+import zlib
 import random
-import numpy
 import math
-import pandas as pd
 import logging
+import threading
+import mmap
+import struct
+import bisect
+import heapq
+import itertools
+import hashlib
+import sqlite3
+import gzip
+import time
+import datetime
+import functools
+import inspect
+import contextvars
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
-from flask import request
-from flask import Response
-from flask import Flask
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+class _LazyModule:
+    """初めて属性を参照した時に読み込むモジュール
+
+    requests・numpy・pandas・Flaskの読み込みには合わせて0.5秒程度かかるため、
+    使わない処理(検索のみのcron等)では読み込まないようにする。
+    """
+
+    def __init__(self, name, *submodules):
+        self._name = name
+        self._submodules = submodules
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            module = importlib.import_module(self._name)
+            for submodule in self._submodules:
+                importlib.import_module(submodule)
+            self._module = module
+        return getattr(self._module, attr)
+
+
+def _optional_module(name, *submodules):
+    """インストールされていれば_LazyModule、無ければNone"""
+    return _LazyModule(name, *submodules) if importlib.util.find_spec(name) is not None else None
+
+
+# 上流APIへの通信(ダウンロード時のみ)
+requests = _LazyModule('requests', 'requests.adapters')
+# 出力・索引の数値処理
+numpy = _LazyModule('numpy')
+# merge_data・列指向キャッシュ(load_table)でのみ使用
+pd = _LazyModule('pandas')
+# Webサーバー用のメソッド(response・mimetype・cached_response等)でのみ使用
+flask = _LazyModule('flask')
+
+# プロセス間のロックに使用(Windowsではスレッド間のロックのみ)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# (オプション) 列指向キャッシュをFeather形式で保存する場合に使用
+pyarrow = _optional_module('pyarrow', 'pyarrow.feather')
+
+# (オプション) tmp/のページをzstdで圧縮する場合に使用(未インストール時はgzip)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# (オプション) JSON出力の高速化に使用
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # ロギング設定
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def _is_frame(data):
+    """pandasのDataFrameか否か(pandasが未読み込みであればDataFrameではないため読み込まない)"""
+    pandas = sys.modules.get('pandas')
+    return pandas is not None and isinstance(data, pandas.DataFrame)
+
+
+def _part_path(path):
+    """書き込み途中のファイル名(スレッド・プロセスごとに異なる)"""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+
+
+def _shutdown_executor(executor, futures):
+    """未開始のfuturesを取り消してからexecutorを終了する(実行中のものは終わるまで待つ)
+
+    shutdownのcancel_futuresはPython 3.9以上のため使わない。
+    """
+    for future in futures:
+        future.cancel()
+    executor.shutdown()
+
+
+# 呼び出し元(非同期版のensure_cached)でヒット・ミスを記録済みか(_ensure_cachedで重複して記録しない)
+_cache_accounted = contextvars.ContextVar('cache_accounted', default=False)
+
+
+# statsDataIdごとのスレッド間ロック(statsDataId→[ロック, 使用中・待機中のスレッド数]、使われなくなると削除)
+_flight_locks = {}
+_flight_locks_lock = threading.Lock()
+
+
+def _lock_file(path):
+    """pathのファイルを作成してflockで排他的にロックし、開いたファイルを返す
+
+    ロックを待つ間に他のプロセスがファイルを削除した場合は、作り直したファイルでロックし直す。
+    """
+    while True:
+        f = open(path, 'a')
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            st = None
+        fst = os.fstat(f.fileno())
+        if st is not None and (st.st_dev, st.st_ino) == (fst.st_dev, fst.st_ino):
+            return f
+        f.close()
+
+
+def _unlock_file(path, f):
+    """_lock_fileのロックを解放してファイルを削除(ロックしたまま削除するため、待っている側は作り直す)"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    fcntl.flock(f, fcntl.LOCK_UN)
+    f.close()
+
+
+def _intersect_sorted(lists):
+    """昇順に並んだ整数列の共通部分(短い列から順に二分探索で確認)"""
+    lists = sorted(lists, key=len)
+    if not lists:
+        return []
+    candidates = list(lists[0])
+    for other in lists[1:]:
+        kept = []
+        for c in candidates:
+            i = bisect.bisect_left(other, c)
+            if i < len(other) and other[i] == c:
+                kept.append(c)
+        candidates = kept
+        if not candidates:
+            break
+    return candidates
+
+
+def _iter_json_array(f, key, chunk_size=1 << 20):
+    """JSONファイルから指定したキーの配列の要素を1つずつ読み込む(全体は読み込まない)
+
+    キーの値が配列でなくオブジェクトの場合はそのオブジェクトだけを返す。
+    キーが見つからない場合はKeyErrorを送出する。
+    """
+    decoder = json.JSONDecoder()
+    pattern = re.compile(r'"' + re.escape(key) + r'"\s*:\s*')
+    buf = ''
+    while True:
+        m = pattern.search(buf)
+        if m and m.end() < len(buf):
+            buf = buf[m.end():]
+            break
+        chunk = f.read(chunk_size)
+        if not chunk:
+            raise KeyError(key)
+        # キーがチャンクの境界をまたぐ場合に備えて末尾を残す
+        buf = buf[-(len(key) + 16):] + chunk if not m else buf + chunk
+
+    pos = 0
+    in_array = None
+    while True:
+        while pos < len(buf) and buf[pos] in ' \t\r\n,':
+            pos += 1
+        if pos == len(buf):
+            chunk = f.read(chunk_size)
+            if not chunk:
+                raise ValueError(f"Unexpected end of JSON in {key}")
+            buf, pos = buf[pos:] + chunk, 0
+            continue
+        if in_array is None:
+            in_array = buf[pos] == '['
+            if in_array:
+                pos += 1
+            continue
+        if buf[pos] == ']':
+            return
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            # 要素が読み込んだ範囲に収まっていない
+            chunk = f.read(chunk_size)
+            if not chunk:
+                raise
+            buf, pos = buf[pos:] + chunk, 0
+            continue
+        yield obj
+        if not in_array:
+            return
+        pos = end
+        if pos > chunk_size:
+            buf, pos = buf[pos:], 0
+
+
+def _normalize_n_gram_text(text):
+    text = unicodedata.normalize('NFKC', text)
+    return re.sub(r'[\s\(\)\-,\[\]]', '', text).replace('・', '')
+
+
+def _n_grams(text, gram):
+    text = _normalize_n_gram_text(text)
+    return [text[i:i+gram] for i in range(len(text)) if i+gram <= len(text)]
+
+
+def _detail_texts(j):
+    """TABLE_INFの1件から詳細インデックスの対象(STATISTICS_NAME, TITLE)の文字列を取得"""
+    STATISTICS_NAME = j.get('STATISTICS_NAME')
+    TITLE = j.get('TITLE')
+    TITLE = TITLE.get('$') if isinstance(TITLE, dict) else None
+    return [t if isinstance(t, str) else '' for t in [STATISTICS_NAME, TITLE]]
+
+
+def _detail_postings(gram, start, texts):
+    """統計表の一部(文書番号start以降)のn-gram→ポスティングを作成(ワーカープロセスで実行)"""
+    postings = {}
+    for doc, fields in enumerate(texts, start):
+        for field_no, text in enumerate(fields):
+            for g in set(_n_grams(text, gram)):
+                postings.setdefault(g, array('I')).append(doc * len(fields) + field_no)
+    return postings
+
+
+def _timed(name, labels=None, **params):
+    """メソッドの所要時間をself.metricsに記録するデコレーター
+
+    labels: 固定のラベル, params: ラベル名→ラベルの値とする引数名
+    """
+    def decorator(f):
+        sig = inspect.signature(f)
+
+        @functools.wraps(f)
+        def wrapper(self, *args, **kwargs):
+            values = dict(labels or {})
+            if params:
+                bound = sig.bind(self, *args, **kwargs)
+                bound.apply_defaults()
+                values.update({k: bound.arguments[v] for k, v in params.items()})
+            with self.metrics.timer(name, **values):
+                return f(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# リクエストごとの計測結果(Server-Timing用、スレッド・asyncioのタスクごとに独立)
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+class Metrics:
+    """処理ごとの件数(カウンター)と所要時間(ヒストグラム)
+
+    render()でPrometheusのテキスト形式に出力する。timer/observeで計測した時間は
+    start_requestで開始したリクエストにも記録され、server_timing()で取得できる。
+    """
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, prefix='estat'):
+        self.prefix = prefix
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            h = self._histograms.get(key)
+            if h is None:
+                # 各バケットの累積件数, 合計, 件数
+                h = self._histograms[key] = [0] * len(self.BUCKETS) + [0.0, 0]
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    h[i] += 1
+            h[-2] += seconds
+            h[-1] += 1
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.append((name, seconds))
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def start_request(self):
+        _request_timings.set([])
+
+    def server_timing(self):
+        """現在のリクエストの処理ごとの合計時間(Server-Timingヘッダーの値)"""
+        totals = OrderedDict()
+        for name, seconds in _request_timings.get() or []:
+            name = name[:-len('_seconds')] if name.endswith('_seconds') else name
+            totals[name] = totals.get(name, 0) + seconds
+        return ', '.join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in totals.items())
+
+    def _sample(self, name, labels, value):
+        if labels:
+            text = ','.join('{}="{}"'.format(
+                k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                for k, v in labels)
+            return f"{self.prefix}_{name}{{{text}}} {value}"
+        return f"{self.prefix}_{name} {value}"
+
+    def render(self, gauges=None):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((k, list(v)) for k, v in self._histograms.items())
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {self.prefix}_{name} counter")
+            lines.append(self._sample(name, labels, value))
+        for (name, labels), h in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {self.prefix}_{name} histogram")
+            for bound, count in zip(self.BUCKETS, h):
+                lines.append(self._sample(name + '_bucket', labels + (('le', bound),), count))
+            lines.append(self._sample(name + '_bucket', labels + (('le', '+Inf'),), h[-1]))
+            lines.append(self._sample(name + '_sum', labels, h[-2]))
+            lines.append(self._sample(name + '_count', labels, h[-1]))
+        for name, value in (gauges or {}).items():
+            lines.append(f"# TYPE {self.prefix}_{name} gauge")
+            lines.append(self._sample(name, (), value))
+        return '\n'.join(lines) + '\n'
+
+
+class _PostingFile:
+    """uint32の配列を持つ索引ファイル(NgramIndex/DimensionIndex)の読み書き
+
+    ファイル構成: マジック(8byte) + ヘッダー長(uint64) + JSONヘッダー
+    + 4byte境界のuint32配列(リトルエンディアン)。
+    サブクラスはMAGIC・KIND(エラーメッセージ用の名前)・_loaded・_lockを定義する。
+    """
+
+    MAGIC = None
+    KIND = 'index'
+    # 同時に開いておく索引の数(0で無制限)
+    MAX_LOADED = 0
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:8] != self.MAGIC:
+            raise ValueError(f"Not {self.KIND} file: {path}")
+        header_len = struct.unpack('<Q', self._mm[8:16])[0]
+        self.header = json.loads(self._mm[16:16 + header_len].decode('utf-8'))
+        base = 16 + header_len
+        base += -base % 4
+        if sys.byteorder == 'little':
+            self._postings = memoryview(self._mm)[base:].cast('I')
+        else:
+            self._postings = array('I', self._mm[base:])
+            self._postings.byteswap()
+
+    @classmethod
+    def load(cls, path):
+        """プロセス内で一度だけ読み込む(ファイルが更新された場合は再読み込み)"""
+        with cls._lock:
+            index = cls._loaded.get(path)
+            if index is None or index.mtime != os.path.getmtime(path):
+                index = cls._loaded[path] = cls(path)
+            cls._loaded.move_to_end(path)
+            while cls.MAX_LOADED and len(cls._loaded) > cls.MAX_LOADED:
+                cls._loaded.popitem(last=False)
+            return index
+
+    @classmethod
+    def _write_file(cls, path, header, arrays):
+        """header: JSONヘッダー, arrays: 順に書き込むarray('I')"""
+        header = json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        part_path = _part_path(path)
+        with open(part_path, 'wb') as f:
+            f.write(cls.MAGIC)
+            f.write(struct.pack('<Q', len(header)))
+            f.write(header)
+            f.write(b'\0' * (-(16 + len(header)) % 4))
+            for values in arrays:
+                if sys.byteorder != 'little':
+                    values = array('I', values)
+                    values.byteswap()
+                values.tofile(f)
+        os.replace(part_path, path)
+
+
+class NgramIndex(_PostingFile):
+    """n-gram→statsDataIdのポスティングリストを持つ転置インデックス
+
+    JSONヘッダーはids/fields/terms(_PostingFileを参照)。
+    ポスティングの各要素は「文書番号 * フィールド数 + フィールド番号」で昇順に並ぶ。
+    """
+
+    MAGIC = b'ESTATNG1'
+    KIND = 'an n-gram index'
+    _loaded = OrderedDict()
+    _lock = threading.Lock()
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.gram = self.header['gram']
+        self.ids = self.header['ids']
+        self.fields = self.header['fields']
+        self.terms = self.header['terms']
+        self._lengths = None
+        self._rows = None
+
+    @classmethod
+    def write(cls, path, gram, ids, fields, postings):
+        """ids: statsDataIdのリスト, postings: {n-gram: array('I')}"""
+        terms = {}
+        offset = 0
+        for term in sorted(postings):
+            terms[term] = [offset, len(postings[term])]
+            offset += len(postings[term])
+        cls._write_file(path, {'gram': gram, 'ids': ids, 'fields': fields, 'terms': terms},
+                        (postings[term] for term in sorted(postings)))
+
+    def posting(self, term):
+        if term not in self.terms:
+            return self._postings[0:0]
+        offset, count = self.terms[term]
+        return self._postings[offset:offset + count]
+
+    def search(self, grams):
+        """全てのn-gramを含む(文書番号, フィールド番号)を昇順で返す"""
+        if not grams:
+            return []
+        if any(len(g) < self.gram for g in grams):
+            # n-gramより短いクエリは、その文字列を含む全n-gramの和集合
+            hits = set()
+            for g in grams:
+                for term in self.terms:
+                    if g in term:
+                        hits.update(self.posting(term))
+            candidates = sorted(hits)
+        else:
+            candidates = _intersect_sorted([self.posting(g) for g in set(grams)])
+        n_fields = len(self.fields)
+        return [divmod(c, n_fields) for c in candidates]
+
+    def expand(self, g):
+        """検索語のn-gramに対応するインデックスのn-gram(n-gramより短い場合はそれを含む全n-gram)"""
+        if len(g) >= self.gram:
+            return [g] if g in self.terms else []
+        return [term for term in self.terms if g in term]
+
+    def field_lengths(self):
+        """(文書番号 * フィールド数 + フィールド番号)ごとのn-gramの種類数と、フィールドごとの平均(初回のみ集計)"""
+        with self._lock:
+            if self._lengths is None:
+                n_fields = len(self.fields)
+                counts = numpy.bincount(numpy.asarray(self._postings, dtype=numpy.uint32),
+                                        minlength=len(self.ids) * n_fields)
+                averages = counts.reshape(-1, n_fields).mean(axis=0) if len(self.ids) else numpy.ones(n_fields)
+                self._lengths = (counts, numpy.maximum(averages, 1.0))
+            return self._lengths
+
+    def rows_in(self, lines):
+        """文書番号→LineIndexの行番号の配列と、LineIndexに無い統計表(行数以降の番号を割り当てる)のリスト"""
+        key = (lines.path, lines.mtime)
+        with self._lock:
+            if self._rows is None or self._rows[0] != key:
+                rows = numpy.empty(len(self.ids), dtype=numpy.int64)
+                extra = []
+                for doc, sid in enumerate(self.ids):
+                    r = lines.row_of(sid)
+                    if r is None:
+                        r = len(lines.lines) + len(extra)
+                        extra.append(sid)
+                    rows[doc] = r
+                self._rows = (key, rows, extra)
+            return self._rows[1], self._rows[2]
+
+
+class InvalidSelection(ValueError):
+    """絞り込み条件・列・集約方法等、リクエストの引数の誤り(Web APIでは400を返す)"""
+
+
+class DimensionIndex(_PostingFile):
+    """統計表の次元(キー行の列)ごとのコード→行番号の索引
+
+    JSONヘッダーはrows/dims/names(_PostingFileを参照)で、uint32の配列は行番号。
+    dims: {キー: {コード: [開始位置, 件数]}}、names: {キー: {名称: [コード, ...]}}
+    行番号は0始まり(キャッシュCSVの3行目が0)で、コードごとに昇順に並ぶ。
+    """
+
+    MAGIC = b'ESTATDM1'
+    KIND = 'a dimension index'
+    MAX_LOADED = 64
+    _loaded = OrderedDict()
+    _lock = threading.Lock()
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.rows = self.header['rows']
+        self.dims = self.header['dims']
+        self.names = self.header['names']
+        self._postings = numpy.frombuffer(self._postings, dtype=numpy.uint32)
+
+    @classmethod
+    def write(cls, path, rows, dims, names):
+        """dims: {キー: {コード: array('I')}}, names: {キー: {名称: [コード, ...]}}"""
+        layout = {}
+        offset = 0
+        for key, postings in dims.items():
+            layout[key] = {}
+            for code, values in postings.items():
+                layout[key][code] = [offset, len(values)]
+                offset += len(values)
+        cls._write_file(path, {'rows': rows, 'dims': layout, 'names': names},
+                        (values for postings in dims.values() for values in postings.values()))
+
+    def posting(self, key, value):
+        """コードまたは名称に一致する行番号(昇順)"""
+        terms = self.dims[key]
+        codes = [value] if value in terms else self.names.get(key, {}).get(value, [])
+        parts = [self._postings[o:o + n] for o, n in (terms[c] for c in codes if c in terms)]
+        if len(parts) == 1:
+            return parts[0]
+        return numpy.sort(numpy.concatenate(parts)) if parts else self._postings[0:0]
+
+    def select(self, where):
+        """where: {キー: [コードまたは名称, ...]}(同じキーの値は和集合、キー間は共通部分)
+        索引に無いキーはInvalidSelectionを送出し、条件が無い場合はNoneを返す"""
+        for key in where:
+            if key not in self.dims:
+                raise InvalidSelection(f"Invalid filter key: {key}")
+        selected = None
+        for key, values in where.items():
+            if not values:
+                continue
+            parts = [self.posting(key, v) for v in values]
+            rows = parts[0] if len(parts) == 1 else numpy.unique(numpy.concatenate(parts))
+            selected = rows if selected is None else numpy.intersect1d(selected, rows, assume_unique=True)
+        return selected
+
+
+class LineIndex:
+    """インデックスファイル(1行1統計表)を列指向で保持する検索用構造
+
+    行は一度だけ読み込み、ファイルのmtimeが変わった場合のみ再読み込みする。
+    部分一致検索は1文字/2文字のn-gram→行番号のポスティングで候補を絞り、
+    候補行だけを実際の文字列で確認する。ポスティングはNgramIndexと同様に、昇順のn-gramの表と
+    1つのarray('I')(n-gramごとに行番号が昇順に並ぶ)への位置で持つ。
+    """
+
+    _loaded = {}
+    _lock = threading.Lock()
+
+    def __init__(self, path, header, parse):
+        stat = os.stat(path)
+        self.path = path
+        self.mtime = (stat.st_mtime_ns, stat.st_size)
+        with open(path, 'r', encoding='utf-8') as f:
+            self.lines = f.read().split('\n')
+        # 列指向のデータ(列名→値のリスト)
+        self.columns = {h: [] for h in header}
+        for line in self.lines:
+            values = parse(line) if line else []
+            for i, h in enumerate(header):
+                self.columns[h].append(values[i] if i < len(values) else '')
+        self._grams = None
+        self._rows = None
+        self._field_grams = {}
+
+    @classmethod
+    def load(cls, path, header, parse):
+        key = (path, tuple(header))
+        with cls._lock:
+            index = cls._loaded.get(key)
+            stat = os.stat(path)
+            if index is None or index.mtime != (stat.st_mtime_ns, stat.st_size):
+                index = cls._loaded[key] = cls(path, header, parse)
+            return index
+
+    @staticmethod
+    def _gram_key(g):
+        """1文字/2文字のn-gramを整数に変換(文字コード+1を22bitずつ並べる)"""
+        return (ord(g[0]) + 1) << 22 | (ord(g[1]) + 1 if len(g) > 1 else 0)
+
+    def _build_grams(self):
+        """(昇順のn-gramのキー, 各n-gramのポスティングの開始位置, ポスティング)"""
+        codes = numpy.frombuffer('\n'.join(self.lines).encode('utf-32-le'), dtype=numpy.uint32)
+        codes = codes.astype(numpy.uint64) + 1
+        newline = codes == ord('\n') + 1
+        # 各文字の行番号(改行の数)
+        rows = numpy.cumsum(newline, dtype=numpy.uint32)
+        pair = ~newline[:-1] & ~newline[1:]
+        keys = numpy.concatenate([codes[~newline] << 22, (codes[:-1] << 22 | codes[1:])[pair]])
+        rows = numpy.concatenate([rows[~newline], rows[:-1][pair]])
+        # n-gram・行番号の順に並べ、同じ行の重複を除く
+        order = numpy.lexsort((rows, keys))
+        keys = keys[order]
+        rows = rows[order]
+        keep = numpy.ones(len(keys), dtype=bool)
+        keep[1:] = (keys[1:] != keys[:-1]) | (rows[1:] != rows[:-1])
+        keys = keys[keep]
+        terms, starts = numpy.unique(keys, return_index=True)
+        offsets = array('I', starts.astype(numpy.uint32).tobytes())
+        offsets.append(len(keys))
+        return terms, offsets, memoryview(array('I', rows[keep].tobytes()))
+
+    def _posting(self, g):
+        terms, offsets, postings = self._grams
+        key = self._gram_key(g)
+        i = int(numpy.searchsorted(terms, key))
+        if i == len(terms) or terms[i] != key:
+            return postings[0:0]
+        return postings[offsets[i]:offsets[i + 1]]
+
+    def find(self, q):
+        """qを含む行の番号(0始まり)を昇順で返す"""
+        with self._lock:
+            if self._grams is None:
+                self._grams = self._build_grams()
+        keys = [q] if len(q) == 1 else {q[j:j + 2] for j in range(len(q) - 1)}
+        candidates = _intersect_sorted([self._posting(g) for g in keys])
+        if len(q) <= 2:
+            return candidates
+        return [c for c in candidates if q in self.lines[c]]
+
+    def match(self, rows, filters):
+        """列ごとの部分一致条件(列名→文字列)で行番号を絞り込む"""
+        for name, value in filters.items():
+            if name not in self.columns:
+                raise ValueError(f"Unknown search field: {name}")
+            column = self.columns[name]
+            rows = [r for r in rows if value in column[r]]
+        return rows
+
+    def row_of(self, key):
+        """先頭列(statsDataId等)の値から行番号を取得(無ければNone)"""
+        with self._lock:
+            if self._rows is None:
+                first = next(iter(self.columns.values()))
+                self._rows = {v: r for r, v in enumerate(first) if v}
+        return self._rows.get(key)
+
+    def field_grams(self, name, gram):
+        """列の値(正規化済み)のn-gram→行番号(出現ごと)と、行ごとのn-gram数・その平均(初回のみ作成)"""
+        key = (name, gram)
+        with self._lock:
+            if key not in self._field_grams:
+                postings = {}
+                lengths = array('I')
+                for r, value in enumerate(self.columns[name]):
+                    grams = _n_grams(value, gram) if value else []
+                    lengths.append(len(grams))
+                    for g in grams:
+                        p = postings.get(g)
+                        if p is None:
+                            p = postings[g] = array('I')
+                        p.append(r)
+                average = max(sum(lengths) / len(lengths), 1.0) if lengths else 1.0
+                self._field_grams[key] = (postings, numpy.asarray(lengths, dtype=numpy.float64), average)
+            return self._field_grams[key]
+
+
+class ResponseCache:
+    """サイズ上限付きのLRUレスポンスキャッシュ
+
+    キーにはルート・引数・元ファイルのmtimeを含めるため、ファイルが書き換わると
+    古いエントリは参照されなくなる。tagsを指定したエントリはinvalidateで明示的に削除できる。
+    1件の大きさがmax_entry_bytes(省略時はmax_bytesの1/8)を超えるレスポンスは登録しない。
+    """
+
+    def __init__(self, max_bytes, max_entry_bytes=None):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_bytes // 8 if max_entry_bytes is None else min(max_entry_bytes, max_bytes)
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, body, tags=()):
+        if len(body) > self.max_entry_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.size -= len(self._entries.pop(key)[0])
+            self._entries[key] = (body, set(tags))
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (old, _) = self._entries.popitem(last=False)
+                self.size -= len(old)
+
+    def invalidate(self, tag):
+        with self._lock:
+            for key in [k for k, (_, tags) in self._entries.items() if tag in tags]:
+                self.size -= len(self._entries.pop(key)[0])
+
+
+class DataCache:
+    """data-cache/の統計表ごとのサイズ・作成日時・最終アクセス・ヒット数の記録
+
+    記録はSQLiteに保存するため、同じディレクトリを使う複数のプロセスで共有される。
+    max_bytesを超えた場合はpolicy('lru'/'lfu')に従って削除する統計表を選ぶ。
+    直近grace秒以内にアクセスされた統計表は読み込み中の可能性があるため削除しない。
+    アクセス(touch)はメモリーに溜め、容量の上限がある場合のみflush_interval秒ごとにまとめて書き込む
+    (上限が無い場合は統計(stats)の取得時のみ)。
+    """
+
+    POLICIES = {
+        'lru': 'last_access ASC',
+        'lfu': 'hits ASC, last_access ASC'
+    }
+
+    def __init__(self, db_path, max_bytes=0, policy='lru', ttl=0, grace=60, flush_interval=5):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Invalid cache policy: {policy}")
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.ttl = ttl
+        self.grace = grace
+        self.flush_interval = flush_interval
+        # 未反映のアクセス(statsDataId→[ヒット数, 最終アクセス])
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._flushed = time.monotonic()
+        self._schema = False
+
+    def _create_schema(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                conn.execute('CREATE TABLE IF NOT EXISTS tables ('
+                             'id TEXT PRIMARY KEY, size INTEGER, created REAL, '
+                             'last_access REAL, hits INTEGER)')
+                conn.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)')
+        finally:
+            conn.close()
+        self._schema = True
+
+    @contextmanager
+    def _connect(self):
+        # テーブルの作成は初回のみ(data-cache/ごと削除された場合は作り直す)
+        if not self._schema or not os.path.exists(self.db_path):
+            self._create_schema()
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _count(self, conn, name, n=1):
+        conn.execute('INSERT INTO counters VALUES (?, ?) '
+                     'ON CONFLICT(name) DO UPDATE SET value = value + ?', (name, n, n))
+
+    def record(self, sid, size, created=None):
+        """作成(ダウンロード・変換)した統計表を記録"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO tables VALUES (?, ?, ?, ?, 0)',
+                         (sid, size, now if created is None else created, now))
+            if created is None:
+                self._count(conn, 'misses')
+
+    def touch(self, sid):
+        now = time.time()
+        with self._pending_lock:
+            entry = self._pending.setdefault(sid, [0, now])
+            entry[0] += 1
+            entry[1] = now
+            due = self.max_bytes > 0 and time.monotonic() - self._flushed >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        """メモリーに溜めたアクセスを書き込む"""
+        with self._pending_lock:
+            pending, self._pending = self._pending, {}
+            self._flushed = time.monotonic()
+        if not pending:
+            return
+        with self._connect() as conn:
+            conn.executemany('UPDATE tables SET hits = hits + ?, last_access = MAX(last_access, ?) WHERE id = ?',
+                             [(hits, last, sid) for sid, (hits, last) in pending.items()])
+            self._count(conn, 'hits', sum(hits for hits, _ in pending.values()))
+
+    def expired(self, sid, updated_at=None):
+        """作成からttl秒を過ぎたか、作成後に上流で更新された(updated_at: UNIX時間)場合はTrue"""
+        if self.ttl <= 0 and updated_at is None:
+            return False
+        with self._connect() as conn:
+            row = conn.execute('SELECT created FROM tables WHERE id = ?', (sid,)).fetchone()
+        if row is None:
+            return False
+        created = row[0]
+        if self.ttl > 0 and time.time() - created > self.ttl:
+            return True
+        return updated_at is not None and created < updated_at
+
+    def remove(self, sid, reason='evictions'):
+        with self._connect() as conn:
+            if conn.execute('DELETE FROM tables WHERE id = ?', (sid,)).rowcount:
+                self._count(conn, reason)
+
+    def sync(self, sizes):
+        """ディスク上の統計表(statsDataId→サイズ)と記録を一致させる(記録の無いものは作成日時をmtimeとする)"""
+        with self._connect() as conn:
+            known = {sid for (sid,) in conn.execute('SELECT id FROM tables')}
+            for sid in known - set(sizes):
+                conn.execute('DELETE FROM tables WHERE id = ?', (sid,))
+            for sid, (size, mtime) in sizes.items():
+                if sid in known:
+                    conn.execute('UPDATE tables SET size = ? WHERE id = ?', (size, sid))
+                else:
+                    # 他のプロセスが同時に記録した場合はそちらを残す
+                    conn.execute('INSERT OR IGNORE INTO tables VALUES (?, ?, ?, ?, 0)', (sid, size, mtime, mtime))
+
+    def victims(self, keep=()):
+        """容量の上限に収めるために削除する統計表(keepは除く)"""
+        if self.max_bytes <= 0:
+            return []
+        self.flush()
+        with self._connect() as conn:
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM tables').fetchone()[0]
+            rows = conn.execute('SELECT id, size, last_access FROM tables ORDER BY ' +
+                                self.POLICIES[self.policy]).fetchall()
+        victims = []
+        recent = time.time() - self.grace
+        for sid, size, last_access in rows:
+            if total <= self.max_bytes:
+                break
+            if sid in keep or last_access > recent:
+                continue
+            victims.append(sid)
+            total -= size
+        return victims
+
+    def totals(self):
+        """(統計表の数, 合計サイズ)"""
+        with self._connect() as conn:
+            return conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM tables').fetchone()
+
+    def stats(self):
+        self.flush()
+        with self._connect() as conn:
+            tables = [dict(zip(['id', 'size', 'created', 'last_access', 'hits'], row))
+                      for row in conn.execute('SELECT id, size, created, last_access, hits FROM tables '
+                                              'ORDER BY last_access DESC')]
+            counters = dict(conn.execute('SELECT name, value FROM counters'))
+        return {
+            'entries': len(tables),
+            'bytes': sum(t['size'] for t in tables),
+            'max_bytes': self.max_bytes,
+            'policy': self.policy,
+            'ttl': self.ttl,
+            'hits': counters.get('hits', 0),
+            'misses': counters.get('misses', 0),
+            'evictions': counters.get('evictions', 0),
+            'expirations': counters.get('expirations', 0),
+            'tables': tables
+        }
+
+
+class JobQueue:
+    """data-cache/に事前に作成する統計表のジョブキュー
+
+    SQLiteに保存するため、プロセスを再起動しても残り、同じディレクトリを使う複数のプロセスで共有される。
+    同じ統計表のジョブは1つにまとめ(優先度は高い方を使う)、優先度の高い順・登録の古い順に取り出す。
+    状態: queued(待機中)・running(実行中)・done(完了)・failed(max_attempts回失敗)
+    timeout秒を過ぎても終わらない実行中のジョブは、ワーカーが停止したものとして待機中に戻す。
+    """
+
+    COLUMNS = ['id', 'priority', 'status', 'attempts', 'error', 'queued', 'started', 'finished']
+
+    def __init__(self, db_path, max_attempts=3, timeout=3600):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute('CREATE TABLE IF NOT EXISTS jobs ('
+                         'id TEXT PRIMARY KEY, priority INTEGER, status TEXT, attempts INTEGER, '
+                         'error TEXT, queued REAL, started REAL, finished REAL)')
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def add(self, ids, priority=0):
+        """ジョブを登録し、(登録・優先度を上げたID, 既に待機中・実行中のID)を返す"""
+        added, duplicate = [], []
+        now = time.time()
+        with self._connect() as conn:
+            for sid in ids:
+                row = conn.execute('SELECT status, priority FROM jobs WHERE id = ?', (sid,)).fetchone()
+                if row is None or row[0] in ('done', 'failed'):
+                    conn.execute('INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, 0, NULL, ?, NULL, NULL)',
+                                 (sid, priority, 'queued', now))
+                    added.append(sid)
+                elif row[0] == 'queued' and priority > row[1]:
+                    conn.execute('UPDATE jobs SET priority = ? WHERE id = ?', (priority, sid))
+                    added.append(sid)
+                else:
+                    duplicate.append(sid)
+        return added, duplicate
+
+    def claim(self):
+        """待機中のジョブを1つ実行中にしてそのIDを返す(無ければNone)"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running' AND started < ?",
+                         (now - self.timeout,))
+            while True:
+                row = conn.execute("SELECT id FROM jobs WHERE status = 'queued' "
+                                   'ORDER BY priority DESC, queued ASC LIMIT 1').fetchone()
+                if row is None:
+                    return None
+                # 他のプロセスが先に取り出した場合は次のジョブを探す
+                if conn.execute("UPDATE jobs SET status = 'running', started = ?, attempts = attempts + 1 "
+                                "WHERE id = ? AND status = 'queued'", (now, row[0])).rowcount:
+                    return row[0]
+
+    def finish(self, sid, error=None):
+        """実行結果を記録(失敗した場合はmax_attempts回まで待機中に戻す)"""
+        with self._connect() as conn:
+            if error is None:
+                conn.execute("UPDATE jobs SET status = 'done', error = NULL, finished = ? WHERE id = ?",
+                             (time.time(), sid))
+            else:
+                conn.execute("UPDATE jobs SET status = CASE WHEN attempts < ? THEN 'queued' ELSE 'failed' END, "
+                             'error = ?, finished = ? WHERE id = ?',
+                             (self.max_attempts, error, time.time(), sid))
+
+    def status(self, sid=None):
+        """ジョブの一覧(sidを指定した場合はそのジョブ、無ければNone)"""
+        with self._connect() as conn:
+            if sid is not None:
+                row = conn.execute('SELECT * FROM jobs WHERE id = ?', (sid,)).fetchone()
+                return dict(zip(self.COLUMNS, row)) if row else None
+            rows = conn.execute('SELECT * FROM jobs ORDER BY priority DESC, queued ASC').fetchall()
+        return [dict(zip(self.COLUMNS, row)) for row in rows]
+
+    def counts(self):
+        """状態ごとのジョブ数"""
+        with self._connect() as conn:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status'))
+        return {s: counts.get(s, 0) for s in ('queued', 'running', 'done', 'failed')}
+
+    def clear(self, statuses=('done', 'failed')):
+        """終了したジョブの記録を削除"""
+        with self._connect() as conn:
+            return conn.execute('DELETE FROM jobs WHERE status IN (%s)' % ','.join('?' * len(statuses)),
+                                tuple(statuses)).rowcount
+
+
+class UpstreamUnavailable(Exception):
+    """サーキットブレーカーが開いている(上流APIが停止中とみなしている)間のリクエストで送出"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"e-Stat API is unavailable, retry after {retry_after:.0f} seconds")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """appIdごとのリクエスト数の制限(トークンバケット)
+
+    rate: 1秒あたりのリクエスト数(0で制限無し), burst: 続けて送信できるリクエスト数。
+    上流から429が返された場合はrateを半分に下げ(min_rateまで)、成功するたびに元のrateへ少しずつ戻す。
+    """
+
+    def __init__(self, rate, burst, min_rate=0.1):
+        self.max_rate = self.rate = rate
+        self.burst = max(burst, 1)
+        self.min_rate = min(min_rate, rate)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """トークンを1つ予約し、送信までに待つ秒数を返す(不足分は後のリクエストほど長く待つ)"""
+        if self.max_rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def throttle(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0)
+
+    def recover(self):
+        if self.rate < self.max_rate:
+            with self._lock:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class CircuitBreaker:
+    """上流APIへの接続の失敗がthreshold回続いたら、cooldown秒の間はリクエストを送らずに失敗させる
+
+    cooldown後は1件だけ試行し、成功すれば閉じ、失敗すれば再びcooldown秒開く(threshold 0で無効)。
+    試行が結果を記録せずに終わった場合(中断等)はabortで解放する。解放されない試行もcooldown秒で放棄したとみなす。
+    """
+
+    def __init__(self, threshold=5, cooldown=30):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened = None
+        # 半開状態の試行を開始した時刻
+        self.trial = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened is not None
+
+    def check(self):
+        """送信してよいか確認し、半開状態の試行ならTrueを返す(開いている間はUpstreamUnavailableを送出)"""
+        with self._lock:
+            if self.opened is None:
+                return False
+            now = time.monotonic()
+            remaining = self.opened + self.cooldown - now
+            if remaining > 0 or (self.trial is not None and now - self.trial < self.cooldown):
+                raise UpstreamUnavailable(max(remaining, 1))
+            self.trial = now
+            return True
+
+    def abort(self):
+        """結果を記録せずに終わった試行を解放(次のリクエストが試行になる)"""
+        with self._lock:
+            self.trial = None
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened = None
+            self.trial = None
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.threshold > 0 and (self.trial is not None or self.failures >= self.threshold):
+                if self.opened is None or self.trial is not None:
+                    logger.warning(f"Circuit breaker opened after {self.failures} failures")
+                self.opened = time.monotonic()
+            self.trial = None
+
+
+class UpstreamClient:
+    """上流API(e-Stat)へのリクエストの送信
+
+    appIdごとのトークンバケットで流量を制限し、接続の失敗・429・5xxはジッター付きの指数バックオフで
+    retries回まで再試行する(Retry-Afterがあればその秒数)。接続の失敗と5xxはサーキットブレーカーで数える。
+    for_appで作成した複製や非同期版とも共有する(非同期版はreserve/outcomeで待ち時間を受け取る)。
+    """
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, metrics, rate=10, burst=20, retries=4, backoff=0.5, backoff_max=30,
+                 threshold=5, cooldown=30):
+        self.metrics = metrics
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.breaker = CircuitBreaker(threshold, cooldown)
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, appId):
+        with self._lock:
+            bucket = self._buckets.get(appId)
+            if bucket is None:
+                bucket = self._buckets[appId] = TokenBucket(self.rate, self.burst)
+            return bucket
+
+    def reserve(self, appId, api):
+        """(送信までに待つ秒数, サーキットブレーカーの試行か否か)を返す(開いている場合はUpstreamUnavailableを送出)
+
+        試行の場合、outcomeを呼ばずに終わるとき(中断等)はbreaker.abort()で解放すること。
+        """
+        try:
+            trial = self.breaker.check()
+        except UpstreamUnavailable:
+            self.metrics.inc('upstream_rejected_total', api=api)
+            raise
+        wait = self.bucket(appId).reserve()
+        if wait > 0:
+            self.metrics.observe('upstream_throttle_seconds', wait, api=api)
+        return wait, trial
+
+    def _retry_after(self, value):
+        try:
+            return min(float(value), self.backoff_max)
+        except (TypeError, ValueError):
+            return None
+
+    def outcome(self, appId, api, attempt, status=None, retry_after=None):
+        """応答(statusがNoneの場合は接続の失敗)を記録し、再試行までに待つ秒数(再試行しない場合はNone)を返す"""
+        if status is not None and status not in self.RETRY_STATUSES:
+            self.breaker.success()
+            if status < 400:
+                self.bucket(appId).recover()
+            return None
+        if status == 429:
+            # 上流は応答しているため、流量だけを下げる
+            self.breaker.success()
+            self.bucket(appId).throttle()
+        else:
+            self.breaker.failure()
+        if attempt >= self.retries or self.breaker.is_open:
+            return None
+        self.metrics.inc('upstream_retries_total', api=api, reason=status or 'error')
+        delay = self._retry_after(retry_after)
+        if delay is None:
+            delay = random.uniform(0, min(self.backoff_max, self.backoff * 2 ** attempt))
+        logger.warning(f"Retrying {api} in {delay:.1f}s (attempt {attempt + 1}/{self.retries}, "
+                       f"status: {status or 'connection error'})")
+        return delay
+
+    def get(self, session, uri, appId, api, timeout, **kwargs):
+        """GETを送信し、成功した応答を返す(再試行しても失敗した場合は最後の例外を送出)"""
+        attempt = 0
+        while True:
+            wait, trial = self.reserve(appId, api)
+            try:
+                if wait > 0:
+                    time.sleep(wait)
+                with self.metrics.timer('upstream_request_seconds', api=api):
+                    response = session.get(uri, timeout=timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError):
+                delay = self.outcome(appId, api, attempt)
+                if delay is None:
+                    raise
+            except BaseException:
+                # リダイレクトの超過・中断等で結果を記録しない場合は試行を解放する
+                if trial:
+                    self.breaker.abort()
+                raise
+            else:
+                delay = self.outcome(appId, api, attempt, response.status_code,
+                                     response.headers.get('Retry-After'))
+                if delay is None:
+                    response.raise_for_status()
+                    return response
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+
 class e_Stat_API_Adaptor:
 
     def __init__(self, _):
@@ -55,6 +1238,14 @@ class e_Stat_API_Adaptor:
             'url-dictionary-stat-center': 'http://www.e-stat.go.jp/api/sample2/api-m/stat-center-index.csv',
             # 詳細(n-gram形式)
             'dictionary-detail': self._['directory'] + 'dictionary/detail/',
+            # 詳細(n-gram形式)の転置インデックス
+            'dictionary-detail-index': self._['directory'] + 'dictionary/detail.ngram.dic',
+            # data-cache/の統計表ごとのサイズ・アクセスの記録
+            'data-cache-db': self._['directory'] + 'data-cache/cache.sqlite',
+            # キャッシュを事前に作成するジョブのキュー
+            'job-queue-db': self._['directory'] + 'data-cache/jobs.sqlite',
+            # 差分更新の状態(前回の同期日と統計表ごとのUPDATED_DATE)
+            'sync-state': self._['directory'] + 'dictionary/sync.json.dic',
             # 公開ディレクトリ
             'http-public': '/'
         }
@@ -65,7 +1256,8 @@ class e_Stat_API_Adaptor:
             'api-error': 'API request failed'
         }
         self.url = {
-            'host': 'http://api.e-stat.go.jp',
+            # 'host'を指定するとAPIの接続先を変更できる(テスト用のスタブ等)
+            'host': self._.get('host', 'http://api.e-stat.go.jp'),
             'path': '/'.join([
                 'rest', self._['ver'], 'app', 'json', 'getStatsData'
             ])
@@ -75,10 +1267,66 @@ class e_Stat_API_Adaptor:
             'user': ['statsDataId', '検索語']
         }
         self.header = {'Access-Control-Allow-Origin': '*'}
+        # merge_dataで利用可能な集約方法
+        self.aggregates = ['sum', 'mean', 'min', 'max', 'median', 'count', 'var', 'std']
         self.random_str = 'ABCDEFGHIJKLMNOPQRTSUVWXYZabcdefghijklmnopqrstuvwxyz1234567890'
         self.cache = {}
         # N-グラムの設定
         self.gram = 2
+        # 順位付き検索(rank_tables)のBM25のパラメーターと項目ごとの重み(0で対象外)
+        self.rank_k1 = float(self._.get('rank_k1', 1.2))
+        self.rank_b = float(self._.get('rank_b', 0.75))
+        self.rank_weights = dict({'STATISTICS_NAME': 1.0, 'TITLE': 1.0, '調査名': 1.0,
+                                  '組織名': 0.5, 'カテゴリー': 0.5}, **self._.get('rank_weights', {}))
+        # CSVと併せて列指向のバイナリキャッシュを作成するか否か
+        # ('lazy'の場合は変換時には作成せず、load_table等で最初に使う時に作成する(pandasを読み込まないため))
+        self.columnar_cache = self._.get('columnar_cache', True)
+        # 詳細インデックス作成時のワーカープロセス数(1でプロセスを使用しない)と1回に渡す統計表の件数
+        self.index_workers = int(self._.get('index_workers', os.cpu_count() or 1))
+        self.index_chunk = int(self._.get('index_chunk', 2000))
+        # ストリーミング出力時に一度に変換する行数
+        self.chunk_rows = int(self._.get('chunk_rows', 10000))
+        # レスポンスキャッシュの上限(バイト数、0で無効)と1件の上限(省略時は全体の1/8)
+        entry_bytes = self._.get('response_cache_entry_bytes')
+        self.response_cache = ResponseCache(int(self._.get('response_cache_bytes', 64 * 1024 * 1024)),
+                                            None if entry_bytes is None else int(entry_bytes))
+        # data-cache/の容量の上限(バイト数、0で無制限)・削除方針('lru'/'lfu')・有効期間(秒、0で無期限)・
+        # 削除の対象外とする直近のアクセスからの秒数・アクセスの記録をまとめて書き込む間隔(秒)
+        self.data_cache = DataCache(self.path['data-cache-db'],
+                                    int(self._.get('cache_bytes', 0)),
+                                    self._.get('cache_policy', 'lru'),
+                                    float(self._.get('cache_ttl', 0)),
+                                    float(self._.get('cache_grace', 60)),
+                                    float(self._.get('cache_flush_interval', 5)))
+        # tmp/のページの圧縮形式('zstd'/'gzip'/'none')
+        self.page_compression = self._.get('page_compression', 'zstd' if zstandard else 'gzip')
+        # 変換後にページを保持する秒数(0で変換後すぐに削除)と保持するページの合計サイズの上限
+        self.page_retention = float(self._.get('page_retention', 0))
+        self.page_cache_bytes = int(self._.get('page_cache_bytes', 1024 * 1024 * 1024))
+        # ダウンロードに失敗した統計表の取得済みページを、再試行時に再利用する秒数
+        self.page_resume = float(self._.get('page_resume', 3600))
+        # ページの並列ダウンロード数
+        self.concurrency = int(self._.get('concurrency', 4))
+        # キャッシュを事前に作成するジョブのキュー(ワーカー数・1つのジョブの試行回数・実行中とみなす秒数)
+        self.job_workers = int(self._.get('job_workers', 2))
+        self.jobs = JobQueue(self.path['job-queue-db'],
+                             int(self._.get('job_attempts', 3)),
+                             float(self._.get('job_timeout', 3600)))
+        # 処理ごとの件数と所要時間('server_timing': TrueでレスポンスにServer-Timingヘッダーを付与)
+        self.metrics = Metrics()
+        # 上流APIへのリクエスト(appIdごとの1秒あたりのリクエスト数(0で制限無し)と続けて送信できる数、
+        # 失敗時の再試行回数とバックオフの初期値・上限(秒)、
+        # サーキットブレーカーが開く連続失敗回数(0で無効)と開いている秒数)
+        self.upstream = UpstreamClient(self.metrics,
+                                       float(self._.get('rate_limit', 10)),
+                                       int(self._.get('rate_burst', 20)),
+                                       int(self._.get('retries', 4)),
+                                       float(self._.get('retry_backoff', 0.5)),
+                                       float(self._.get('retry_backoff_max', 30)),
+                                       int(self._.get('breaker_threshold', 5)),
+                                       float(self._.get('breaker_cooldown', 30)))
+        # HTTPセッション(keep-alive/コネクションプール、for_appで作成した複製とも共有)
+        self._shared = {'session': None, 'lock': threading.Lock()}
 
         # ディレクトリの作成
         self._ensure_directories()
@@ -94,6 +1342,30 @@ class e_Stat_API_Adaptor:
         for directory in directories:
             Path(directory).mkdir(parents=True, exist_ok=True)
 
+    def _get_session(self):
+        """コネクションプール付きのrequests.Sessionを取得"""
+        with self._shared['lock']:
+            if self._shared['session'] is None:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_connections=self.concurrency,
+                                      pool_maxsize=self.concurrency)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._shared['session'] = session
+            return self._shared['session']
+
+    def _upstream_get(self, uri, api, timeout, **kwargs):
+        """流量制限・再試行・サーキットブレーカーを適用して上流APIへGETを送信"""
+        return self.upstream.get(self._get_session(), uri, self._['appId'], api, timeout, **kwargs)
+
+    # appIdや作業用のパス(self.cache)をリクエストごとに持つ複製を作成
+    # HTTPセッションやレスポンスキャッシュ等は元のインスタンスと共有する
+    def for_app(self, appId):
+        adaptor = copy.copy(self)
+        adaptor._ = dict(self._, appId=appId)
+        adaptor.cache = {}
+        return adaptor
+
     def _validate_stats_id(self, stats_id):
         """統計IDの検証"""
         if not stats_id or not isinstance(stats_id, str):
@@ -121,11 +1393,20 @@ class e_Stat_API_Adaptor:
             }).replace('getStatsData', 'getStatsList')
 
             logger.info(f"Downloading all statistics IDs from: {load_uri}")
-            response = requests.get(load_uri, timeout=30)
-            response.raise_for_status()
-
-            with open(self.path['statid-json'], 'w', encoding='utf-8') as f:
-                json.dump(response.json(), f, ensure_ascii=False, indent=2)
+            # 数百MBになるため、メモリに展開せずにそのままファイルへ書き込む
+            part_path = _part_path(self.path['statid-json'])
+            try:
+                with self._upstream_get(load_uri, 'getStatsList', 30, stream=True) as response:
+                    with open(part_path, 'wb') as f:
+                        for chunk in response.iter_content(chunk_size=1 << 20):
+                            f.write(chunk)
+                            self.metrics.inc('upstream_bytes_total', len(chunk), api='getStatsList')
+                # エラー(appIdの誤り等)の場合は既存のall.json.dicを残す
+                self.check_statid_json(part_path)
+                os.replace(part_path, self.path['statid-json'])
+            finally:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
 
             logger.info(f"Successfully saved to: {self.path['statid-json']}")
             return True
@@ -136,43 +1417,115 @@ class e_Stat_API_Adaptor:
             logger.error(f"Unexpected error: {e}")
             raise
 
-    # ダウンロードした統計表からインデックスファイルを作成する
-    def build_statid_index(self):
-        try:
-            jd = self.load_json(
-                self.path['statid-json'])['GET_STATS_LIST']['DATALIST_INF']['TABLE_INF']
+    def _check_result(self, RESULT):
+        """APIのRESULTを確認(STATUSが100以上の場合はエラー。e-StatはHTTP 200でエラーを返す)"""
+        if int(RESULT.get('STATUS', 0)) >= 100:
+            raise RuntimeError(f"e-Stat API error {RESULT.get('STATUS')}: {RESULT.get('ERROR_MSG', '')}")
 
-            rows = []
-            for j in jd:
-                try:
-                    row = '-'.join([
-                        j['@id'],
-                        j['STAT_NAME']['$'],
-                        str(j['SURVEY_DATE']),
-                        j['GOV_ORG']['$'],
-                        j['MAIN_CATEGORY']['$'],
-                        j['SUB_CATEGORY']['$']
-                    ]) + '.dic'
-                    rows.append(row)
-                except KeyError as e:
-                    logger.warning(f"Missing key in data: {e}")
-                    continue
+    # getStatsListの結果を保存したファイルのRESULTを確認
+    def check_statid_json(self, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            self._check_result(next(_iter_json_array(f, 'RESULT')))
+
+    # all.json.dicのTABLE_INFを1件ずつ読み込む(メモリ使用量は統計表1件分)
+    def iter_table_inf(self, path=None):
+        path = self.path['statid-json'] if path is None else path
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from _iter_json_array(f, 'TABLE_INF')
 
-            with open(self.path['dictionary-index'], 'w', encoding='utf-8') as f:
-                f.write('\n'.join(rows))
+    # ダウンロードした統計表からインデックスファイルを作成する
+    def build_statid_index(self):
+        return self.build_indexes(detailed=False)
 
-            logger.info(f"Index created: {len(rows)} entries")
+    # all.json.dicを1回だけ走査してindex.list.dicとdetail.ngram.dicを作成する
+    # n-gramの作成は統計表をindex_chunk件ずつに分けてワーカープロセスで行い、順に結合する
+    # progress: 処理済みの統計表の件数を受け取る関数
+    def build_indexes(self, statid=True, detailed=True, workers=None, progress=None):
+        workers = self.index_workers if workers is None else int(workers)
+        try:
+            fields = ['STATISTICS_NAME', 'TITLE']
+            ids = []
+            postings = {}
+            n_rows = 0
+            n_done = 0
+            pending = deque()
+
+            def merge(partial, n):
+                nonlocal n_done
+                # チャンクは文書番号の順に結合するため、各ポスティングは昇順のまま
+                for g, values in partial.items():
+                    if g in postings:
+                        postings[g].extend(values)
+                    else:
+                        postings[g] = values
+                n_done += n
+                if progress is not None:
+                    progress(n_done)
+
+            if statid:
+                part_path = _part_path(self.path['dictionary-index'])
+                index_file = open(part_path, 'w', encoding='utf-8')
+            executor = ProcessPoolExecutor(max_workers=workers) if detailed and workers > 1 else None
+            try:
+                tables = self.iter_table_inf()
+                while True:
+                    chunk = list(itertools.islice(tables, self.index_chunk))
+                    if not chunk:
+                        break
+
+                    if statid:
+                        for j in chunk:
+                            try:
+                                row = self._index_line(j)
+                                index_file.write(('\n' if n_rows else '') + row)
+                                n_rows += 1
+                            except KeyError as e:
+                                logger.warning(f"Missing key in data: {e}")
+
+                    if not detailed:
+                        merge({}, len(chunk))
+                        continue
+                    texts = [_detail_texts(j) for j in chunk]
+                    if executor is None:
+                        merge(_detail_postings(self.gram, len(ids), texts), len(chunk))
+                    else:
+                        pending.append((executor.submit(_detail_postings, self.gram, len(ids), texts),
+                                        len(chunk)))
+                        # 未処理のチャンクはワーカー数の2倍までに抑える(メモリ使用量の上限)
+                        if len(pending) >= workers * 2:
+                            future, n = pending.popleft()
+                            merge(future.result(), n)
+                    ids.extend(j['@id'] for j in chunk)
+
+                while pending:
+                    future, n = pending.popleft()
+                    merge(future.result(), n)
+            finally:
+                if statid:
+                    index_file.close()
+                if executor is not None:
+                    # 失敗した場合は未開始のチャンクを取り消す
+                    _shutdown_executor(executor, [future for future, _ in pending])
+
+            if statid:
+                os.replace(part_path, self.path['dictionary-index'])
+                logger.info(f"Index created: {n_rows} entries")
+                self.response_cache.invalidate('search')
+            if detailed:
+                NgramIndex.write(self.path['dictionary-detail-index'], self.gram, ids, fields, postings)
+                logger.info(f"Detailed index built: {len(ids)} entries, {len(postings)} n-grams")
             return True
         except Exception as e:
             logger.error(f"Failed to build index: {e}")
+            if statid and 'part_path' in locals() and os.path.exists(part_path):
+                os.remove(part_path)
             raise
 
     # 統計センターが作成するindexのダウンロード用関数
     def load_stat_center_index(self):
         try:
             logger.info(f"Downloading stat center index from: {self.path['url-dictionary-stat-center']}")
-            response = requests.get(self.path['url-dictionary-stat-center'], timeout=30)
-            response.raise_for_status()
+            response = self._upstream_get(self.path['url-dictionary-stat-center'], 'stat-center-index', 30)
 
             with open(self.path['dictionary-stat-center'], 'wb') as f:
                 f.write(response.content)
@@ -183,48 +1536,388 @@ class e_Stat_API_Adaptor:
             logger.error(f"Failed to download stat center index: {e}")
             raise
 
+    # STATISTICS_NAMEとTITLEのn-gramから単一ファイルの転置インデックスを作成
     def build_detailed_index(self):
+        return self.build_indexes(statid=False)
+
+    def _index_line(self, j):
+        """TABLE_INFの1件からindex.list.dicの1行を作成(項目が無い場合はKeyError)"""
+        return '-'.join([
+            j['@id'],
+            j['STAT_NAME']['$'],
+            str(j['SURVEY_DATE']),
+            j['GOV_ORG']['$'],
+            j['MAIN_CATEGORY']['$'],
+            j['SUB_CATEGORY']['$']
+        ]) + '.dic'
+
+    def _detail_grams(self, j):
+        """TABLE_INFの1件からSTATISTICS_NAMEとTITLEのn-gramの集合を作成"""
+        return [set(_n_grams(text, self.gram)) for text in _detail_texts(j)]
+
+    def _table_list(self, data):
+        """getStatsListの結果からTABLE_INFのリストを取得(1件の場合や0件の場合も含む)"""
+        TABLE_INF = data['GET_STATS_LIST'].get('DATALIST_INF', {}).get('TABLE_INF', [])
+        return TABLE_INF if isinstance(TABLE_INF, list) else [TABLE_INF]
+
+    def _write_json(self, path, data):
+        part_path = _part_path(path)
+        with open(part_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(part_path, path)
+
+    # 指定した期間(yyyymmdd-yyyymmdd)に更新された統計表の一覧をダウンロード
+    def load_updated_ids(self, since, until):
         try:
-            jd = self.load_json(
-                self.path['statid-json'])['GET_STATS_LIST']['DATALIST_INF']['TABLE_INF']
-
-            for i, j in enumerate(jd):
-                filename = '-'.join([
-                    j['@id'],
-                    j['STAT_NAME']['$'],
-                    str(j['SURVEY_DATE']),
-                    j['GOV_ORG']['$'],
-                    j['MAIN_CATEGORY']['$'],
-                    j['SUB_CATEGORY']['$']
-                ]) + '.dic'
+            load_uri = self.build_uri({
+                'appId': self._['appId'],
+                'updatedDate': f"{since}-{until}"
+            }).replace('getStatsData', 'getStatsList')
 
+            logger.info(f"Downloading statistics IDs updated from {since} to {until}")
+            response = self._upstream_get(load_uri, 'getStatsList', 30)
+            self.metrics.inc('upstream_bytes_total', len(response.content), api='getStatsList')
+            data = response.json()
+            self._check_result(data['GET_STATS_LIST'].get('RESULT', {}))
+            return self._table_list(data)
+        except requests.RequestException as e:
+            logger.error(f"Failed to download updated statistics IDs: {e}")
+            raise
+
+    # 統計表一覧とインデックスを差分更新する
+    # 前回の同期日以降に更新された統計表だけを取得し、all.json.dic・index.list.dic・
+    # detail.ngram.dicの該当箇所を置き換え、更新された統計表のキャッシュを削除する
+    # (初回は全件を取得してインデックスを作成する。上流で削除された統計表は残る)
+    def refresh_catalog(self):
+        today = datetime.date.today().strftime('%Y%m%d')
+        state = None
+        if os.path.exists(self.path['sync-state']):
+            state = self.load_json(self.path['sync-state'])
+
+        if state is None or not os.path.exists(self.path['statid-json']):
+            logger.info("No previous sync state, rebuilding the catalog")
+            self.load_all_ids()
+            self.build_indexes()
+            tables = {j['@id']: j.get('UPDATED_DATE') for j in self.iter_table_inf()}
+            self._write_json(self.path['sync-state'], {'last_sync': today, 'tables': tables})
+            return {'added': list(tables), 'updated': []}
+
+        # 同じ日に更新された統計表も取得できるよう、前回の同期日を含めて問い合わせる
+        changed = {}
+        for j in self.load_updated_ids(state['last_sync'], today):
+            if state['tables'].get(j['@id']) != j.get('UPDATED_DATE'):
+                changed[j['@id']] = j
+        changed = list(changed.values())
+
+        added, updated = [], []
+        if changed:
+            new = {j['@id']: j for j in changed}
+            old = {}
+
+            def merged():
+                for j in self.iter_table_inf():
+                    if j['@id'] in new:
+                        old[j['@id']] = j
+                        j = new[j['@id']]
+                    yield j
+                for j in changed:
+                    if j['@id'] not in old:
+                        yield j
+
+            self._write_catalog(merged())
+            added = [j['@id'] for j in changed if j['@id'] not in old]
+            updated = [j['@id'] for j in changed if j['@id'] in old]
+
+            self._patch_statid_index(changed)
+            self._patch_detailed_index(changed, old)
+            for j in changed:
+                self.evict_cached_data(j['@id'], 'expirations')
+                state['tables'][j['@id']] = j.get('UPDATED_DATE')
+
+        state['last_sync'] = today
+        self._write_json(self.path['sync-state'], state)
+        logger.info(f"Catalog refreshed: {len(added)} added, {len(updated)} updated")
+        return {'added': added, 'updated': updated}
+
+    def _write_catalog(self, tables):
+        """TABLE_INFを1件ずつall.json.dicへ書き込む(getStatsListと同じ構造)"""
+        part_path = _part_path(self.path['statid-json'])
+        with open(part_path, 'w', encoding='utf-8') as f:
+            f.write('{"GET_STATS_LIST":{"DATALIST_INF":{"TABLE_INF":[')
+            n = 0
+            for j in tables:
+                f.write((',' if n else '') + json.dumps(j, ensure_ascii=False, separators=(',', ':')))
+                n += 1
+            f.write(f'],"NUMBER":{n}}}}}}}')
+        os.replace(part_path, self.path['statid-json'])
+
+    def _patch_statid_index(self, entries):
+        """index.list.dicの該当する行を置き換え、新しい統計表は末尾に追加"""
+        if not os.path.exists(self.path['dictionary-index']):
+            return self.build_statid_index()
+
+        with open(self.path['dictionary-index'], 'r', encoding='utf-8') as f:
+            lines = f.read().split('\n')
+        pos = {line.split('-', 1)[0]: i for i, line in enumerate(lines) if line}
+
+        for j in entries:
+            try:
+                line = self._index_line(j)
+            except KeyError as e:
+                logger.warning(f"Missing key in data: {e}")
+                line = None
+            i = pos.get(j['@id'])
+            if i is not None:
+                lines[i] = line
+            elif line is not None:
+                lines.append(line)
+
+        part_path = _part_path(self.path['dictionary-index'])
+        with open(part_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join([line for line in lines if line]))
+        os.replace(part_path, self.path['dictionary-index'])
+        self.response_cache.invalidate('search')
+        return True
+
+    def _patch_detailed_index(self, entries, old):
+        """detail.ngram.dicのポスティングを更新(old: statsDataId→更新前のTABLE_INF)"""
+        if not os.path.exists(self.path['dictionary-detail-index']):
+            return self.build_detailed_index()
+
+        index = NgramIndex.load(self.path['dictionary-detail-index'])
+        n_fields = len(index.fields)
+        ids = list(index.ids)
+        doc_of = {sid: doc for doc, sid in enumerate(ids)}
+        postings = {term: array('I', index.posting(term)) for term in index.terms}
+
+        for j in entries:
+            doc = doc_of.get(j['@id'])
+            if doc is None:
+                doc = doc_of[j['@id']] = len(ids)
+                ids.append(j['@id'])
+            else:
+                # 更新前のn-gramから該当する文書を取り除く(不明な場合は全n-gramを確認)
+                if j['@id'] in old:
+                    old_grams = self._detail_grams(old[j['@id']])
+                else:
+                    old_grams = [set(postings)] * n_fields
+                for field_no, grams in enumerate(old_grams):
+                    value = doc * n_fields + field_no
+                    for g in grams:
+                        p = postings.get(g)
+                        if p is None:
+                            continue
+                        i = bisect.bisect_left(p, value)
+                        if i < len(p) and p[i] == value:
+                            del p[i]
+
+            for field_no, grams in enumerate(self._detail_grams(j)):
+                value = doc * n_fields + field_no
+                for g in grams:
+                    p = postings.setdefault(g, array('I'))
+                    i = bisect.bisect_left(p, value)
+                    if i == len(p) or p[i] != value:
+                        p.insert(i, value)
+
+        postings = {term: p for term, p in postings.items() if p}
+        NgramIndex.write(self.path['dictionary-detail-index'], index.gram, ids,
+                         index.fields, postings)
+        logger.info(f"Detailed index patched: {len(entries)} entries")
+        return True
+
+    # 統計表のキャッシュ(CSV・行インデックス・列指向キャッシュ・ページ・レスポンス)を削除
+    # reason: キャッシュの統計に記録する削除の理由('evictions'/'expirations')
+    def evict_cached_data(self, statsDataId, reason='evictions'):
+        self._validate_stats_id(statsDataId)
+        with self._single_flight(statsDataId):
+            for path in self._cache_files(statsDataId):
+                if os.path.exists(path):
+                    os.remove(path)
+                    logger.info(f"Removed cached file: {path}")
+            # 保持しているページ(全appId分)も古いデータのため削除
+            self._cleanup_temp_files(statsDataId, appId='*')
+            self.data_cache.remove(statsDataId, reason)
+        self.response_cache.invalidate(statsDataId)
+        self.metrics.inc('data_cache_removals_total', reason=reason)
+
+    def _cache_files(self, statsDataId):
+        """data-cache/で統計表のキャッシュを構成するファイル"""
+        return [os.path.join(self.path['csv'], statsDataId + '.csv'),
+                self._row_index_path(statsDataId),
+                self._dimension_index_path(statsDataId),
+                self._columnar_path(statsDataId)]
+
+    def _cache_size(self, statsDataId):
+        return sum(os.path.getsize(p) for p in self._cache_files(statsDataId) if os.path.exists(p))
+
+    def _scan_cache(self):
+        """data-cache/にある統計表(statsDataId→(サイズ, CSVのmtime))"""
+        sizes = {}
+        for file in Path(self.path['csv']).glob('*.csv'):
+            sid = file.stem
+            if re.match(r'^\d+$', sid):
                 try:
-                    STATISTICS_NAME = self.create_n_gram_str(
-                        j['STATISTICS_NAME'], self.gram)
-                except:
-                    STATISTICS_NAME = ''
-                try:
-                    TITLE = self.create_n_gram_str(j['TITLE']['$'], self.gram)
-                except:
-                    TITLE = ''
+                    sizes[sid] = (self._cache_size(sid), file.stat().st_mtime)
+                except FileNotFoundError:
+                    continue
+        return sizes
 
-                with open(self.path['dictionary-detail'] + filename, 'w', encoding='utf-8') as f:
-                    f.write('\n'.join([STATISTICS_NAME, TITLE]))
+    def _upstream_updated_at(self, statsDataId):
+        """refresh_catalogで記録した統計表のUPDATED_DATE(UNIX時間、不明な場合はNone)"""
+        try:
+            mtime = os.path.getmtime(self.path['sync-state'])
+        except FileNotFoundError:
+            return None
+        cached = self._shared.get('sync-state')
+        if cached is None or cached[0] != mtime:
+            cached = self._shared['sync-state'] = (mtime, self.load_json(self.path['sync-state'])['tables'])
+        try:
+            return datetime.datetime.strptime(cached[1][statsDataId], '%Y-%m-%d').timestamp()
+        except (KeyError, TypeError, ValueError):
+            return None
 
-            logger.info(f"Detailed index built: {len(jd)} entries")
-            return True
-        except Exception as e:
-            logger.error(f"Failed to build detailed index: {e}")
-            raise
+    def _expire_cached(self, statsDataId):
+        """有効期間を過ぎたか、上流で更新された統計表のキャッシュを削除"""
+        if (os.path.exists(os.path.join(self.path['csv'], statsDataId + '.csv')) and
+                self.data_cache.expired(statsDataId, self._upstream_updated_at(statsDataId))):
+            logger.info(f"Cache expired: {statsDataId}")
+            self.evict_cached_data(statsDataId, 'expirations')
+
+    def _enforce_cache_quota(self, keep):
+        """data-cache/を容量の上限に収める(keepの統計表は削除しない)"""
+        if self.data_cache.max_bytes <= 0:
+            return
+        self.data_cache.sync(self._scan_cache())
+        for sid in self.data_cache.victims(keep=[keep]):
+            logger.info(f"Evicting cached table: {sid}")
+            self.evict_cached_data(sid, 'evictions')
+
+    # data-cache/の使用量とヒット率等の統計(キャッシュ領域の大きさを決める際の参考)
+    def cache_stats(self):
+        self.data_cache.sync(self._scan_cache())
+        return self.data_cache.stats()
+
+    # 複数の統計表をworkers個のスレッドで並行してダウンロード・変換する
+    # 戻り値: {statsDataId: キャッシュCSVのパス(失敗した場合は例外)}
+    def fetch_tables(self, statsDataIds, workers=None):
+        ids = list(dict.fromkeys(sid.strip() for sid in statsDataIds if sid.strip()))
+        for sid in ids:
+            self._validate_stats_id(sid)
+        workers = self.job_workers if workers is None else int(workers)
+
+        def fetch(sid):
+            try:
+                return sid, self._ensure_cached(sid)
+            except Exception as e:
+                logger.error(f"Failed to fetch {sid}: {e}")
+                return sid, e
+
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            return dict(executor.map(fetch, ids))
+
+    # 統計表のキャッシュを作成するジョブを登録(priorityが大きいものから処理)
+    # キャッシュ済みの統計表と、既に待機中・実行中の統計表は登録しない
+    def enqueue_tables(self, statsDataIds, priority=0):
+        ids = list(dict.fromkeys(sid.strip() for sid in statsDataIds if sid.strip()))
+        for sid in ids:
+            self._validate_stats_id(sid)
+
+        cached = []
+        pending = []
+        for sid in ids:
+            self._expire_cached(sid)
+            if os.path.exists(os.path.join(self.path['csv'], sid + '.csv')):
+                cached.append(sid)
+            else:
+                pending.append(sid)
+        queued, duplicate = self.jobs.add(pending, int(priority))
+        self.metrics.inc('cache_jobs_total', len(queued), result='queued')
+        logger.info(f"Queued {len(queued)} tables ({len(cached)} cached, {len(duplicate)} already queued)")
+        return {'queued': queued, 'cached': cached, 'duplicate': duplicate}
+
+    # ユーザーindex(dictionary/user.csv.dic)で登録が多い順の統計表ID
+    def popular_ids(self, limit=None):
+        if not os.path.exists(self.path['dictionary-user']):
+            return []
+        counts = {}
+        with open(self.path['dictionary-user'], 'r', encoding='utf-8') as f:
+            for line in f:
+                sid = line.split(',', 1)[0].strip()
+                if re.match(r'^\d+$', sid):
+                    counts[sid] = counts.get(sid, 0) + 1
+        ids = sorted(counts, key=lambda sid: -counts[sid])
+        return ids if limit is None else ids[:int(limit)]
+
+    def _work_jobs(self, stop=None, interval=None):
+        """ジョブを順に処理(intervalを指定した場合はstopまでキューを監視し続ける)"""
+        processed = 0
+        while stop is None or not stop.is_set():
+            sid = self.jobs.claim()
+            if sid is None:
+                if interval is None:
+                    break
+                stop.wait(interval)
+                continue
+            logger.info(f"Warming cache: {sid}")
+            try:
+                self._ensure_cached(sid)
+            except Exception as e:
+                logger.error(f"Cache job failed: {sid}: {e}")
+                self.jobs.finish(sid, str(e))
+                self.metrics.inc('cache_jobs_total', result='failed')
+            else:
+                self.jobs.finish(sid)
+                self.metrics.inc('cache_jobs_total', result='done')
+            processed += 1
+        return processed
+
+    # 待機中のジョブが無くなるまでworkers個のスレッドで処理し、処理したジョブの数を返す
+    def run_jobs(self, workers=None):
+        workers = self.job_workers if workers is None else int(workers)
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            return sum(executor.map(lambda _: self._work_jobs(), range(max(workers, 1))))
+
+    # キューを監視して処理するバックグラウンドのスレッドを開始(Webサーバーと同じプロセスで使う場合)
+    # 戻り値のEventをsetすると停止する
+    def start_job_workers(self, workers=None, interval=5.0):
+        workers = self.job_workers if workers is None else int(workers)
+        stop = threading.Event()
+        for i in range(max(workers, 1)):
+            threading.Thread(target=self._work_jobs, args=(stop, interval),
+                             name=f"estat-job-worker-{i}", daemon=True).start()
+        return stop
+
+    # ジョブの状態(statsDataIdを指定しない場合は状態ごとの件数と一覧)
+    def job_status(self, statsDataId=None):
+        if statsDataId is not None:
+            self._validate_stats_id(statsDataId)
+            return self.jobs.status(statsDataId)
+        return {'counts': self.jobs.counts(), 'jobs': self.jobs.status()}
+
+    def _normalize_n_gram_text(self, text):
+        return _normalize_n_gram_text(text)
 
     def create_n_gram_str(self, text, gram):
-        text = unicodedata.normalize('NFKC', text)
-        text = re.sub(r'[\s\(\)\-,\[\]]', '', text).replace('・', '')
-        ngrams = [text[i:i+gram] for i in range(len(text)) if i+gram <= len(text)]
-        return ','.join([ng for ng in ngrams if ng])
+        return ','.join([ng for ng in _n_grams(text, gram) if ng])
 
+    @_timed('search_seconds', labels={'index': 'detail'})
     def search_detailed_index(self, q):
         self._validate_query(q)
+
+        if not os.path.exists(self.path['dictionary-detail-index']):
+            return self._search_detailed_files(q)
+
+        index = NgramIndex.load(self.path['dictionary-detail-index'])
+        text = self._normalize_n_gram_text(q)
+        if len(text) < self.gram:
+            grams = [text] if text else []
+        else:
+            grams = self.create_n_gram_str(text, self.gram).split(',')
+
+        return [','.join([index.ids[doc], q]) for doc, _ in index.search(grams)]
+
+    def _search_detailed_files(self, q):
+        """旧形式(1統計表1ファイル)の詳細インデックスを走査"""
         detail_files = os.listdir(self.path['dictionary-detail'])
         detail_index = []
 
@@ -268,30 +1961,55 @@ class e_Stat_API_Adaptor:
             logger.error(f"Invalid JSON in {path}: {e}")
             raise
 
-    def search_id(self, q, _index, _header='index'):
+    def _parse_index_line(self, line):
+        """index.list.dicの1行を列(statsDataId, 調査名, 調査年月, 組織名, カテゴリー)に分解"""
+        parts = line[:-len('.dic')].split('-') if line.endswith('.dic') else line.split('-')
+        if len(parts) < 6:
+            return parts
+        # 調査年月は「201501-201512」のような期間の場合がある
+        date_start = len(parts) - 4
+        if date_start > 2 and parts[date_start - 1].isdigit() and parts[date_start].isdigit():
+            date_start -= 1
+        return [
+            parts[0],
+            '-'.join(parts[1:date_start]),
+            '-'.join(parts[date_start:-3]),
+            parts[-3],
+            '-'.join(parts[-2:])
+        ]
+
+    def _parse_user_line(self, line):
+        return line.split(',', 1)
+
+    def _format_index_row(self, line, line_num=None):
+        row = [str(line_num)] if line_num is not None else []
+        row += [c for c in line.split('-') if '.dic' not in c]
+        # 行の整形
+        if len(row) == 6:
+            row[2] = row[2] + '-' + row[3]
+            del row[3]
+        return ','.join(row)
+
+    # filters: 列名→部分一致文字列 (例: {'組織名': '総務省', 'カテゴリー': '人口'})
+    @_timed('search_seconds', index='_header')
+    def search_id(self, q, _index, _header='index', filters=None):
         self._validate_query(q)
 
         try:
-            with open(_index, 'r', encoding='utf-8') as f:
-                content = f.read()
+            parse = self._parse_index_line if _header == 'index' else self._parse_user_line
+            index = LineIndex.load(_index, self.csv_header[_header], parse)
 
             if q == 'index':
-                rows = [[c for c in line.split('-') if '.dic' not in c]
-                       for line in content.split('\n') if line]
+                hits = [i for i, line in enumerate(index.lines) if line]
             else:
-                lines = content.split('\n')
-                rows = []
-                for line_num, line in enumerate(lines, 1):
-                    if q in line:
-                        parts = [str(line_num)] + [c for c in line.split('-') if '.dic' not in c]
-                        rows.append(parts)
-
-            # 行の整形
-            for i, r in enumerate(rows):
-                if len(r) == 6:
-                    rows[i][2] = rows[i][2] + '-' + rows[i][3]
-                    del rows[i][3]
-                rows[i] = ','.join(rows[i])
+                hits = index.find(q)
+            if filters:
+                hits = index.match(hits, filters)
+
+            if q == 'index':
+                rows = [self._format_index_row(index.lines[i]) for i in hits]
+            else:
+                rows = [self._format_index_row(index.lines[i], i + 1) for i in hits]
 
             result = '\n'.join([','.join(self.csv_header[_header]), '\n'.join(rows)])
             return result
@@ -302,181 +2020,614 @@ class e_Stat_API_Adaptor:
             logger.error(f"Search failed: {e}")
             raise
 
-    def get_all_data(self, statsDataId, next_key):
-        self._validate_stats_id(statsDataId)
+    # 検索語のn-gramで統計表をBM25Fにより順位付けし、(一致した統計表の数, [(statsDataId, スコア), ...])を返す
+    # 詳細インデックス(STATISTICS_NAME・TITLE)とindex.list.dic(調査名・組織名・カテゴリー)を項目として扱い、
+    # 一部のn-gramだけを含む統計表も対象とする。上位offset+k件だけをヒープで保持する
+    def rank_tables(self, q, k=20, offset=0, filters=None):
+        self._validate_query(q)
+        k, offset = int(k), int(offset)
+        if k < 1 or offset < 0:
+            raise ValueError(self.msg['invalid-query'])
+
+        text = self._normalize_n_gram_text(q)
+        grams = list(dict.fromkeys(_n_grams(text, self.gram))) if len(text) >= self.gram else [text]
+        grams = [g for g in grams if g]
+
+        lines = LineIndex.load(self.path['dictionary-index'], self.csv_header['index'], self._parse_index_line)
+        ids = lines.columns[self.csv_header['index'][0]]
+        detail = None
+        extra = []
+        if os.path.exists(self.path['dictionary-detail-index']):
+            detail = NgramIndex.load(self.path['dictionary-detail-index'])
+            doc_rows, extra = detail.rows_in(lines)
+        # 文書: index.list.dicの各行と、詳細インデックスにのみある統計表
+        n_docs = len(lines.lines) + len(extra)
+        k1, b = self.rank_k1, self.rank_b
+        scores = numpy.zeros(n_docs)
+        matched = numpy.zeros(n_docs, dtype=bool)
+
+        for g in grams:
+            # 項目の重みと長さで正規化したtfの文書ごとの合計
+            tf = numpy.zeros(n_docs)
+            if detail is not None:
+                lengths, averages = detail.field_lengths()
+                n_fields = len(detail.fields)
+                weights = numpy.array([self.rank_weights.get(f, 0) for f in detail.fields], dtype=numpy.float64)
+                for term in detail.expand(g):
+                    p = numpy.asarray(detail.posting(term), dtype=numpy.int64)
+                    field_no = p % n_fields
+                    w = weights[field_no] / (1 - b + b * lengths[p] / averages[field_no])
+                    tf += numpy.bincount(doc_rows[p // n_fields], weights=w, minlength=n_docs)
+            for name in self.csv_header['index'][1:]:
+                weight = self.rank_weights.get(name)
+                if not weight:
+                    continue
+                postings, lengths, average = lines.field_grams(name, self.gram)
+                terms = [g] if len(g) >= self.gram else [t for t in postings if g in t]
+                for term in terms:
+                    if term not in postings:
+                        continue
+                    r = numpy.asarray(postings[term], dtype=numpy.int64)
+                    w = weight / (1 - b + b * lengths[r] / average)
+                    tf += numpy.bincount(r, weights=w, minlength=n_docs)
+
+            hit = tf > 0
+            df = int(numpy.count_nonzero(hit))
+            if not df:
+                continue
+            # 多くの統計表に含まれるn-gramほど重みを下げる
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            scores += idf * tf * (k1 + 1) / (tf + k1)
+            matched |= hit
+
+        candidates = numpy.flatnonzero(matched).tolist()
+        if filters:
+            candidates = lines.match([r for r in candidates if r < len(lines.lines)], filters)
+        scores = scores.tolist()
+        top = heapq.nlargest(offset + k, candidates, key=scores.__getitem__)
+        return len(candidates), [(ids[r] if r < len(lines.lines) else extra[r - len(lines.lines)], scores[r])
+                                 for r in top[offset:]]
+
+    # rank_tablesの結果をindex.list.dicの項目とスコアを付けたCSVで返す
+    @_timed('search_seconds', labels={'index': 'ranked'})
+    def search_ranked(self, q, k=20, offset=0, filters=None):
+        try:
+            _, top = self.rank_tables(q, k, offset, filters)
+            lines = LineIndex.load(self.path['dictionary-index'], self.csv_header['index'], self._parse_index_line)
+            header = self.csv_header['index'] + ['score']
+            rows = []
+            for sid, score in top:
+                r = lines.row_of(sid)
+                values = [lines.columns[h][r] for h in self.csv_header['index']] if r is not None else \
+                    [sid] + [''] * (len(self.csv_header['index']) - 1)
+                rows.append(','.join(values + [f"{score:.4f}"]))
+            return '\n'.join([','.join(header), '\n'.join(rows)])
+        except FileNotFoundError:
+            logger.error(f"Index file not found: {self.path['dictionary-index']}")
+            raise
 
-        self.cache['tmp'] = os.path.join(
+    # tmp/のページファイル名: <appId>.<statsDataId>.<開始位置>.json[.gz|.zst]
+    def _page_path(self, statsDataId, next_key):
+        ext = {'gzip': '.gz', 'zstd': '.zst'}.get(self.page_compression, '')
+        return os.path.join(
             self.path['tmp'],
-            '.'.join([self._['appId'], statsDataId, next_key, 'json'])
+            '.'.join([self._['appId'], statsDataId, next_key, 'json']) + ext
         )
 
+    def _page_files(self, statsDataId='*', appId=None):
+        """tmp/にあるページファイルを(開始位置, パス)の開始位置順のリストで取得(圧縮形式は問わない)"""
+        appId = self._['appId'] if appId is None else appId
+        pages = []
+        for file in Path(self.path['tmp']).glob(f"{appId}.{statsDataId}.*"):
+            m = re.match(r'^.+\.(\d+)\.json(\.gz|\.zst)?$', file.name)
+            if m:
+                pages.append((int(m.group(1)), file))
+        return sorted(pages)
+
+    def _page_uri(self, statsDataId, next_key):
+        return self.build_uri({
+            'appId': self._['appId'],
+            'statsDataId': statsDataId,
+            'limit': self._['limit'],
+            'startPosition': next_key
+        })
+
+    def _save_page(self, tmp_path, body):
+        """APIのレスポンス(bytes)を整形せずに圧縮して保存"""
+        if tmp_path.endswith('.gz'):
+            body = gzip.compress(body)
+        elif tmp_path.endswith('.zst'):
+            body = zstandard.ZstdCompressor().compress(body)
+        # 並列取得中に不完全なファイルが読まれないよう、書き込み後にリネーム
+        part_path = _part_path(tmp_path)
+        with open(part_path, 'wb') as f:
+            f.write(body)
+        os.replace(part_path, tmp_path)
+
+    def _load_page(self, tmp_path):
+        tmp_path = str(tmp_path)
+        with open(tmp_path, 'rb') as f:
+            body = f.read()
+        if tmp_path.endswith('.gz'):
+            body = gzip.decompress(body)
+        elif tmp_path.endswith('.zst'):
+            if zstandard is None:
+                raise RuntimeError(f"zstandard is required to read {tmp_path}")
+            body = zstandard.ZstdDecompressor().decompress(body)
+        try:
+            return json.loads(body)
+        except json.JSONDecodeError as e:
+            logger.error(f"Invalid JSON in {tmp_path}: {e}")
+            raise
+
+    def _remaining_positions(self, RESULT_INF):
+        """1ページ目のRESULT_INFから残りのページの開始位置を計算(総件数が不明な場合はNone)
+
+        上流は1ページの件数をlimitより少なく制限する場合があるため、1ページ目の実際の件数を使う。
+        """
+        total = int(RESULT_INF.get('TOTAL_NUMBER', 0))
+        next_key = int(RESULT_INF['NEXT_KEY'])
+        step = next_key - int(RESULT_INF.get('FROM_NUMBER', 1))
+        if total <= 0 or step <= 0:
+            return None
+        return [str(p) for p in range(next_key, total + 1, step)]
+
+    def _discard_pages(self, statsDataId, positions):
+        """開始位置がずれていたページをtmp/から削除"""
+        positions = {int(p) for p in positions}
+        for position, file in self._page_files(statsDataId):
+            if position in positions:
+                try:
+                    file.unlink()
+                except FileNotFoundError:
+                    pass
+
+    def _fetch_page(self, statsDataId, next_key):
+        """1ページ分をダウンロードしてtmp/に保存し、(保存先, ページ)を返す(保存済みの場合は読み込む)"""
+        tmp_path = self._page_path(statsDataId, next_key)
+
+        if self._page_reusable(tmp_path):
+            self.metrics.inc('pages_total', source='tmp')
+            return tmp_path, self._load_page(tmp_path)
+
+        apiURI = self._page_uri(statsDataId, next_key)
+
+        logger.info(f"Fetching data from API: {statsDataId}, position: {next_key}")
+        response = self._upstream_get(apiURI, 'getStatsData', 60)
+        self.metrics.inc('upstream_bytes_total', len(response.content), api='getStatsData')
+        self.metrics.inc('pages_total', source='api')
+        # 途中で切れた応答が再開時に使われないよう、解析できたものだけを保存
+        page = response.json()
+        self._save_page(tmp_path, response.content)
+        return tmp_path, page
+
+    def _page_reusable(self, tmp_path):
+        """tmp/のページが再利用できる(page_retention・page_resume秒以内に保存された)か否か"""
         try:
-            if not os.path.exists(self.cache['tmp']):
-                apiURI = self.build_uri({
-                    'appId': self._['appId'],
-                    'statsDataId': statsDataId,
-                    'limit': self._['limit'],
-                    'startPosition': next_key
-                })
-
-                logger.info(f"Fetching data from API: {statsDataId}, position: {next_key}")
-                response = requests.get(apiURI, timeout=60)
-                response.raise_for_status()
-
-                with open(self.cache['tmp'], 'w', encoding='utf-8') as f:
-                    json.dump(response.json(), f, ensure_ascii=False, indent=2)
-
-            data = self.load_json(self.cache['tmp'])
-            RESULT_INF = data['GET_STATS_DATA']['STATISTICAL_DATA']['RESULT_INF']
+            age = time.time() - os.path.getmtime(tmp_path)
+        except FileNotFoundError:
+            return False
+        return age <= max(self.page_retention, self.page_resume)
+
+    def _is_upstream_error(self, e):
+        """上流APIとの通信の失敗(取得済みのページを残して再開できる)か否か"""
+        return isinstance(e, UpstreamUnavailable) or (
+            'requests' in sys.modules and isinstance(e, requests.RequestException))
+
+    def _result_inf(self, page):
+        return page['GET_STATS_DATA']['STATISTICAL_DATA']['RESULT_INF']
+
+    def get_all_data(self, statsDataId, next_key):
+        self._validate_stats_id(statsDataId)
+
+        try:
+            self.cache['tmp'], page = self._fetch_page(statsDataId, next_key)
+            RESULT_INF = self._result_inf(page)
             NEXT_KEY = '-1' if 'NEXT_KEY' not in RESULT_INF else RESULT_INF['NEXT_KEY']
 
             return str(NEXT_KEY)
-        except requests.RequestException as e:
-            logger.error(f"API request failed: {e}")
-            # エラー時は一時ファイルを削除
-            self._cleanup_temp_files(statsDataId)
-            return None
         except Exception as e:
-            logger.error(f"Unexpected error in get_all_data: {e}")
-            self._cleanup_temp_files(statsDataId)
+            if self._is_upstream_error(e):
+                # 取得済みのページは残し、次回は失敗したページから再開する
+                logger.error(f"API request failed: {e}")
+            else:
+                logger.error(f"Unexpected error in get_all_data: {e}")
+                self._cleanup_temp_files(statsDataId)
             return None
 
-    def _cleanup_temp_files(self, statsDataId):
+    # 全ページを開始位置の順に返す(総件数が判明した後は残りのページを並列取得)
+    # 取得済みで未処理のページはconcurrencyの2倍までに抑える
+    def iter_pages(self, statsDataId, concurrency=None):
+        self._validate_stats_id(statsDataId)
+        concurrency = self.concurrency if concurrency is None else int(concurrency)
+
+        try:
+            _, page = self._fetch_page(statsDataId, '1')
+            RESULT_INF = self._result_inf(page)
+            yield page
+            if not self._['next_key'] or 'NEXT_KEY' not in RESULT_INF:
+                return
+
+            positions = self._remaining_positions(RESULT_INF)
+            if positions is None or concurrency <= 1:
+                # 総件数が不明な場合はNEXT_KEYを順に辿る
+                next_key = str(RESULT_INF['NEXT_KEY'])
+                while next_key != '-1':
+                    _, page = self._fetch_page(statsDataId, next_key)
+                    next_key = str(self._result_inf(page).get('NEXT_KEY', '-1'))
+                    yield page
+                return
+
+            logger.info(f"Fetching {len(positions)} remaining pages for {statsDataId} "
+                        f"with {concurrency} workers")
+            executor = ThreadPoolExecutor(max_workers=concurrency)
+            queue = deque(positions)
+            pending = deque()
+            next_key = None
+            try:
+                while queue or pending:
+                    while queue and len(pending) < concurrency * 2:
+                        position = queue.popleft()
+                        # 計測結果(Server-Timing)をリクエストに記録するため、呼び出し元のcontextvarsで実行する
+                        pending.append((position, executor.submit(contextvars.copy_context().run,
+                                                                  self._fetch_page, statsDataId, position)))
+                    # 例外は結果の取得時に再送出される
+                    _, future = pending.popleft()
+                    page = future.result()[1]
+                    yield page
+                    # 各ページのNEXT_KEYが次に取得したページの開始位置と一致するか確認
+                    actual = str(self._result_inf(page).get('NEXT_KEY', '-1'))
+                    expected = pending[0][0] if pending else (queue[0] if queue else '-1')
+                    if actual != expected:
+                        logger.warning(f"Unexpected NEXT_KEY for {statsDataId}: {actual} "
+                                       f"(expected {expected}), following NEXT_KEY instead")
+                        next_key = actual
+                        break
+            finally:
+                # 未開始のページは取り消す
+                _shutdown_executor(executor, [future for _, future in pending])
+
+            if next_key is not None:
+                # 残りは開始位置がずれているため削除し、NEXT_KEYを順に辿る
+                self._discard_pages(statsDataId, [p for p, _ in pending])
+                while next_key != '-1':
+                    _, page = self._fetch_page(statsDataId, next_key)
+                    next_key = str(self._result_inf(page).get('NEXT_KEY', '-1'))
+                    yield page
+        except Exception as e:
+            if self._is_upstream_error(e):
+                # 取得済みのページは残し、次回は失敗したページから再開する
+                logger.error(f"API request failed: {e}")
+            else:
+                logger.error(f"Unexpected error in iter_pages: {e}")
+                self._cleanup_temp_files(statsDataId)
+            raise
+
+    # 全ページをtmp/にダウンロード
+    def download_all_data(self, statsDataId, concurrency=None):
+        for _ in self.iter_pages(statsDataId, concurrency):
+            pass
+        return True
+
+    def _cleanup_temp_files(self, statsDataId, appId=None):
         """一時ファイルのクリーンアップ"""
         try:
-            pattern = f"{self._['appId']}.{statsDataId}.*.json"
-            temp_dir = Path(self.path['tmp'])
-            for file in temp_dir.glob(pattern):
+            for _, file in self._page_files(statsDataId, appId):
                 file.unlink()
                 logger.info(f"Cleaned up temp file: {file}")
         except Exception as e:
             logger.warning(f"Failed to cleanup temp files: {e}")
 
-    def convert_raw_json_to_csv(self, statsDataId):
+    # 変換後のページファイルを保持期間(page_retention秒)と容量(page_cache_bytes)に従って削除
+    def _prune_pages(self, statsDataId):
+        if self.page_retention <= 0:
+            self._cleanup_temp_files(statsDataId)
+            return
+
+        now = time.time()
+        pages = []
+        for _, file in self._page_files(appId='*'):
+            try:
+                st = file.stat()
+            except FileNotFoundError:
+                continue
+            pages.append((st.st_mtime, st.st_size, file))
+        total = sum(size for _, size, _ in pages)
+        # 古いものから削除
+        for mtime, size, file in sorted(pages, key=lambda x: x[0]):
+            if now - mtime <= self.page_retention and total <= self.page_cache_bytes:
+                break
+            try:
+                file.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def _build_class_maps(self, CLASS_INF):
+        """CLASS_INFから列名(_h)とコード→名称(_b)の対応表を作成"""
+        _h = {}
+        _b = {}
+        for o in CLASS_INF['CLASS_OBJ']:
+            classes = o['CLASS'] if isinstance(o['CLASS'], list) else [o['CLASS']]
+            _b.setdefault(o['@id'], {})
+            for oc in classes:
+                _b[o['@id']][oc['@code']] = oc['@name']
+            _h[o['@id']] = o['@name']
+        return _h, _b
+
+    # ページを1つずつCSVへ変換する(メモリ使用量はページサイズに比例)
+    # pages: iter_pagesが返すページ(省略時はtmp/に保存されたページを読み込む)
+    @_timed('convert_seconds')
+    def convert_raw_json_to_csv(self, statsDataId, pages=None):
         self._validate_stats_id(statsDataId)
 
         try:
-            self.cache['csv'] = os.path.join(self.path['csv'], statsDataId + '.csv')
-            dat = {'header': None, 'body': [], 'keys': None}
-
-            # 一時JSONファイルの取得
-            pattern = f"{self._['appId']}.{statsDataId}.*.json"
-            temp_dir = Path(self.path['tmp'])
-            json_files = sorted(temp_dir.glob(pattern),
-                              key=lambda x: int(x.stem.split('.')[2]))
-
-            if not json_files:
-                raise FileNotFoundError(f"No JSON files found for {statsDataId}")
-
-            logger.info(f"Converting {len(json_files)} JSON files to CSV")
-
-            for i, json_file in enumerate(json_files):
-                logger.info(f"Processing {i+1}/{len(json_files)}: {json_file.name}")
-                jd = self.load_json(str(json_file))
-
-                if i == 0:
-                    dat['header'] = [
-                        k.replace('@', '')
-                        for k in jd['GET_STATS_DATA']['STATISTICAL_DATA']['DATA_INF']['VALUE'][0].keys()
-                    ]
-                    dat['keys'] = jd['GET_STATS_DATA']['STATISTICAL_DATA']['CLASS_INF']
-
-                dat['body'].extend(jd['GET_STATS_DATA']['STATISTICAL_DATA']['DATA_INF']['VALUE'])
-
-            # ヘッダーとボディの作成
-            _h = {}
-            _b = {}
-
-            for o in dat['keys']['CLASS_OBJ']:
-                o['CLASS'] = [o['CLASS']] if not isinstance(o['CLASS'], list) else o['CLASS']
-                if o['@id'] not in _b:
-                    _b[o['@id']] = {}
-                for oc in o['CLASS']:
-                    _b[o['@id']][oc['@code']] = oc['@name']
-                _h[o['@id']] = o['@name']
-
-            newCSV = [[_h.get(h, h) for h in dat['header']]]
-            newCSV.append(dat['header'])
-
-            for body in dat['body']:
-                newCSV.append(list(body.values()))
-
-            # データの変換
-            for i, x in enumerate(newCSV):
-                if i > 0:
-                    for j, d in enumerate(x):
-                        if dat['header'][j] in _b and d in _b[dat['header'][j]]:
-                            newCSV[i][j] = _b[dat['header'][j]][d]
-                        else:
-                            newCSV[i][j] = d
-
-            # CSV書き込み
-            with open(self.cache['csv'], 'w', encoding='utf-8', newline='') as f:
-                csv.writer(f, quoting=csv.QUOTE_NONNUMERIC).writerows(newCSV)
-
-            logger.info(f"CSV created successfully: {self.cache['csv']}")
-
-            # 一時ファイルの削除
-            for json_file in json_files:
-                json_file.unlink()
+            csv_path = self.cache['csv'] = os.path.join(self.path['csv'], statsDataId + '.csv')
+
+            if pages is None:
+                # 一時JSONファイルの取得(圧縮形式の異なる同じページは1つだけ使う)
+                page_files = list(dict(self._page_files(statsDataId)).values())
+                if not page_files:
+                    raise FileNotFoundError(f"No JSON files found for {statsDataId}")
+
+                logger.info(f"Converting {len(page_files)} JSON files to CSV")
+                pages = (self._load_page(page_file) for page_file in page_files)
+
+            # 途中で失敗した場合に不完全なCSVがキャッシュとして残らないようにする
+            part_path = _part_path(csv_path)
+            with open(part_path, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f, quoting=csv.QUOTE_NONNUMERIC)
+                keys = None
+                columns = None
+                n_rows = 0
+                # 次元(値以外の列)ごとのコード→行番号
+                dims = {}
+
+                for i, page in enumerate(pages):
+                    logger.info(f"Processing page {i+1}: {statsDataId}")
+                    STATISTICAL_DATA = page['GET_STATS_DATA']['STATISTICAL_DATA']
+                    VALUE = STATISTICAL_DATA['DATA_INF']['VALUE']
+                    VALUE = VALUE if isinstance(VALUE, list) else [VALUE]
+
+                    if i == 0:
+                        # ヘッダーと列ごとのコード→名称の対応表は最初のページで一度だけ作成
+                        keys = list(VALUE[0].keys())
+                        header = [k.replace('@', '') for k in keys]
+                        _h, _b = self._build_class_maps(STATISTICAL_DATA['CLASS_INF'])
+                        columns = [(k, _b.get(h)) for k, h in zip(keys, header)]
+                        dims = {h: (k, {}) for k, h in zip(keys, header) if h != '$'}
+                        writer.writerow([_h.get(h, h) for h in header])
+                        writer.writerow(header)
+
+                    for body in VALUE:
+                        row = []
+                        for k, names in columns:
+                            d = body.get(k, '')
+                            row.append(names.get(d, d) if names else d)
+                        writer.writerow(row)
+                    for k, postings in dims.values():
+                        for r, body in enumerate(VALUE, n_rows):
+                            d = body.get(k, '')
+                            p = postings.get(d)
+                            if p is None:
+                                p = postings[d] = array('I')
+                            p.append(r)
+                    n_rows += len(VALUE)
+                    del page, STATISTICAL_DATA, VALUE
+
+                if keys is None:
+                    raise FileNotFoundError(f"No JSON files found for {statsDataId}")
+
+            os.replace(part_path, csv_path)
+            logger.info(f"CSV created successfully: {csv_path}")
+            self.metrics.inc('converted_rows_total', n_rows)
+            self.response_cache.invalidate(statsDataId)
+
+            self.write_row_index(statsDataId)
+            self._write_dimension_index(statsDataId, n_rows, {h: p for h, (_, p) in dims.items()}, _b)
+            if self.columnar_cache and self.columnar_cache != 'lazy':
+                self.write_columnar_cache(statsDataId)
+
+            # 一時ファイルの削除(保持期間の設定がある場合は古いものから削除)
+            self._prune_pages(statsDataId)
 
             return True
         except Exception as e:
             logger.error(f"Failed to convert JSON to CSV: {e}")
-            self._cleanup_temp_files(statsDataId)
+            if hasattr(pages, 'close'):
+                pages.close()
+            if 'part_path' in locals() and os.path.exists(part_path):
+                os.remove(part_path)
+            if not self._is_upstream_error(e):
+                self._cleanup_temp_files(statsDataId)
             raise
 
+    def _is_text_column(self, col):
+        return (not isinstance(col.dtype, pd.CategoricalDtype) and
+                not pd.api.types.is_numeric_dtype(col) and
+                not pd.api.types.is_bool_dtype(col))
+
+    def _read_cache_csv(self, csv_path, keys, columns=None):
+        """キャッシュCSVを読み込む(コードや名称の列は文字列のまま、値の列のみ数値として解釈)"""
+        dims = [k for k in keys if '$' not in k]
+        return pd.read_csv(csv_path, skiprows=[0], usecols=columns,
+                           dtype={k: str for k in dims}, keep_default_na=False,
+                           na_values={k: [''] for k in keys if '$' in k})
+
+    def _columnar_path(self, statsDataId):
+        ext = '.feather' if pyarrow is not None else '.npz'
+        return os.path.join(self.path['csv'], statsDataId + ext)
+
+    # キャッシュCSVから型付きの列指向ファイル(Feather、pyarrowが無い場合はNumPyのnpz)を作成
+    def write_columnar_cache(self, statsDataId):
+        self._validate_stats_id(statsDataId)
+        csv_path = os.path.join(self.path['csv'], statsDataId + '.csv')
+        columnar_path = self._columnar_path(statsDataId)
+
+        try:
+            with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+                reader = csv.reader(f)
+                labels = next(reader)
+                keys = next(reader)
+            df = self._read_cache_csv(csv_path, keys)
+
+            # 値の種類が少ない文字列の列はカテゴリ型で保存
+            for c in df.columns:
+                if self._is_text_column(df[c]) and df[c].nunique() <= len(df) // 2:
+                    df[c] = df[c].astype('category')
+
+            meta = json.dumps({'labels': labels, 'keys': keys, 'columns': list(df.columns)},
+                              ensure_ascii=False)
+            part_path = _part_path(columnar_path)
+            if pyarrow is not None:
+                table = pyarrow.Table.from_pandas(df, preserve_index=False)
+                table = table.replace_schema_metadata(
+                    dict(table.schema.metadata or {}, estat=meta.encode('utf-8')))
+                pyarrow.feather.write_feather(table, part_path)
+            else:
+                arrays = {'__meta__': numpy.array(meta)}
+                for i, c in enumerate(df.columns):
+                    col = df[c]
+                    if isinstance(col.dtype, pd.CategoricalDtype):
+                        arrays[f'codes{i}'] = col.cat.codes.to_numpy()
+                        arrays[f'categories{i}'] = col.cat.categories.to_numpy(dtype=str)
+                    elif self._is_text_column(col):
+                        arrays[f'values{i}'] = col.fillna('').to_numpy(dtype=str)
+                    else:
+                        arrays[f'values{i}'] = col.to_numpy()
+                with open(part_path, 'wb') as f:
+                    numpy.savez(f, **arrays)
+            os.replace(part_path, columnar_path)
+
+            logger.info(f"Columnar cache created: {columnar_path}")
+            return columnar_path
+        except Exception as e:
+            logger.error(f"Failed to write columnar cache: {e}")
+            if 'part_path' in locals() and os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+
+    def _read_columnar_cache(self, columnar_path, columns=None):
+        if columnar_path.endswith('.feather'):
+            table = pyarrow.feather.read_table(columnar_path, columns=columns)
+            meta = json.loads(table.schema.metadata[b'estat'].decode('utf-8'))
+            del meta['columns']
+            return table.to_pandas(), meta
+
+        with numpy.load(columnar_path, allow_pickle=False) as npz:
+            meta = json.loads(str(npz['__meta__']))
+            data = {}
+            for i, c in enumerate(meta.pop('columns')):
+                if columns is not None and c not in columns:
+                    continue
+                if f'codes{i}' in npz:
+                    data[c] = pd.Categorical.from_codes(npz[f'codes{i}'], npz[f'categories{i}'])
+                else:
+                    data[c] = npz[f'values{i}']
+        return pd.DataFrame(data), meta
+
+    # キャッシュ済みの統計表をDataFrameとして読み込む(列名はキー行)
+    # 列指向キャッシュがあればそれを使い、無ければCSVから作成する
+    def load_table(self, statsDataId, columns=None, categorical=False):
+        self._validate_stats_id(statsDataId)
+        csv_path = os.path.join(self.path['csv'], statsDataId + '.csv')
+        columnar_path = self._columnar_path(statsDataId)
+
+        if (self.columnar_cache and os.path.exists(csv_path) and
+                (not os.path.exists(columnar_path) or
+                 os.path.getmtime(columnar_path) < os.path.getmtime(csv_path))):
+            self.write_columnar_cache(statsDataId)
+
+        if self.columnar_cache and os.path.exists(columnar_path):
+            df, meta = self._read_columnar_cache(columnar_path, columns)
+        else:
+            with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+                reader = csv.reader(f)
+                meta = {'labels': next(reader), 'keys': next(reader)}
+            df = self._read_cache_csv(csv_path, meta['keys'], columns)
+
+        if not categorical:
+            for c in df.columns:
+                if isinstance(df[c].dtype, pd.CategoricalDtype):
+                    df[c] = df[c].astype(df[c].cat.categories.dtype)
+        df.attrs.update(meta)
+        return df
+
+    def _table_header(self, statsDataId):
+        """キャッシュCSVの1行目(列名)と2行目(キー行)を取得"""
+        with open(os.path.join(self.path['csv'], statsDataId + '.csv'), 'r',
+                  encoding='utf-8', newline='') as f:
+            reader = csv.reader(f)
+            return next(reader), next(reader)
+
+    # aggregate: 集約方法(カンマ区切りで複数指定可, 例: 'sum,mean')
+    @_timed('merge_seconds')
     def merge_data(self, statsDataId, group_by, aggregate):
-        statsDataId_list = statsDataId.split(',')
+        # 重複したIDは1つにまとめる
+        statsDataId_list = list(dict.fromkeys(sid.strip() for sid in statsDataId.split(',')))
 
         # IDの検証
         for sid in statsDataId_list:
-            self._validate_stats_id(sid.strip())
+            self._validate_stats_id(sid)
+
+        aggregates = [a.strip() for a in (aggregate or '').split(',') if a.strip()]
+        for a in aggregates:
+            if a not in self.aggregates:
+                raise InvalidSelection(f"Invalid aggregate: {a}")
 
-        data = {}
         for sid in statsDataId_list:
-            sid = sid.strip()
-            csv_path = os.path.join(self.path['csv'], sid + '.csv')
-
-            if not os.path.exists(csv_path):
-                logger.info(f"Downloading data for {sid}")
-                self.get_all_data(sid, '1')
-                self.convert_raw_json_to_csv(sid)
-
-            data[sid] = pd.read_csv(csv_path, skiprows=[0])
-            data[sid]['stat-id'] = sid
-
-        # データの結合
-        for k, v in data.items():
-            v.rename(columns=lambda x: x.replace('$', '$' + k), inplace=True)
-
-        data = pd.concat([v for k, v in data.items()], ignore_index=True)
-
-        if group_by != 'all':
-            group_cols = group_by.split(',')
-
-            # 集約処理
-            if aggregate == 'sum':
-                data = data.groupby(group_cols).sum()
-            elif aggregate == 'min':
-                data = data.groupby(group_cols).min()
-            elif aggregate == 'max':
-                data = data.groupby(group_cols).max()
-            elif aggregate == 'median':
-                data = data.groupby(group_cols).median()
-            elif aggregate == 'count':
-                data = data.groupby(group_cols).count()
-            elif aggregate == 'var':
-                data = data.groupby(group_cols).var()
-            elif aggregate == 'std':
-                data = data.groupby(group_cols).std()
-            elif aggregate == 'mean':
-                data = data.groupby(group_cols).mean()
-
-            if aggregate:
-                data = data.loc[:, [c for c in data.columns if '$' in c]]
-            else:
+            self._ensure_cached(sid)
+
+        if group_by == 'all' or not aggregates:
+            data = {}
+            for sid in statsDataId_list:
+                data[sid] = self.load_table(sid)
+                data[sid]['stat-id'] = sid
+                data[sid].rename(columns=lambda x: x.replace('$', '$' + sid), inplace=True)
+
+            data = pd.concat(list(data.values()), ignore_index=True)
+            if group_by != 'all':
                 data = data.loc[:, [c for c in data.columns if '$' in c or group_by in c]]
+            data.attrs.clear()
+            return data.reset_index()
+
+        # 統計表ごとに必要な列だけを読み込み、結合前に集約する
+        group_cols = group_by.split(',')
+        frames = []
+        zero_fill = []
+        for sid in statsDataId_list:
+            keys = self._table_header(sid)[1]
+            for c in group_cols:
+                if c not in keys:
+                    raise InvalidSelection(f"Invalid group_by: {c}")
+            values = [k for k in keys if '$' in k and k not in group_cols]
+            df = self.load_table(sid, columns=group_cols + values, categorical=True)
+            renamed = {c: c.replace('$', '$' + sid) for c in values}
+            df = df.rename(columns=renamed)
+            values = list(renamed.values())
+            for c in values:
+                df[c] = pd.to_numeric(df[c], errors='coerce')
+
+            agg = df.groupby(group_cols, observed=True, sort=True)[values].agg(aggregates)
+            if len(aggregates) == 1:
+                agg.columns = agg.columns.droplevel(1)
+                if aggregates[0] in ('sum', 'count'):
+                    zero_fill += values
+            else:
+                agg.columns = [f'{c}_{a}' for c, a in agg.columns]
+                zero_fill += [f'{c}_{a}' for c in values for a in aggregates if a in ('sum', 'count')]
+
+            # カテゴリ型のキーは統計表ごとにカテゴリが異なるため元の型に戻して結合する
+            agg = agg.reset_index()
+            for c in group_cols:
+                if isinstance(agg[c].dtype, pd.CategoricalDtype):
+                    agg[c] = agg[c].astype(agg[c].cat.categories.dtype)
+            frames.append(agg.set_index(group_cols))
+
+        data = pd.concat(frames, axis=1).sort_index()
+        # 他の統計表にしか無いグループの合計・件数は0とする
+        data[zero_fill] = data[zero_fill].fillna(0)
+        data.attrs.clear()
 
         return data.reset_index()
 
@@ -494,46 +2645,217 @@ class e_Stat_API_Adaptor:
             logger.error(f"Failed to remove file {filepath}: {e}")
             raise
 
-    def get_csv(self, cmd, statsDataId):
+    @contextmanager
+    def _single_flight(self, statsDataId):
+        """同じstatsDataIdのダウンロード・変換を1つに制限する(スレッド間とプロセス間)"""
+        with _flight_locks_lock:
+            entry = _flight_locks.setdefault(statsDataId, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                if fcntl is None:
+                    yield
+                    return
+                path = os.path.join(self.path['tmp'], statsDataId + '.lock')
+                f = _lock_file(path)
+                try:
+                    yield
+                finally:
+                    _unlock_file(path, f)
+        finally:
+            with _flight_locks_lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del _flight_locks[statsDataId]
+
+    def _ensure_cached(self, statsDataId):
+        """キャッシュCSVが無ければダウンロードして作成し、そのパスを返す"""
         self._validate_stats_id(statsDataId)
-
-        cmd_map = {'get': 'cat', 'head': 'head', 'tail': 'tail'}
-        if cmd not in cmd_map:
-            raise ValueError(f"Invalid command: {cmd}")
-
         csv_path = os.path.join(self.path['csv'], statsDataId + '.csv')
+        self._expire_cached(statsDataId)
 
+        created = False
         if not os.path.exists(csv_path):
-            logger.info(f"CSV not found, downloading: {statsDataId}")
-            next_key = '1'
+            with self._single_flight(statsDataId):
+                # 待っている間に他のスレッド・プロセスが作成した場合はそれを使う
+                if not os.path.exists(csv_path):
+                    logger.info(f"CSV not found, downloading: {statsDataId}")
+                    # ダウンロードしたページはファイルから読み直さずにそのまま変換する
+                    self.convert_raw_json_to_csv(statsDataId, self.iter_pages(statsDataId))
+                    self.data_cache.record(statsDataId, self._cache_size(statsDataId))
+                    created = True
+
+        if created:
+            self.metrics.inc('data_cache_requests_total', result='miss')
+            # 他の統計表の削除はロックを解放してから行う(ロックの順序によるデッドロックを避ける)
+            self._enforce_cache_quota(statsDataId)
+        elif not _cache_accounted.get():
+            self.metrics.inc('data_cache_requests_total', result='hit')
+            self.data_cache.touch(statsDataId)
+        return csv_path
+
+    def _row_index_path(self, statsDataId):
+        return os.path.join(self.path['csv'], statsDataId + '.idx')
+
+    # キャッシュCSVの各データ行の開始位置(バイト)を記録したインデックスを作成
+    # (uint64リトルエンディアン、末尾にファイルサイズ)
+    def write_row_index(self, statsDataId):
+        self._validate_stats_id(statsDataId)
+        csv_path = os.path.join(self.path['csv'], statsDataId + '.csv')
+        idx_path = self._row_index_path(statsDataId)
+
+        offsets = array('Q')
+        with open(csv_path, 'rb') as f:
+            pos = len(f.readline())
+            pos += len(f.readline())
+            for line in f:
+                offsets.append(pos)
+                pos += len(line)
+            offsets.append(pos)
+        if sys.byteorder != 'little':
+            offsets.byteswap()
+
+        part_path = _part_path(idx_path)
+        with open(part_path, 'wb') as f:
+            offsets.tofile(f)
+        os.replace(part_path, idx_path)
+        return idx_path
+
+    def _read_row_range(self, statsDataId, csv_path, offset, limit):
+        """行インデックスを使ってoffset行目からlimit行を読み込む"""
+        idx_path = self._row_index_path(statsDataId)
+        if (not os.path.exists(idx_path) or
+                os.path.getmtime(idx_path) < os.path.getmtime(csv_path)):
+            self.write_row_index(statsDataId)
+
+        with open(idx_path, 'rb') as f:
+            n_rows = os.fstat(f.fileno()).st_size // 8 - 1
+            start = min(max(offset, 0), n_rows)
+            stop = n_rows if limit is None else min(start + max(limit, 0), n_rows)
+            f.seek(start * 8)
+            begin = struct.unpack('<Q', f.read(8))[0]
+            f.seek(stop * 8)
+            end = struct.unpack('<Q', f.read(8))[0]
+
+        with open(csv_path, 'rb') as f:
+            f.seek(begin)
+            data = f.read(end - begin)
+        return self._decode_lines(data)
+
+    def _dimension_index_path(self, statsDataId):
+        return os.path.join(self.path['csv'], statsDataId + '.dim')
+
+    def _write_dimension_index(self, statsDataId, n_rows, dims, class_maps):
+        """dims: {キー: {コード: array('I')}}, class_maps: {キー: {コード: 名称}}"""
+        names = {}
+        for key, postings in dims.items():
+            names[key] = {}
+            for code, name in class_maps.get(key, {}).items():
+                if code in postings and name != code:
+                    names[key].setdefault(name, []).append(code)
+        path = self._dimension_index_path(statsDataId)
+        DimensionIndex.write(path, n_rows, dims, names)
+        return path
+
+    # キャッシュCSVから次元ごとの索引を作成(索引の無い以前のキャッシュ用)
+    # CSVにはコードが無いため、この場合は名称でのみ絞り込める
+    def write_dimension_index(self, statsDataId):
+        self._validate_stats_id(statsDataId)
+        csv_path = os.path.join(self.path['csv'], statsDataId + '.csv')
 
-            if self._['next_key']:
-                while next_key != '-1':
-                    next_key = self.get_all_data(statsDataId, next_key)
-                    if next_key is None:
-                        raise Exception(f"Failed to download data for {statsDataId}")
-                    logger.info(f"Next key: {next_key}")
-            else:
-                self.get_all_data(statsDataId, next_key)
+        with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+            reader = csv.reader(f)
+            next(reader)
+            keys = next(reader)
+            dims = {k: {} for k in keys if k != '$'}
+            columns = [(i, dims[k]) for i, k in enumerate(keys) if k in dims]
+            n_rows = 0
+            for n_rows, row in enumerate(reader, 1):
+                for i, postings in columns:
+                    p = postings.get(row[i])
+                    if p is None:
+                        p = postings[row[i]] = array('I')
+                    p.append(n_rows - 1)
+        return self._write_dimension_index(statsDataId, n_rows, dims, {})
+
+    def _load_dimension_index(self, statsDataId, csv_path):
+        path = self._dimension_index_path(statsDataId)
+        if not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(csv_path):
+            self.write_dimension_index(statsDataId)
+        return DimensionIndex.load(path)
+
+    # where: {キー: [コードまたは名称, ...]}に一致する行番号(0始まり、昇順)
+    # 同じキーの値は和集合、キー間は共通部分。条件が無い場合は全ての行
+    def select_rows(self, statsDataId, where=None):
+        csv_path = self._ensure_cached(statsDataId)
+        index = self._load_dimension_index(statsDataId, csv_path)
+        rows = index.select(where or {})
+        return numpy.arange(index.rows) if rows is None else rows
+
+    def _iter_row_blocks(self, statsDataId, csv_path, rows):
+        """指定した行(昇順)をchunk_rows行ずつ文字列として読み込む(連続する行はまとめて読む)"""
+        idx_path = self._row_index_path(statsDataId)
+        if (not os.path.exists(idx_path) or
+                os.path.getmtime(idx_path) < os.path.getmtime(csv_path)):
+            self.write_row_index(statsDataId)
+        offsets = numpy.memmap(idx_path, dtype='<u8', mode='r')
+
+        with open(csv_path, 'rb') as f:
+            for i in range(0, len(rows), self.chunk_rows):
+                block = numpy.asarray(rows[i:i + self.chunk_rows], dtype=numpy.int64)
+                breaks = numpy.flatnonzero(numpy.diff(block) != 1) + 1
+                starts = block[numpy.r_[0, breaks]]
+                stops = block[numpy.r_[breaks - 1, len(block) - 1]] + 1
+                parts = []
+                for begin, end in zip(offsets[starts].tolist(), offsets[stops].tolist()):
+                    f.seek(begin)
+                    parts.append(f.read(end - begin))
+                yield self._decode_lines(b''.join(parts))
+
+    def _tail_rows(self, csv_path, n):
+        """ファイル末尾から逆方向に読み込み、最後のn行を返す"""
+        with open(csv_path, 'rb') as f:
+            # データ行の開始位置(2行目のキー行の直後)
+            f.readline()
+            f.readline()
+            first = f.tell()
+            pos = f.seek(0, os.SEEK_END)
+            data = b''
+            while pos > first and data.count(b'\n') <= n:
+                step = min(1 << 13, pos - first)
+                pos -= step
+                f.seek(pos)
+                data = f.read(step) + data
+        return self._decode_lines(b''.join(data.splitlines(keepends=True)[-n:]))
+
+    def _decode_lines(self, data):
+        # テキストモードでの読み込みと同様に改行を\nに揃える
+        return data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+
+    # cmd: get(全体), head(先頭5行), tail(末尾5行), range(offset行目からlimit行)
+    def get_csv(self, cmd, statsDataId, offset=0, limit=None):
+        self._validate_stats_id(statsDataId)
+
+        cmd_map = {'get': 'cat', 'head': 'head', 'tail': 'tail', 'range': 'range'}
+        if cmd not in cmd_map:
+            raise ValueError(f"Invalid command: {cmd}")
 
-            self.convert_raw_json_to_csv(statsDataId)
+        csv_path = self._ensure_cached(statsDataId)
 
-        # CSVの読み込み
+        # CSVの読み込み(2行目のキー行は除外)
         try:
             with open(csv_path, 'r', encoding='utf-8') as f:
-                lines = f.readlines()
-
-            # 2行目(キー行)を除外
-            lines = [lines[0]] + lines[2:]
-
-            if cmd == 'head':
-                result = ''.join(lines[:6])  # ヘッダー + 5行
-            elif cmd == 'tail':
-                result = ''.join([lines[0]] + lines[-5:])  # ヘッダー + 最後の5行
-            else:
-                result = ''.join(lines)
-
-            return result
+                header = f.readline()
+                f.readline()
+                if cmd == 'head':
+                    return header + ''.join(itertools.islice(f, 5))  # ヘッダー + 5行
+                elif cmd == 'get':
+                    return header + f.read()
+
+            if cmd == 'tail':
+                return header + self._tail_rows(csv_path, 5)  # ヘッダー + 最後の5行
+            return header + self._read_row_range(statsDataId, csv_path, int(offset),
+                                                 None if limit is None else int(limit))
         except Exception as e:
             logger.error(f"Failed to read CSV: {e}")
             raise
@@ -542,42 +2864,430 @@ class e_Stat_API_Adaptor:
         logger.error(txt)
         return txt
 
-    def get_output(self, data, output_type):
-        def get_tmp_data(tmp_data_0_j, tmp_data_i_j):
-            if re.match(r'^\$\d+$', tmp_data_0_j) or tmp_data_0_j == '$':
-                return float(tmp_data_i_j) if tmp_data_i_j != '' else None
-            else:
-                return tmp_data_i_j
+    # 値の列($, $統計表ID, $統計表ID_集約方法)か否か
+    def _is_value_column(self, name):
+        return name == '$' or re.match(r'^\$\d+(_[a-z]+)?$', name) is not None
 
+    def _to_numbers(self, values):
+        """列の値を一括で数値に変換(空文字や数値でない値はNone)"""
+        arr = numpy.asarray(values)
+        if arr.dtype.kind not in 'fiub':
+            arr = arr.astype(str)
+            try:
+                arr = numpy.where(arr == '', 'nan', arr).astype(float)
+            except ValueError:
+                arr = numpy.array([self._parse_float(v) for v in arr], dtype=float)
+        arr = arr.astype(float)
+        out = arr.astype(object)
+        out[numpy.isnan(arr)] = None
+        return out.tolist()
+
+    def _parse_float(self, value):
+        try:
+            return float(value)
+        except ValueError:
+            return numpy.nan
+
+    def _dumps(self, obj):
+        if orjson is not None:
+            return orjson.dumps(obj).decode('utf-8')
+        return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+    def _series_values(self, name, col):
+        if self._is_value_column(name):
+            return self._to_numbers(col.to_numpy())
+        return col.astype(object).where(col.notna(), '').astype(str).tolist()
+
+    def _frame_header(self, data):
+        """DataFrameの出力時の列名(load_tableで読み込んだ場合は1行目の列名)"""
+        labels = data.attrs.get('labels')
+        return list(labels) if labels and len(labels) == len(data.columns) else list(data.columns)
+
+    def _output_columns(self, data):
+        """CSV文字列またはDataFrameを(列名, 変換済みの列)に分解"""
+        if _is_frame(data):
+            header = self._frame_header(data)
+            return header, [self._series_values(h, data[c]) for h, c in zip(header, data.columns)]
+
+        rows = list(csv.reader(io.StringIO(data.strip())))
+        header = rows[0]
+        columns = [list(c) for c in zip(*rows[1:])] if len(rows) > 1 else [[] for _ in header]
+        # 列の型は列ごとに一度だけ判定する
+        columns = [self._to_numbers(c) if self._is_value_column(h) else c
+                   for h, c in zip(header, columns)]
+        return header, columns
+
+    # data: get_csv等が返すCSV文字列、またはload_table/merge_dataが返すDataFrame
+    @_timed('serialize_seconds', format='output_type')
+    def get_output(self, data, output_type):
         if output_type == 'csv':
+            if _is_frame(data):
+                header = self._frame_header(data)
+                return data.to_csv(quoting=csv.QUOTE_NONNUMERIC, index=None, header=header)
             return data
         elif output_type == 'rjson':
-            tmp_data = list(csv.reader(io.StringIO(data.strip())))
-            data = []
-            for i in range(1, len(tmp_data)):
-                row_data = {}
-                for j in range(len(tmp_data[i])):
-                    row_data[tmp_data[0][j]] = get_tmp_data(
-                        tmp_data[0][j], tmp_data[i][j])
-                data.append(row_data)
-            return json.dumps(data, ensure_ascii=False)
+            header, columns = self._output_columns(data)
+            return self._dumps([dict(zip(header, row)) for row in zip(*columns)])
         elif output_type == 'cjson':
-            tmp_data = list(csv.reader(io.StringIO(data.strip())))
-            data = {}
-            for i in range(len(tmp_data[0])):
-                data[tmp_data[0][i]] = [
-                    get_tmp_data(tmp_data[0][i], tmp_data[j][i])
-                    for j in range(1, len(tmp_data))
-                ]
-            return json.dumps(data, ensure_ascii=False)
+            header, columns = self._output_columns(data)
+            return self._dumps(dict(zip(header, columns)))
         else:
             return self.error(self.msg['check-extension'])
 
+    # 統計表を指定した形式で出力(JSONの場合、列指向キャッシュがあればCSVを経由せずに作成)
+    def get_table_output(self, cmd, statsDataId, output_type, offset=0, limit=None):
+        if cmd == 'get' and output_type in ('rjson', 'cjson') and self.columnar_cache:
+            self._ensure_cached(statsDataId)
+            return self.get_output(self.load_table(statsDataId), output_type)
+        return self.get_output(self.get_csv(cmd, statsDataId, offset, limit), output_type)
+
+    # 出力を分割して返すジェネレーター(Flaskのストリーミングレスポンス用)
+    # data: CSV文字列またはDataFrame
+    def iter_output(self, data, output_type):
+        if output_type not in ('csv', 'rjson', 'cjson'):
+            return iter([self.error(self.msg['check-extension'])])
+        if not _is_frame(data):
+            return iter([self.get_output(data, output_type)])
+
+        if output_type == 'csv':
+            chunks = self._iter_frame_csv(data)
+        elif output_type == 'rjson':
+            chunks = self._iter_rjson(
+                self._output_columns(data.iloc[i:i + self.chunk_rows])
+                for i in range(0, len(data), self.chunk_rows))
+        else:
+            chunks = self._iter_cjson(
+                (h, self._series_values(h, data[c]))
+                for h, c in zip(self._frame_header(data), data.columns))
+        return self._timed_chunks(chunks, output_type)
+
+    # 統計表を分割して出力(キャッシュCSVを先頭から順に読むため、メモリ使用量は表の大きさに依存しない)
+    # where/colsを指定した場合は次元の索引で絞り込んだ行・列のみを出力(iter_selectionを参照)
+    def iter_table_output(self, cmd, statsDataId, output_type, offset=0, limit=None, where=None, cols=None):
+        self._validate_stats_id(statsDataId)
+        if output_type not in ('csv', 'rjson', 'cjson'):
+            return iter([self.error(self.msg['check-extension'])])
+        if where or cols:
+            return self.iter_selection(cmd, statsDataId, output_type, where, cols, offset, limit)
+        if cmd != 'get':
+            return iter([self.get_table_output(cmd, statsDataId, output_type, offset, limit)])
+
+        # ダウンロードはレスポンスの送信開始前に行い、エラーを通常どおり返せるようにする
+        csv_path = self._ensure_cached(statsDataId)
+        if output_type == 'csv':
+            chunks = self._iter_csv_file(csv_path)
+        elif output_type == 'rjson':
+            chunks = self._iter_rjson(self._iter_csv_chunks(csv_path))
+        else:
+            chunks = self._iter_cjson(self._iter_table_columns(statsDataId, csv_path))
+        return self._timed_chunks(chunks, output_type)
+
+    # getのクエリ文字列から絞り込み条件と出力する列を取り出す
+    # 例: ?area=13000,14000&time=2020000000&cols=area,time,$
+    def selection_args(self, args):
+        reserved = ('offset', 'limit', 'dl', 'cols')
+        where = {k: [v for v in args[k].split(',') if v] for k in args if k not in reserved}
+        cols = [c for c in args.get('cols', '').split(',') if c]
+        return where, cols or None
+
+    def _pick_columns(self, labels, keys, cols):
+        """colsの各列(キー行の名前または列名)の位置"""
+        if not cols:
+            return list(range(len(keys)))
+        picks = []
+        for c in cols:
+            if c in keys:
+                picks.append(keys.index(c))
+            elif c in labels:
+                picks.append(labels.index(c))
+            else:
+                raise InvalidSelection(f"Invalid column: {c}")
+        return picks
+
+    # where: {キー: [コードまたは名称, ...]}で行を絞り込み、cols: 列(キー行の名前または列名)を選んで出力
+    # 読み込むのは一致した行のみのため、処理時間と出力の大きさは一致した行数に比例する
+    # cmd: get(全体), head(先頭5行), tail(末尾5行), range(offset行目からlimit行)は絞り込み後の行に対して適用
+    def iter_selection(self, cmd, statsDataId, output_type, where=None, cols=None, offset=0, limit=None):
+        self._validate_stats_id(statsDataId)
+        if cmd not in ('get', 'head', 'tail', 'range'):
+            raise ValueError(f"Invalid command: {cmd}")
+        if output_type not in ('csv', 'rjson', 'cjson'):
+            return iter([self.error(self.msg['check-extension'])])
+
+        csv_path = self._ensure_cached(statsDataId)
+        labels, keys = self._table_header(statsDataId)
+        picks = self._pick_columns(labels, keys, cols)
+        rows = self.select_rows(statsDataId, where)
+        if cmd == 'head':
+            rows = rows[:5]
+        elif cmd == 'tail':
+            rows = rows[-5:]
+        elif cmd == 'range':
+            start = max(int(offset), 0)
+            rows = rows[start:] if limit is None else rows[start:start + max(int(limit), 0)]
+
+        header = [labels[i] for i in picks]
+        blocks = self._iter_row_blocks(statsDataId, csv_path, rows)
+        if output_type == 'csv':
+            chunks = self._iter_selected_csv(header, picks, len(keys), blocks)
+        elif output_type == 'rjson':
+            chunks = self._iter_rjson(self._iter_selected_columns(header, picks, blocks))
+        else:
+            chunks = self._iter_cjson(self._selected_columns(header, picks, blocks))
+        return self._timed_chunks(chunks, output_type)
+
+    def _iter_selected_csv(self, header, picks, n_columns, blocks):
+        buf = io.StringIO()
+        writer = csv.writer(buf, quoting=csv.QUOTE_NONNUMERIC, lineterminator='\n')
+        writer.writerow(header)
+        yield buf.getvalue()
+        for block in blocks:
+            if picks == list(range(n_columns)):
+                # 全ての列を出力する場合はキャッシュCSVの行をそのまま返す
+                yield block
+                continue
+            buf.seek(0)
+            buf.truncate()
+            writer.writerows([r[i] for i in picks] for r in csv.reader(io.StringIO(block)))
+            yield buf.getvalue()
+
+    def _iter_selected_columns(self, header, picks, blocks):
+        """読み込んだ行を(列名, 変換済みの列)としてchunk_rows行ずつ返す"""
+        is_value = [self._is_value_column(h) for h in header]
+        for block in blocks:
+            rows = list(csv.reader(io.StringIO(block)))
+            columns = [[r[i] for r in rows] for i in picks]
+            yield header, [self._to_numbers(c) if v else c for v, c in zip(is_value, columns)]
+
+    def _selected_columns(self, header, picks, blocks):
+        columns = [[] for _ in picks]
+        for _, chunk in self._iter_selected_columns(header, picks, blocks):
+            for column, values in zip(columns, chunk):
+                column.extend(values)
+        return zip(header, columns)
+
+    def _timed_chunks(self, chunks, output_type):
+        """分割出力の作成にかかった時間(送信待ちの時間は含まない)を記録"""
+        elapsed = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed += time.perf_counter() - start
+                yield chunk
+        finally:
+            self.metrics.observe('serialize_seconds', elapsed, format=output_type)
+
+    def _iter_csv_file(self, csv_path):
+        with open(csv_path, 'r', encoding='utf-8') as f:
+            yield f.readline()
+            # 2行目(キー行)を除外
+            f.readline()
+            while True:
+                chunk = f.read(1 << 20)
+                if not chunk:
+                    break
+                yield chunk
+
+    def _iter_frame_csv(self, data):
+        header = self._frame_header(data)
+        yield data.iloc[0:0].to_csv(quoting=csv.QUOTE_NONNUMERIC, index=None, header=header)
+        for i in range(0, len(data), self.chunk_rows):
+            yield data.iloc[i:i + self.chunk_rows].to_csv(
+                quoting=csv.QUOTE_NONNUMERIC, index=None, header=False)
+
+    def _iter_csv_chunks(self, csv_path):
+        """キャッシュCSVをchunk_rows行ずつ(列名, 変換済みの列)として読み込む"""
+        with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            next(reader)
+            is_value = [self._is_value_column(h) for h in header]
+            while True:
+                rows = [r for _, r in zip(range(self.chunk_rows), reader)]
+                if not rows:
+                    break
+                columns = [self._to_numbers(c) if v else list(c)
+                           for v, c in zip(is_value, zip(*rows))]
+                yield header, columns
+
+    def _iter_table_columns(self, statsDataId, csv_path):
+        """統計表を1列ずつ(列名, 変換済みの列)として読み込む"""
+        if self.columnar_cache:
+            labels, keys = self._table_header(statsDataId)
+            for label, key in zip(labels, keys):
+                col = self.load_table(statsDataId, columns=[key])[key]
+                yield label, self._series_values(label, col)
+            return
+
+        with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+            header = next(csv.reader(f))
+        for i, h in enumerate(header):
+            with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+                reader = csv.reader(f)
+                next(reader)
+                next(reader)
+                values = [r[i] for r in reader]
+            yield h, self._to_numbers(values) if self._is_value_column(h) else values
+
+    def _iter_rjson(self, chunks):
+        yield '['
+        first = True
+        for header, columns in chunks:
+            rows = [dict(zip(header, row)) for row in zip(*columns)]
+            if rows:
+                body = self._dumps(rows)[1:-1]
+                yield body if first else ',' + body
+                first = False
+        yield ']'
+
+    def _iter_cjson(self, columns):
+        yield '{'
+        for i, (name, values) in enumerate(columns):
+            yield (',' if i else '') + self._dumps(name) + ':' + self._dumps(values)
+        yield '}'
+
+    def _gzip_chunks(self, chunks):
+        z = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            data = z.compress(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+            if data:
+                yield data
+        yield z.flush()
+
     def mimetype(self, ext):
         mt = 'text/plain' if ext == 'csv' else 'application/json'
-        if request.args.get('dl') == 'true':
+        if flask.request.args.get('dl') == 'true':
             mt = 'application/octet-stream'
         return mt
 
+    # res: 文字列、またはiter_output/iter_table_outputが返すジェネレーター
     def response(self, res, ext):
-        return Response(res, mimetype=self.mimetype(ext), headers=self.header)
+        headers = dict(self.header)
+        # 'gzip': Trueの場合、gzipに対応したクライアントには圧縮して返す
+        if self._.get('gzip') and 'gzip' in flask.request.headers.get('Accept-Encoding', ''):
+            res = self._gzip_chunks([res] if isinstance(res, (str, bytes)) else res)
+            headers['Content-Encoding'] = 'gzip'
+            headers['Vary'] = 'Accept-Encoding'
+        if not isinstance(res, (str, bytes)):
+            res = flask.stream_with_context(res)
+        return flask.Response(res, mimetype=self.mimetype(ext), headers=headers)
+
+    # 元ファイル(deps)のmtimeをキーに含めてレスポンスをキャッシュし、ETag/Last-Modifiedを付与する
+    # produce: レスポンス本体(文字列またはジェネレーター)を作成する関数
+    # tags: invalidateで削除するための目印(統計表IDや'search')
+    # tables: レスポンスの元になる統計表(キャッシュから返す場合も有効期間の確認とアクセスの記録を行う)
+    def cached_response(self, ext, deps, tags, produce, tables=()):
+        request = flask.request
+        for sid in tables:
+            self._validate_stats_id(sid)
+            # 有効期間を過ぎた統計表は削除され、depsが無くなるためproduceで作り直す
+            self._expire_cached(sid)
+
+        def current_key():
+            try:
+                mtimes = tuple(os.stat(p).st_mtime_ns for p in deps)
+            except FileNotFoundError:
+                return None, None
+            key = (request.path, tuple(sorted(request.args.items(multi=True))), mtimes)
+            return key, max(mtimes) / 1e9 if mtimes else None
+
+        def touch():
+            """produceを呼ばずに返す場合も統計表へのアクセスとして記録する(LRU/LFU用)"""
+            for sid in tables:
+                self.metrics.inc('data_cache_requests_total', result='hit')
+                self.data_cache.touch(sid)
+
+        key, last_modified = current_key()
+        body = None
+        if key is not None:
+            etag = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+            if (request.if_none_match.contains_weak(etag) or
+                    (request.if_modified_since is not None and not request.if_none_match and
+                     int(last_modified) <= request.if_modified_since.timestamp())):
+                self.metrics.inc('response_cache_requests_total', result='not_modified')
+                touch()
+                res = flask.Response(status=304, headers=self.header)
+                res.set_etag(etag, weak=True)
+                return res
+            body = self.response_cache.get(key)
+        self.metrics.inc('response_cache_requests_total', result='miss' if body is None else 'hit')
+        if body is not None:
+            touch()
+
+        if body is None:
+            res = produce()
+            # 元ファイルはproduceの中で作成される場合がある(未キャッシュの統計表)
+            key, last_modified = current_key()
+            if key is not None and self.response_cache.max_bytes > 0:
+                res = self._tee_to_cache(res, key, tags)
+        else:
+            res = body
+
+        res = self.response(res, ext)
+        if key is not None:
+            res.set_etag(hashlib.sha1(repr(key).encode('utf-8')).hexdigest(), weak=True)
+            res.last_modified = last_modified
+        return res
+
+    def _tee_to_cache(self, res, key, tags):
+        """レスポンスを送信しながら保存し、1件の上限以下の大きさであればキャッシュに登録する
+        (上限を超えた時点で保存をやめるため、大きなレスポンスをメモリーに溜めない)"""
+        if isinstance(res, (str, bytes)):
+            body = res.encode('utf-8') if isinstance(res, str) else res
+            self.response_cache.put(key, body, tags)
+            return body
+
+        def tee():
+            buf = []
+            size = 0
+            for chunk in res:
+                chunk = chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+                if buf is not None:
+                    size += len(chunk)
+                    if size > self.response_cache.max_entry_bytes:
+                        buf = None
+                    else:
+                        buf.append(chunk)
+                yield chunk
+            if buf is not None:
+                self.response_cache.put(key, b''.join(buf), tags)
+        return tee()
+
+    # /metrics用(Prometheusのテキスト形式)
+    def metrics_text(self):
+        entries, size = self.data_cache.totals()
+        jobs = self.jobs.counts()
+        return self.metrics.render({
+            'response_cache_bytes': self.response_cache.size,
+            'data_cache_entries': entries,
+            'data_cache_bytes': size,
+            'cache_jobs_queued': jobs['queued'],
+            'cache_jobs_running': jobs['running'],
+            'upstream_circuit_open': int(self.upstream.breaker.is_open)
+        })
+
+    def metrics_response(self):
+        return flask.Response(self.metrics_text(), mimetype='text/plain; version=0.0.4')
+
+    # リクエストの計測を開始(Flaskのbefore_requestで呼び出す)
+    def start_request(self):
+        flask.request.environ['estat.start'] = time.perf_counter()
+        self.metrics.start_request()
+
+    # リクエストの所要時間を記録し、'server_timing': Trueの場合はServer-Timingヘッダーを付与する
+    # (Flaskのafter_requestで呼び出す。ストリーミングの場合は送信開始までの時間)
+    def finish_request(self, res):
+        start = flask.request.environ.get('estat.start')
+        if start is not None:
+            self.metrics.observe('request_seconds', time.perf_counter() - start,
+                                 endpoint=flask.request.endpoint or '', status=res.status_code)
+        if self._.get('server_timing'):
+            timing = self.metrics.server_timing()
+            if timing:
+                res.headers['Server-Timing'] = timing
+        return res
@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  e-Stat API Adaptor (asyncio)
+#  (c) 2016 National Statistics Center
+#  License: MIT
+#
+# # # # # # # # # # # # # # # # # # # # # # # #
+
+import os
+import copy
+import json
+import asyncio
+import logging
+import functools
+import contextvars
+from contextlib import asynccontextmanager
+import aiohttp
+from e_Stat_API_Adaptor import (e_Stat_API_Adaptor, UpstreamUnavailable, InvalidSelection, _part_path,
+                                _cache_accounted, _lock_file, _unlock_file)
+
+# プロセス間のロックに使用(Windowsではプロセス内のロックのみ)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+async def _to_thread(func, *args):
+    """funcをスレッドで実行(asyncio.to_threadはPython 3.9以上のため同等の処理を行う)"""
+    loop = asyncio.get_running_loop()
+    # contextvarsの値(Server-Timingの計測等)をスレッドに引き継ぐ
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(None, functools.partial(context.run, func, *args))
+
+
+class e_Stat_API_Adaptor_async:
+    """e_Stat_API_Adaptorのasyncio版
+
+    上流APIへの通信はaiohttpのコネクションプールで非同期に行い、
+    ファイルの読み書きや変換は同期版のメソッドをスレッドで実行する。
+    """
+
+    def __init__(self, _, adaptor=None):
+        # 同期版のインスタンス(パス・インデックス・キャッシュ等を共有)
+        self.adaptor = adaptor if adaptor is not None else e_Stat_API_Adaptor(_)
+        self._ = self.adaptor._
+        self.path = self.adaptor.path
+        # 同時に接続する上流APIへのコネクション数
+        self.connections = int(self._.get('connections', 100))
+        # HTTPセッションとstatsDataIdごとのロック(for_appで作成した複製とも共有)
+        # locks: statsDataId→[ロック, 使用中・待機中のタスク数](使われなくなると削除)
+        self._shared = {'session': None, 'locks': {}}
+
+    # appId等をリクエストごとに持つ複製を作成
+    def for_app(self, appId):
+        adaptor = copy.copy(self)
+        adaptor.adaptor = self.adaptor.for_app(appId)
+        adaptor._ = adaptor.adaptor._
+        return adaptor
+
+    async def _get_session(self):
+        session = self._shared['session']
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=self.connections)
+            session = aiohttp.ClientSession(connector=connector)
+            self._shared['session'] = session
+        return session
+
+    async def close(self):
+        if self._shared['session'] is not None:
+            await self._shared['session'].close()
+            self._shared['session'] = None
+
+    # 同期版と共有するUpstreamClientで流量制限・再試行・サーキットブレーカーを適用してGETを送信し、
+    # 成功した応答を返す(本文の読み込み中の失敗は再試行しない)
+    @asynccontextmanager
+    async def _request(self, uri, timeout, api):
+        session = await self._get_session()
+        upstream = self.adaptor.upstream
+        attempt = 0
+        while True:
+            wait, trial = upstream.reserve(self._['appId'], api)
+            try:
+                await asyncio.sleep(wait)
+                response = await session.get(uri, timeout=timeout)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                delay = upstream.outcome(self._['appId'], api, attempt)
+                if delay is None:
+                    raise
+            except BaseException:
+                # クライアントの切断によるキャンセル等で結果を記録しない場合は試行を解放する
+                if trial:
+                    upstream.breaker.abort()
+                raise
+            else:
+                delay = upstream.outcome(self._['appId'], api, attempt, response.status,
+                                         response.headers.get('Retry-After'))
+                if delay is None:
+                    try:
+                        response.raise_for_status()
+                        yield response
+                    finally:
+                        response.release()
+                    return
+                response.release()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def _get(self, uri, timeout, api):
+        with self.adaptor.metrics.timer('upstream_request_seconds', api=api):
+            async with self._request(uri, aiohttp.ClientTimeout(total=timeout), api) as response:
+                body = await response.read()
+        self.adaptor.metrics.inc('upstream_bytes_total', len(body), api=api)
+        return body
+
+    async def _fetch_page(self, statsDataId, next_key):
+        """1ページ分をダウンロードしてtmp/に保存し、RESULT_INFを返す"""
+        tmp_path = self.adaptor._page_path(statsDataId, next_key)
+
+        if self.adaptor._page_reusable(tmp_path):
+            self.adaptor.metrics.inc('pages_total', source='tmp')
+            data = await _to_thread(self.adaptor._load_page, tmp_path)
+        else:
+            logger.info(f"Fetching data from API: {statsDataId}, position: {next_key}")
+            body = await self._get(self.adaptor._page_uri(statsDataId, next_key), 60, 'getStatsData')
+            self.adaptor.metrics.inc('pages_total', source='api')
+            data = await _to_thread(self._parse_and_save, tmp_path, body)
+
+        return data['GET_STATS_DATA']['STATISTICAL_DATA']['RESULT_INF']
+
+    def _parse_and_save(self, tmp_path, body):
+        data = json.loads(body)
+        self.adaptor._save_page(tmp_path, body)
+        return data
+
+    # 全ページをダウンロード(総件数が判明した後は残りのページを並行して取得)
+    # 戻り値: 今回の取得で使ったページの開始位置(順番どおり)。tmp/に残っている他のページは含まない
+    async def download_all_data(self, statsDataId, concurrency=None):
+        self.adaptor._validate_stats_id(statsDataId)
+        concurrency = self.adaptor.concurrency if concurrency is None else int(concurrency)
+
+        try:
+            fetched = ['1']
+            RESULT_INF = await self._fetch_page(statsDataId, '1')
+            if not self._['next_key'] or 'NEXT_KEY' not in RESULT_INF:
+                return fetched
+
+            positions = self.adaptor._remaining_positions(RESULT_INF)
+            if positions is None:
+                # 総件数が不明な場合はNEXT_KEYを順に辿る
+                next_key = str(RESULT_INF['NEXT_KEY'])
+                while next_key != '-1':
+                    fetched.append(next_key)
+                    RESULT_INF = await self._fetch_page(statsDataId, next_key)
+                    next_key = str(RESULT_INF.get('NEXT_KEY', '-1'))
+                return fetched
+
+            semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+            async def fetch(position):
+                async with semaphore:
+                    return await self._fetch_page(statsDataId, position)
+
+            results = await asyncio.gather(*[fetch(p) for p in positions])
+            # 各ページのNEXT_KEYが次のページの開始位置と一致するか確認し、ずれていればNEXT_KEYを順に辿る
+            for i, RESULT_INF in enumerate(results):
+                next_key = str(RESULT_INF.get('NEXT_KEY', '-1'))
+                expected = positions[i + 1] if i + 1 < len(positions) else '-1'
+                if next_key != expected:
+                    logger.warning(f"Unexpected NEXT_KEY for {statsDataId}: {next_key} "
+                                   f"(expected {expected}), following NEXT_KEY instead")
+                    await _to_thread(self.adaptor._discard_pages, statsDataId, positions[i + 1:])
+                    fetched += positions[:i + 1]
+                    while next_key != '-1':
+                        fetched.append(next_key)
+                        RESULT_INF = await self._fetch_page(statsDataId, next_key)
+                        next_key = str(RESULT_INF.get('NEXT_KEY', '-1'))
+                    return fetched
+            return fetched + positions
+        except (aiohttp.ClientError, asyncio.TimeoutError, UpstreamUnavailable) as e:
+            # 取得済みのページは残し、次回は失敗したページから再開する
+            logger.error(f"API request failed: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"Unexpected error in download_all_data: {e}")
+            self.adaptor._cleanup_temp_files(statsDataId)
+            raise
+
+    # 全ての統計IDをダウンロード
+    async def load_all_ids(self):
+        load_uri = self.adaptor.build_uri({
+            'appId': self._['appId'],
+            'searchWord': ''
+        }).replace('getStatsData', 'getStatsList')
+
+        logger.info(f"Downloading all statistics IDs from: {load_uri}")
+        # 数百MBになるため、メモリに展開せずにそのままファイルへ書き込む
+        part_path = _part_path(self.path['statid-json'])
+        metrics = self.adaptor.metrics
+        try:
+            with metrics.timer('upstream_request_seconds', api='getStatsList'):
+                timeout = aiohttp.ClientTimeout(total=None, sock_read=30)
+                async with self._request(load_uri, timeout, 'getStatsList') as response:
+                    with open(part_path, 'wb') as f:
+                        async for chunk in response.content.iter_chunked(1 << 20):
+                            f.write(chunk)
+                            metrics.inc('upstream_bytes_total', len(chunk), api='getStatsList')
+            await _to_thread(self.adaptor.check_statid_json, part_path)
+            os.replace(part_path, self.path['statid-json'])
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        logger.info(f"Successfully saved to: {self.path['statid-json']}")
+        return True
+
+    # 統計センターが作成するindexのダウンロード
+    async def load_stat_center_index(self):
+        logger.info(f"Downloading stat center index from: {self.path['url-dictionary-stat-center']}")
+        body = await self._get(self.path['url-dictionary-stat-center'], 30, 'stat-center-index')
+        with open(self.path['dictionary-stat-center'], 'wb') as f:
+            f.write(body)
+        return True
+
+    # tmp/<statsDataId>.lockでプロセス間のロックを取得(Windowsではプロセス内のロックのみ)
+    @asynccontextmanager
+    async def _file_lock(self, statsDataId):
+        if fcntl is None:
+            yield
+            return
+        path = os.path.join(self.path['tmp'], statsDataId + '.lock')
+        task = asyncio.ensure_future(_to_thread(_lock_file, path))
+        try:
+            f = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # 待っている間にキャンセルされた場合は、スレッドがロックを取得した後に解放する
+            task.add_done_callback(lambda t: t.cancelled() or t.exception() or _unlock_file(path, t.result()))
+            raise
+        try:
+            yield
+        finally:
+            _unlock_file(path, f)
+
+    # キャッシュCSVが無ければダウンロードして作成し、そのパスを返す
+    # 同じstatsDataIdへの同時リクエストではダウンロード・変換は1回だけ行う
+    async def ensure_cached(self, statsDataId):
+        self.adaptor._validate_stats_id(statsDataId)
+        csv_path = os.path.join(self.path['csv'], statsDataId + '.csv')
+        await _to_thread(self.adaptor._expire_cached, statsDataId)
+        if os.path.exists(csv_path):
+            self.adaptor.metrics.inc('data_cache_requests_total', result='hit')
+            await _to_thread(self.adaptor.data_cache.touch, statsDataId)
+            return csv_path
+
+        created = False
+        locks = self._shared['locks']
+        entry = locks.setdefault(statsDataId, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0], self._file_lock(statsDataId):
+                if not os.path.exists(csv_path):
+                    logger.info(f"CSV not found, downloading: {statsDataId}")
+                    positions = await self.download_all_data(statsDataId)
+                    await _to_thread(self._convert, statsDataId, positions)
+                    created = True
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del locks[statsDataId]
+
+        self.adaptor.metrics.inc('data_cache_requests_total', result='miss' if created else 'hit')
+        if created:
+            await _to_thread(self.adaptor._enforce_cache_quota, statsDataId)
+        else:
+            await _to_thread(self.adaptor.data_cache.touch, statsDataId)
+        return csv_path
+
+    async def _cached_call(self, func, *args):
+        """ensure_cachedの後に同期版をスレッドで実行(同期版ではキャッシュのヒットを重複して記録しない)"""
+        token = _cache_accounted.set(True)
+        try:
+            return await _to_thread(func, *args)
+        finally:
+            _cache_accounted.reset(token)
+
+    def _convert(self, statsDataId, positions):
+        """今回取得したページ(開始位置)だけを変換する(以前の取得で残ったページは混ぜない)"""
+        adaptor = self.adaptor
+        pages = (adaptor._load_page(adaptor._page_path(statsDataId, p)) for p in positions)
+        adaptor.convert_raw_json_to_csv(statsDataId, pages)
+        self.adaptor.data_cache.record(statsDataId, self.adaptor._cache_size(statsDataId))
+
+    async def get_csv(self, cmd, statsDataId, offset=0, limit=None):
+        await self.ensure_cached(statsDataId)
+        return await self._cached_call(self.adaptor.get_csv, cmd, statsDataId, offset, limit)
+
+    async def get_table_output(self, cmd, statsDataId, output_type, offset=0, limit=None):
+        await self.ensure_cached(statsDataId)
+        return await self._cached_call(
+            self.adaptor.get_table_output, cmd, statsDataId, output_type, offset, limit)
+
+    # 分割して出力するジェネレーター(同期)を返す。各要素の取得はスレッドで行うこと
+    async def iter_table_output(self, cmd, statsDataId, output_type, offset=0, limit=None, where=None, cols=None):
+        await self.ensure_cached(statsDataId)
+        return await self._cached_call(
+            self.adaptor.iter_table_output, cmd, statsDataId, output_type, offset, limit, where, cols)
+
+    async def merge_data(self, statsDataId, group_by, aggregate):
+        ids = list(dict.fromkeys(sid.strip() for sid in statsDataId.split(',')))
+        await asyncio.gather(*[self.ensure_cached(sid) for sid in ids])
+        return await self._cached_call(self.adaptor.merge_data, statsDataId, group_by, aggregate)
+
+    async def search_id(self, q, _index, _header='index', filters=None):
+        return await _to_thread(self.adaptor.search_id, q, _index, _header, filters)
+
+    async def search_ranked(self, q, k=20, offset=0, filters=None):
+        return await _to_thread(self.adaptor.search_ranked, q, k, offset, filters)
+
+    async def search_detailed_index(self, q):
+        return await _to_thread(self.adaptor.search_detailed_index, q)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# e-Stat API Adaptorのコマンドラインツール(複数の統計表・検索語を1回の起動でまとめて処理)
+#
+# python estat.py install                                  # 統計表IDのダウンロードとインデックスの作成
+# python estat.py refresh                                  # 統計表IDの差分更新
+# python estat.py fetch 0000030001 0000030002 --workers 4  # ダウンロードしてdata-cache/に保存
+# python estat.py fetch --file ids.txt                     # 1行1統計表ID('-'で標準入力)
+# python estat.py convert 0000030001                       # tmp/に保持したページからCSVを作り直す
+# python estat.py get 0000030001 0000030002 --format rjson --output-dir out/
+# python estat.py get 0000030001 --where area=13000 --cols area,time,$
+# python estat.py search 人口 法人 --format csv
+# python estat.py search 家計 --detail
+# python estat.py search 人口世帯 --top 20 --offset 20              # スコアの高い順に21〜40件目
+# python estat.py merge 0000030001,0000030002 --group-by area --aggregate sum
+#
+# 起動時間を短くするため、pandas・Flaskは必要な処理(merge等)でのみ読み込まれる
+import os
+import sys
+import argparse
+import logging
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import e_Stat_API_Adaptor
+
+config = {
+    # 取得したappId
+    'appId': '#appID#',
+    # データをダウンロード時に一度に取得するデータ件数
+    'limit': '10000',
+    # next_keyに対応するか否か(非対応の場合は上記のlimitで設定した件数のみしかダウンロードされない)
+    # 対応時はTrue/非対応時はFalse
+    'next_key': True,
+    # 中間アプリの設置ディレクトリ
+    'directory': '#絶対パス#',
+    # APIのバージョン
+    'ver': '2.0',
+    # 列指向キャッシュは最初に使う時に作成(ダウンロードのみの場合はpandasを読み込まない)
+    'columnar_cache': 'lazy'
+}
+
+
+def _read_ids(args):
+    ids = []
+    for value in args.ids:
+        ids.extend(v for v in value.split(',') if v.strip())
+    if args.file:
+        f = sys.stdin if args.file == '-' else open(args.file, 'r', encoding='utf-8')
+        try:
+            ids.extend(line.strip() for line in f if line.strip())
+        finally:
+            if f is not sys.stdin:
+                f.close()
+    return list(dict.fromkeys(i.strip() for i in ids))
+
+
+def _pairs(values):
+    """['area=13000,14000', ...] → {'area': ['13000', '14000']}"""
+    where = {}
+    for value in values or []:
+        key, _, v = value.partition('=')
+        where.setdefault(key, []).extend(x for x in v.split(',') if x)
+    return where
+
+
+def _write(chunks, path=None):
+    out = open(path, 'w', encoding='utf-8') if path else sys.stdout
+    try:
+        for chunk in chunks:
+            out.write(chunk.decode('utf-8') if isinstance(chunk, bytes) else chunk)
+        if not path:
+            out.write('\n')
+    finally:
+        if path:
+            out.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='e-Stat API Adaptorのコマンドラインツール')
+    parser.add_argument('--appId', help='appId(省略時はこのファイルの設定)')
+    parser.add_argument('--directory', help='中間アプリの設置ディレクトリ(省略時はこのファイルの設定)')
+    parser.add_argument('-v', '--verbose', action='store_true', help='処理の経過を表示')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    install = sub.add_parser('install', help='統計表IDのダウンロードとインデックスの作成')
+    install.add_argument('--no-detail', action='store_true', help='詳細検索用インデックスを作成しない')
+    install.add_argument('--workers', type=int, help='詳細検索用インデックス作成のワーカー数')
+
+    sub.add_parser('refresh', help='前回から更新された統計表IDを取得してインデックスに反映')
+
+    def ids_parser(name, help):
+        p = sub.add_parser(name, help=help)
+        p.add_argument('ids', nargs='*', help='統計表ID(カンマ区切りも可)')
+        p.add_argument('--file', help="統計表IDの一覧(1行1件、'-'で標準入力)")
+        return p
+
+    fetch = ids_parser('fetch', 'ダウンロードしてdata-cache/に保存')
+    fetch.add_argument('--workers', type=int, help='同時に処理する統計表の数')
+
+    ids_parser('convert', 'tmp/に保持したページからキャッシュCSVを作成')
+
+    get = ids_parser('get', '統計表を出力')
+    get.add_argument('--cmd', default='get', choices=['get', 'head', 'tail', 'range'])
+    get.add_argument('--format', default='csv', choices=['csv', 'rjson', 'cjson'])
+    get.add_argument('--offset', type=int, default=0)
+    get.add_argument('--limit', type=int)
+    get.add_argument('--where', action='append', metavar='KEY=CODE[,CODE]', help='次元による絞り込み(複数可)')
+    get.add_argument('--cols', help='出力する列(カンマ区切り)')
+    get.add_argument('--output-dir', help='<統計表ID>.<形式>として保存するディレクトリ(省略時は標準出力)')
+
+    search = sub.add_parser('search', help='統計表を検索')
+    search.add_argument('queries', nargs='+', help="検索語('index'で全件)")
+    search.add_argument('--detail', action='store_true', help='詳細検索用インデックス(N-gram)を検索')
+    search.add_argument('--format', default='csv', choices=['csv', 'rjson', 'cjson'])
+    search.add_argument('--filter', action='append', metavar='項目=値', help='調査名・組織名等による絞り込み')
+    search.add_argument('--top', type=int, metavar='K', help='スコアの高い順に上位K件を出力')
+    search.add_argument('--offset', type=int, default=0, help='--top指定時の開始位置')
+
+    merge = sub.add_parser('merge', help='統計表を結合・集約')
+    merge.add_argument('ids', help='統計表ID(カンマ区切り)')
+    merge.add_argument('--group-by', default='all')
+    merge.add_argument('--aggregate', default='')
+    merge.add_argument('--format', default='csv', choices=['csv', 'rjson', 'cjson'])
+    args = parser.parse_args(argv)
+
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    if args.appId:
+        config['appId'] = args.appId
+    if args.directory:
+        config['directory'] = args.directory
+    eStatAPI = e_Stat_API_Adaptor.e_Stat_API_Adaptor(config)
+
+    if args.command == 'install':
+        eStatAPI.load_all_ids()
+        eStatAPI.build_indexes(detailed=not args.no_detail, workers=args.workers)
+    elif args.command == 'refresh':
+        result = eStatAPI.refresh_catalog()
+        print(f"added: {len(result['added'])}, updated: {len(result['updated'])}")
+    elif args.command == 'fetch':
+        failed = 0
+        for sid, result in eStatAPI.fetch_tables(_read_ids(args), args.workers).items():
+            if isinstance(result, Exception):
+                failed += 1
+                print(f"{sid}\terror\t{result}")
+            else:
+                print(f"{sid}\tok\t{result}")
+        return 1 if failed else 0
+    elif args.command == 'convert':
+        for sid in _read_ids(args):
+            eStatAPI.convert_raw_json_to_csv(sid)
+            print(f"{sid}\tok")
+    elif args.command == 'get':
+        where = _pairs(args.where)
+        cols = [c for c in (args.cols or '').split(',') if c] or None
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+        for sid in _read_ids(args):
+            chunks = eStatAPI.iter_table_output(args.cmd, sid, args.format, args.offset, args.limit, where, cols)
+            _write(chunks, os.path.join(args.output_dir, f"{sid}.{args.format}") if args.output_dir else None)
+    elif args.command == 'search':
+        filters = dict(f.split('=', 1) for f in args.filter or [] if '=' in f)
+        for q in args.queries:
+            if args.top:
+                _write([eStatAPI.get_output(eStatAPI.search_ranked(q, args.top, args.offset, filters), args.format)])
+            elif args.detail:
+                print('\n'.join(eStatAPI.search_detailed_index(q)))
+            else:
+                result = eStatAPI.search_id(q, eStatAPI.path['dictionary-index'], filters=filters)
+                _write([eStatAPI.get_output(result, args.format)])
+    else:
+        _write(eStatAPI.iter_output(eStatAPI.merge_data(args.ids, args.group_by, args.aggregate), args.format))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
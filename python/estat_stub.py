@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  e-Stat API スタブサーバー(ベンチマーク・動作確認用)
+#  (c) 2016 National Statistics Center
+#  License: MIT
+#
+# # # # # # # # # # # # # # # # # # # # # # # #
+
+import sys
+import json
+import time
+import random
+import socket
+import argparse
+import threading
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# 地域(都道府県)の分類
+AREAS = [('%02d000' % (i + 1), name) for i, name in enumerate([
+    '北海道', '青森県', '岩手県', '宮城県', '秋田県', '山形県', '福島県', '茨城県', '栃木県', '群馬県',
+    '埼玉県', '千葉県', '東京都', '神奈川県', '新潟県', '富山県', '石川県', '福井県', '山梨県', '長野県',
+    '岐阜県', '静岡県', '愛知県', '三重県', '滋賀県', '京都府', '大阪府', '兵庫県', '奈良県', '和歌山県',
+    '鳥取県', '島根県', '岡山県', '広島県', '山口県', '徳島県', '香川県', '愛媛県', '高知県', '福岡県',
+    '佐賀県', '長崎県', '熊本県', '大分県', '宮崎県', '鹿児島県', '沖縄県'])]
+CATEGORIES = ['人口・世帯', '労働・賃金', '農林水産業', '鉱工業', '商業・サービス業', '企業・家計・経済']
+ORGANIZATIONS = ['総務省', '厚生労働省', '農林水産省', '経済産業省', '国土交通省']
+
+
+class EStatStub:
+    """getStatsData/getStatsListの合成データを返すe-Stat APIのスタブ
+
+    rows: 統計表1つあたりのデータ件数, tables: getStatsListの統計表数,
+    latency: 1リクエストあたりの遅延(秒), special: 値が'-'になる割合(n件に1件、0で無し),
+    error_rate: 503を返すリクエストの割合(再試行の確認用)。fail()で次のリクエストの失敗も指定できる。
+    max_limit: 1ページの件数の上限(e-Statと同様に、limitがこれを超えても上限までしか返さない)
+    データはstatsDataIdと位置から決まるため、同じ条件であれば毎回同じ内容になる。
+    """
+
+    def __init__(self, rows=10000, tables=1000, latency=0.0, special=0, port=0, error_rate=0.0,
+                 max_limit=100000):
+        self.rows = rows
+        self.tables = tables
+        self.latency = latency
+        self.special = special
+        self.error_rate = error_rate
+        self.max_limit = max_limit
+        self.hits = 0
+        self._faults = deque()
+        self._catalog = None
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def host(self):
+        return 'http://127.0.0.1:%d' % self.server.server_port
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def fail(self, *statuses):
+        """次のリクエストから順に、指定したステータスを返す(0は応答せずに接続を切る)"""
+        with self._lock:
+            self._faults.extend(statuses)
+
+    def _fault(self):
+        with self._lock:
+            if self._faults:
+                return self._faults.popleft()
+        if self.error_rate and random.random() < self.error_rate:
+            return 503
+        return None
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {k: v[0] for k, v in parse_qs(url.query).items()}
+                with stub._lock:
+                    stub.hits += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                fault = stub._fault()
+                if fault == 0:
+                    self.close_connection = True
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                    return
+                if fault is not None:
+                    self.send_response(fault)
+                    if fault in (429, 503):
+                        self.send_header('Retry-After', '1')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if url.path.endswith('getStatsList'):
+                    body = stub.stats_list(query.get('updatedDate'))
+                elif url.path.endswith('getStatsData'):
+                    body = stub.stats_data(query.get('statsDataId', '0000000001'),
+                                           int(query.get('startPosition', 1)),
+                                           min(int(query.get('limit', 100000)), stub.max_limit))
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def table_inf(self, i):
+        category = CATEGORIES[i % len(CATEGORIES)]
+        return {
+            '@id': '%010d' % (i + 1),
+            'STAT_NAME': {'@code': '%08d' % (i % 97), '$': '%s調査%d' % (category[:2], i % 97)},
+            'GOV_ORG': {'@code': '%05d' % (i % 5), '$': ORGANIZATIONS[i % len(ORGANIZATIONS)]},
+            'STATISTICS_NAME': '%s調査%d 確報 %d年' % (category[:2], i % 97, 2000 + i % 20),
+            'TITLE': {'@no': '%03d' % (i % 50), '$': '%s別 %s 第%d表' % (
+                ['男女', '年齢', '産業', '地域'][i % 4], category, i % 50)},
+            'CYCLE': '年次',
+            'SURVEY_DATE': 200001 + (i % 20) * 100,
+            'OPEN_DATE': '2020-01-01',
+            'SMALL_AREA': 0,
+            'MAIN_CATEGORY': {'@code': '%02d' % (i % 6 + 1), '$': category},
+            'SUB_CATEGORY': {'@code': '01', '$': category.split('・')[0]},
+            'OVERALL_TOTAL_NUMBER': self.rows,
+            'UPDATED_DATE': '2020-%02d-%02d' % (i % 12 + 1, i % 28 + 1)
+        }
+
+    def stats_list(self, updated_date=None):
+        if updated_date is None:
+            with self._lock:
+                if self._catalog is None:
+                    self._catalog = self._stats_list_body([self.table_inf(i) for i in range(self.tables)])
+                return self._catalog
+        since, _, until = updated_date.partition('-')
+        until = until or since
+        tables = [t for t in (self.table_inf(i) for i in range(self.tables))
+                  if since <= t['UPDATED_DATE'].replace('-', '')[:len(since)] and
+                  t['UPDATED_DATE'].replace('-', '')[:len(until)] <= until]
+        return self._stats_list_body(tables)
+
+    def _stats_list_body(self, tables):
+        return json.dumps({'GET_STATS_LIST': {
+            'RESULT': {'STATUS': 0, 'ERROR_MSG': '正常に終了しました。'},
+            'DATALIST_INF': {'NUMBER': len(tables), 'TABLE_INF': tables}
+        }}, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def class_inf(self):
+        return {'CLASS_OBJ': [
+            {'@id': 'tab', '@name': '表章項目', 'CLASS': [
+                {'@code': '001', '@name': '人口', '@unit': '人'},
+                {'@code': '002', '@name': '世帯数', '@unit': '世帯'}]},
+            {'@id': 'cat01', '@name': '男女別', 'CLASS': [
+                {'@code': '100', '@name': '総数'}, {'@code': '110', '@name': '男'},
+                {'@code': '120', '@name': '女'}]},
+            {'@id': 'area', '@name': '地域', 'CLASS': [
+                {'@code': code, '@name': name} for code, name in AREAS]},
+            {'@id': 'time', '@name': '時間軸(年次)', 'CLASS': [
+                {'@code': '%d000000' % year, '@name': '%d年' % year} for year in range(1920, 2021)]},
+        ]}
+
+    def value(self, statsDataId, i):
+        seed = int(statsDataId) % 1000
+        area = AREAS[i % len(AREAS)][0]
+        rest = i // len(AREAS)
+        value = {
+            '@tab': ['001', '002'][rest % 2],
+            '@cat01': ['100', '110', '120'][(rest // 2) % 3],
+            '@area': area,
+            '@time': '%d000000' % (2020 - (rest // 6) % 101),
+            '@unit': ['人', '世帯'][rest % 2],
+            '$': str((i * 7919 + seed * 104729) % 1000000)
+        }
+        if self.special and i % self.special == self.special - 1:
+            value['$'] = '-'
+        return value
+
+    def stats_data(self, statsDataId, start, limit):
+        end = min(self.rows, start - 1 + limit)
+        RESULT_INF = {'TOTAL_NUMBER': self.rows, 'FROM_NUMBER': start, 'TO_NUMBER': end}
+        if end < self.rows:
+            RESULT_INF['NEXT_KEY'] = end + 1
+        return json.dumps({'GET_STATS_DATA': {
+            'RESULT': {'STATUS': 0, 'ERROR_MSG': '正常に終了しました。'},
+            'STATISTICAL_DATA': {
+                'RESULT_INF': RESULT_INF,
+                'TABLE_INF': self.table_inf(int(statsDataId) - 1),
+                'CLASS_INF': self.class_inf(),
+                'DATA_INF': {'VALUE': [self.value(statsDataId, i) for i in range(start - 1, end)]}
+            }
+        }}, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='e-Stat APIのスタブサーバー')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--rows', type=int, default=10000, help='統計表1つあたりのデータ件数')
+    parser.add_argument('--tables', type=int, default=1000, help='getStatsListの統計表数')
+    parser.add_argument('--latency', type=float, default=0.0, help='1リクエストあたりの遅延(秒)')
+    parser.add_argument('--special', type=int, default=0, help="n件に1件の値を'-'にする")
+    parser.add_argument('--error-rate', type=float, default=0.0, help='503を返すリクエストの割合(0〜1)')
+    args = parser.parse_args(argv)
+
+    stub = EStatStub(args.rows, args.tables, args.latency, args.special, args.port, args.error_rate)
+    print(f"Serving e-Stat API stub on {stub.host} ('host' に指定してください)")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,15 +1,18 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+# 使い方: python get_csv.py 0000030001
+# (複数の統計表をまとめて処理する場合は estat.py get を使用)
 import sys
 sys.path.append('./')
 import e_Stat_API_Adaptor
 eStatAPI = e_Stat_API_Adaptor.e_Stat_API_Adaptor({
-    'appId'	: '#appID#' # 取得したappId    
-    , 'limit'	: '10000'  # データをダウンロード時に一度に取得するデータ件数  
-    , 'next_key'	: True        # next_keyに対応するか否か(非対応の場合は上記のlimitで設定した件数のみしかダウンロードされない)# 対応時はTrue/非対応時はFalse
-    , 'directory': '#Directory#'      # 中間アプリの設置ディレクトリ
-    , 'ver'		: '2.0'       # APIのバージョン
+    'appId': '#appID#',  # 取得したappId
+    'limit': '10000',  # データをダウンロード時に一度に取得するデータ件数
+    'next_key': True,  # next_keyに対応するか否か(非対応の場合は上記のlimitで設定した件数のみしかダウンロードされない)# 対応時はTrue/非対応時はFalse
+    'directory': '#Directory#',  # 中間アプリの設置ディレクトリ
+    'ver': '2.0',  # APIのバージョン
+    'columnar_cache': 'lazy'  # 列指向キャッシュは最初に使う時に作成(pandasを読み込まない)
 })
 # 0000030001をcsvの形式でダウンロード
-print 'id:' + sys.argv[1]
-print eStatAPI.get_csv('get', sys.argv[1])
+print('id:' + sys.argv[1])
+print(eStatAPI.get_csv('get', sys.argv[1]))
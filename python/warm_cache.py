@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# data-cache/を事前に作成するジョブの登録・実行・状態確認
+#
+# python warm_cache.py add 0000030001 0000030002 --priority 10
+# python warm_cache.py add --popular 100        # ユーザーindexで登録の多い100件
+# python warm_cache.py add --file ids.txt       # 1行1統計表ID
+# python warm_cache.py run --workers 4          # 待機中のジョブが無くなるまで処理
+# python warm_cache.py run --watch              # キューを監視して処理し続ける(Ctrl+Cで停止)
+# python warm_cache.py status [0000030001]
+# python warm_cache.py clear                    # 完了・失敗したジョブの記録を削除
+import sys
+import json
+import time
+import argparse
+sys.path.append('./')
+import e_Stat_API_Adaptor
+
+config = {
+    # 取得したappId
+    'appId': '#appID#',
+    # データをダウンロード時に一度に取得するデータ件数
+    'limit': '10000',
+    # next_keyに対応するか否か(非対応の場合は上記のlimitで設定した件数のみしかダウンロードされない)
+    # 対応時はTrue/非対応時はFalse
+    'next_key': True,
+    # 中間アプリの設置ディレクトリ
+    'directory': '#絶対パス#',
+    # APIのバージョン
+    'ver': '2.0'
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='data-cache/を事前に作成するジョブキュー')
+    parser.add_argument('--appId', help='appId(省略時はこのファイルの設定)')
+    parser.add_argument('--directory', help='中間アプリの設置ディレクトリ(省略時はこのファイルの設定)')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    add = sub.add_parser('add', help='ジョブを登録')
+    add.add_argument('ids', nargs='*', help='統計表ID')
+    add.add_argument('--file', help='統計表IDの一覧(1行1件)')
+    add.add_argument('--popular', type=int, metavar='N', help='ユーザーindexで登録の多い上位N件')
+    add.add_argument('--priority', type=int, default=0, help='優先度(大きいものから処理)')
+
+    run = sub.add_parser('run', help='ジョブを処理')
+    run.add_argument('--workers', type=int, help='ワーカー数(省略時は設定のjob_workers)')
+    run.add_argument('--watch', action='store_true', help='キューを監視して処理し続ける')
+    run.add_argument('--interval', type=float, default=5.0, help='--watch時にキューを確認する間隔(秒)')
+
+    status = sub.add_parser('status', help='ジョブの状態を表示')
+    status.add_argument('id', nargs='?', help='統計表ID')
+
+    sub.add_parser('clear', help='完了・失敗したジョブの記録を削除')
+    args = parser.parse_args(argv)
+
+    if args.appId:
+        config['appId'] = args.appId
+    if args.directory:
+        config['directory'] = args.directory
+    eStatAPI = e_Stat_API_Adaptor.e_Stat_API_Adaptor(config)
+
+    if args.command == 'add':
+        ids = list(args.ids)
+        if args.file:
+            with open(args.file, 'r', encoding='utf-8') as f:
+                ids.extend(line.strip() for line in f if line.strip())
+        if args.popular:
+            ids.extend(eStatAPI.popular_ids(args.popular))
+        result = eStatAPI.enqueue_tables(ids, args.priority)
+        print(json.dumps({k: len(v) for k, v in result.items()}, ensure_ascii=False))
+    elif args.command == 'run':
+        if args.watch:
+            stop = eStatAPI.start_job_workers(args.workers, args.interval)
+            try:
+                while True:
+                    time.sleep(3600)
+            except KeyboardInterrupt:
+                stop.set()
+        else:
+            print(f"processed: {eStatAPI.run_jobs(args.workers)}")
+    elif args.command == 'status':
+        print(json.dumps(eStatAPI.job_status(args.id), ensure_ascii=False, indent=2))
+    else:
+        print(f"cleared: {eStatAPI.jobs.clear()}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
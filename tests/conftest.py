@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# テスト共通のフィクスチャ(スタブサーバーとwww/run.py)
+import os
+import sys
+import importlib
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'python'))
+sys.path.insert(0, os.path.join(ROOT, 'www'))
+
+import e_Stat_API_Adaptor
+from estat_stub import EStatStub
+
+ROWS = 250
+LIMIT = 100
+TABLES = ['%010d' % (i + 1) for i in range(4)]
+
+
+@pytest.fixture
+def stub():
+    stub = EStatStub(rows=ROWS, tables=len(TABLES)).start()
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture
+def make_run(tmp_path, stub, monkeypatch):
+    """設定を上書きしたインスタンスを使うwww/run.pyを返す関数"""
+    # run.pyは読み込み時に作業ディレクトリの下にディレクトリを作成するため、一時ディレクトリで読み込む
+    monkeypatch.chdir(tmp_path)
+    run = importlib.import_module('run')
+
+    def make(**config):
+        monkeypatch.setattr(run, 'eStatAPI', e_Stat_API_Adaptor.e_Stat_API_Adaptor(dict({
+            'appId': 'BASE',
+            'limit': str(LIMIT),
+            'next_key': True,
+            'directory': str(tmp_path / 'estat') + '/',
+            'ver': '2.0',
+            'host': stub.host
+        }, **config)))
+        return run
+    return make
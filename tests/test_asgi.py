@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+# www/asgi.pyの引数の検証(整数でない引数は400を返す)を確認する
+# 実行: python -m pytest tests
+import asyncio
+import importlib
+
+import pytest
+
+import e_Stat_API_Adaptor_async
+from conftest import LIMIT, TABLES
+
+
+@pytest.fixture
+def asgi(tmp_path, stub, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    asgi = importlib.import_module('asgi')
+    monkeypatch.setattr(asgi, 'eStatAPI', e_Stat_API_Adaptor_async.e_Stat_API_Adaptor_async({
+        'appId': 'BASE',
+        'limit': str(LIMIT),
+        'next_key': True,
+        'directory': str(tmp_path / 'estat') + '/',
+        'ver': '2.0',
+        'host': stub.host
+    }))
+    return asgi
+
+
+def call(asgi, path, query=''):
+    """ASGIアプリを呼び出して(ステータス, 本文)を返す"""
+    out = {'body': b''}
+
+    async def receive():
+        return {'type': 'http.request'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            out['status'] = message['status']
+        else:
+            out['body'] += message['body']
+
+    async def main():
+        try:
+            await asgi.app({'type': 'http', 'path': path, 'query_string': query.encode()}, receive, send)
+        finally:
+            await asgi.eStatAPI.close()
+    asyncio.run(main())
+    return out['status'], out['body'].decode('utf-8')
+
+
+@pytest.mark.parametrize('path, query', [
+    ('/APP/search/調査.csv', 'top=abc'),
+    ('/APP/search/調査.csv', 'top=0'),
+    ('/APP/search/調査.csv', 'top=5&offset=-1'),
+    ('/APP/range/%s.csv' % TABLES[0], 'offset=x&limit=2'),
+    ('/APP/range/%s.csv' % TABLES[0], 'offset=1&limit=two'),
+])
+def test_invalid_integer_arguments_return_400(asgi, stub, path, query):
+    status, body = call(asgi, path, query)
+    assert status == 400
+    assert body.startswith('Invalid')
+    # 上流には問い合わせない
+    assert stub.hits == 0
+
+
+def test_range(asgi):
+    status, body = call(asgi, '/APP/range/%s.csv' % TABLES[0], 'offset=2&limit=3')
+    assert status == 200
+    assert len(body.strip().split('\n')) == 4
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# 非同期版のダウンロード・変換を確認する
+# 実行: python -m pytest tests
+import json
+import asyncio
+
+import e_Stat_API_Adaptor_async
+from conftest import ROWS, LIMIT, TABLES
+
+
+def test_convert_ignores_stale_pages(tmp_path, stub):
+    api = e_Stat_API_Adaptor_async.e_Stat_API_Adaptor_async({
+        'appId': 'APP',
+        'limit': str(LIMIT),
+        'next_key': True,
+        'directory': str(tmp_path) + '/',
+        'ver': '2.0',
+        'host': stub.host
+    })
+    adaptor = api.adaptor
+    sid = TABLES[0]
+    # 以前の(件数が多かった)取得で残ったページ
+    stale = json.loads(stub.stats_data(sid, 1, LIMIT))
+    adaptor._save_page(adaptor._page_path(sid, str(ROWS + 1)), json.dumps(stale).encode('utf-8'))
+
+    async def main():
+        try:
+            return await api.ensure_cached(sid)
+        finally:
+            await api.close()
+    csv_path = asyncio.run(main())
+
+    with open(csv_path, encoding='utf-8') as f:
+        # 1行目は名称、2行目はキー
+        assert sum(1 for _ in f) - 2 == ROWS
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# レスポンスキャッシュから返す場合もdata-cache/の有効期間とアクセスの記録が有効であることを確認する
+# 実行: python -m pytest tests
+import math
+import time
+
+from conftest import ROWS, LIMIT, TABLES
+
+PAGES = math.ceil(ROWS / LIMIT)
+
+
+def test_ttl_expires_behind_response_cache(make_run, stub):
+    run = make_run(cache_ttl=1)
+    client = run.app.test_client()
+    url = '/APP/get/%s.csv' % TABLES[0]
+
+    # 本文を読み終えた時点でレスポンスキャッシュに登録される
+    first = client.get(url)
+    assert first.status_code == 200
+    body = first.get_data()
+    assert client.get(url).get_data() == body
+    assert client.get(url, headers={'If-None-Match': first.headers['ETag']}).status_code == 304
+    assert stub.hits == PAGES
+
+    time.sleep(1.1)
+    res = client.get(url)
+    assert res.status_code == 200
+    assert res.get_data() == body
+    # 有効期間を過ぎたため再取得する
+    assert stub.hits == PAGES * 2
+
+
+def test_response_cache_hits_touch_ledger(make_run):
+    run = make_run()
+    client = run.app.test_client()
+    for _ in range(3):
+        res = client.get('/APP/get/%s.csv' % TABLES[0])
+        assert res.status_code == 200
+        res.get_data()
+    assert run.eStatAPI.response_cache.size > 0
+    tables = {t['id']: t for t in run.eStatAPI.cache_stats()['tables']}
+    assert tables[TABLES[0]]['hits'] == 2
+    assert tables[TABLES[0]]['last_access'] > tables[TABLES[0]]['created']
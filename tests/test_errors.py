@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# リクエストの引数の誤りは500ではなく400を返すことを確認する
+# 実行: python -m pytest tests
+import pytest
+
+from conftest import TABLES
+
+
+@pytest.fixture
+def client(make_run):
+    return make_run().app.test_client()
+
+
+@pytest.mark.parametrize('path', [
+    '/APP/get/%s.csv?aera=13000' % TABLES[0],
+    '/APP/get/%s.csv?cols=nope' % TABLES[0],
+    '/APP/merge/%s,%s/area.csv?aggregate=median2' % (TABLES[0], TABLES[1]),
+    '/APP/merge/%s,%s/aera.csv?aggregate=sum' % (TABLES[0], TABLES[1]),
+])
+def test_invalid_arguments_return_400(client, path):
+    res = client.get(path)
+    assert res.status_code == 400
+    assert 'Invalid' in res.get_data(as_text=True)
+
+
+def test_valid_merge(client):
+    res = client.get('/APP/merge/%s,%s/area.csv?aggregate=sum' % (TABLES[0], TABLES[1]))
+    assert res.status_code == 200
+    assert '$' + TABLES[0] in res.get_data(as_text=True)
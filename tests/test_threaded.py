@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# www/run.pyを複数のスレッドから同時に呼び出し、リクエストごとの状態(appId等)が混ざらないことを確認する
+# 実行: python -m pytest tests
+import math
+import threading
+
+import pytest
+
+from conftest import ROWS, LIMIT, TABLES
+
+APP_IDS = ['APP0', 'APP1', 'APP2']
+
+
+@pytest.fixture
+def run(make_run):
+    # 全てのリクエストでダウンロード・変換の経路を通す
+    return make_run(response_cache_bytes=0)
+
+
+def test_threaded_requests(run, stub):
+    bodies = {}
+    errors = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(12)
+
+    def hammer(n):
+        client = run.app.test_client()
+        barrier.wait()
+        for i in range(len(TABLES) * 2):
+            sid = TABLES[(n + i) % len(TABLES)]
+            for ext in ('csv', 'rjson', 'cjson'):
+                res = client.get('/%s/get/%s.%s' % (APP_IDS[n % len(APP_IDS)], sid, ext))
+                body = res.get_data(as_text=True)
+                with lock:
+                    if res.status_code != 200:
+                        errors.append((sid, ext, res.status_code, body))
+                    bodies.setdefault((sid, ext), set()).add(body)
+
+    threads = [threading.Thread(target=hammer, args=(n,)) for n in range(12)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    assert set(bodies) == {(sid, ext) for sid in TABLES for ext in ('csv', 'rjson', 'cjson')}
+    assert all(len(b) == 1 for b in bodies.values())
+    # 同じ統計表の同時リクエストでもダウンロードは1回だけ行う(1ページにつき1回)
+    assert stub.hits == len(TABLES) * math.ceil(ROWS / LIMIT)
+    # 共有のインスタンスは変更されない
+    assert run.eStatAPI._['appId'] == 'BASE'
+    assert run.eStatAPI.cache == {}
+
+
+def test_for_app_isolates_state(run):
+    api = run.eStatAPI.for_app('APP0')
+    api.cache['tmp'] = 'x'
+    assert api._['appId'] == 'APP0'
+    assert run.eStatAPI._['appId'] == 'BASE'
+    assert 'tmp' not in run.eStatAPI.cache
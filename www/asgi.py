@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# run.pyと同じルートを提供するASGIアプリ
+# 起動例: uvicorn asgi:app --host 0.0.0.0 --port 5000
+import sys
+import re
+import math
+import time
+import logging
+from urllib.parse import parse_qsl, unquote
+sys.path.append('../python/')
+
+import e_Stat_API_Adaptor_async
+
+logger = logging.getLogger(__name__)
+
+eStatAPI = e_Stat_API_Adaptor_async.e_Stat_API_Adaptor_async({
+    # 取得したappId
+    'appId': '#appID#',
+    # データをダウンロード時に一度に取得するデータ件数
+    'limit': '10000',
+    # next_keyに対応するか否か(非対応の場合は上記のlimitで設定した件数のみしかダウンロードされない)
+    # 対応時はTrue/非対応時はFalse
+    'next_key': False,
+    # 中間アプリの設置ディレクトリ
+    'directory': '#絶対パス# /foo/bar/',
+    # APIのバージョン
+    'ver': '2.0',
+    # データを取得形式
+    'format': 'json',
+    # 上流APIへの同時接続数
+    'connections': 100
+})
+
+_public = re.escape(eStatAPI.path['http-public'])
+routes = [
+    ('search', re.compile('^' + _public + r'(?P<appId>[^/]+)/search/(?P<q>[^/]+)\.(?P<ext>[^./]+)$')),
+    ('merge', re.compile('^' + _public + r'(?P<appId>[^/]+)/merge/(?P<ids>[^/]+)/(?P<group_by>[^/]+)\.(?P<ext>[^./]+)$')),
+    ('get', re.compile('^' + _public + r'(?P<appId>[^/]+)/(?P<cmd>[^/]+)/(?P<id>[^/]+)\.(?P<ext>[^./]+)$')),
+]
+
+
+def mimetype(ext, args):
+    mt = 'text/plain' if ext == 'csv' else 'application/json'
+    if args.get('dl') == 'true':
+        mt = 'application/octet-stream'
+    return mt
+
+
+def _int_arg(args, name, default=None, minimum=0):
+    """整数の引数(指定されていない場合はdefault、整数でないかminimum未満の場合はInvalidSelectionを送出)"""
+    value = args.get(name)
+    if value is None or value == '':
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        number = None
+    if number is None or number < minimum:
+        raise e_Stat_API_Adaptor_async.InvalidSelection(f"Invalid {name}: {value}")
+    return number
+
+
+async def _search_id(api, args, q, ext):
+    # 調査名・組織名・カテゴリー等による絞り込み(例: ?組織名=総務省)
+    filters = {k: args[k] for k in api.adaptor.csv_header['index'] if args.get(k)}
+    # ?top=<件数>でスコアの高い順に上位の統計表だけを返す(?offset=<開始位置>で次のページ)
+    top = _int_arg(args, 'top', minimum=1)
+    if top:
+        result = await api.search_ranked(q, top, _int_arg(args, 'offset', 0), filters)
+    else:
+        result = await api.search_id(q, api.path['dictionary-index'], filters=filters)
+    # 出力の作成(文字列への変換)もスレッドで行う
+    return await e_Stat_API_Adaptor_async._to_thread(api.adaptor.get_output, result, ext)
+
+
+async def _get_data(api, args, cmd, id, ext):
+    # cmdがrangeの場合は?offset=<開始行>&limit=<行数>で範囲を指定
+    offset = _int_arg(args, 'offset', 0)
+    limit = _int_arg(args, 'limit')
+    # 次元による絞り込みと列の選択(例: ?area=13000&time=2020000000&cols=area,$)
+    where, cols = api.adaptor.selection_args(args)
+    return await api.iter_table_output(cmd, id, ext, offset, limit, where, cols)
+
+
+async def _merge_data(api, args, ids, group_by, ext):
+    data = await api.merge_data(ids, group_by, args.get('aggregate', ''))
+    return api.adaptor.iter_output(data, ext)
+
+
+async def _send_body(send, body):
+    if isinstance(body, (str, bytes)):
+        chunks = iter([body])
+    else:
+        chunks = body
+    done = object()
+    while True:
+        # 出力の作成(ファイルの読み込みや変換)はスレッドで行う
+        chunk = await e_Stat_API_Adaptor_async._to_thread(next, chunks, done)
+        if chunk is done:
+            break
+        await send({'type': 'http.response.body',
+                    'body': chunk.encode('utf-8') if isinstance(chunk, str) else chunk,
+                    'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def _send_text(send, status, text, headers=()):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(b'content-type', b'text/plain; charset=utf-8')] + list(headers)})
+    await send({'type': 'http.response.body', 'body': text.encode('utf-8')})
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await eStatAPI.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+
+    path = unquote(scope['path'])
+    args = dict(parse_qsl(scope['query_string'].decode('utf-8')))
+    metrics = eStatAPI.adaptor.metrics
+    if path == eStatAPI.path['http-public'] + 'metrics':
+        text = await e_Stat_API_Adaptor_async._to_thread(eStatAPI.adaptor.metrics_text)
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/plain; version=0.0.4; charset=utf-8')]})
+        await send({'type': 'http.response.body', 'body': text.encode('utf-8')})
+        return
+
+    start = time.perf_counter()
+    metrics.start_request()
+    for name, pattern in routes:
+        m = pattern.match(path)
+        if m:
+            break
+    else:
+        return await _send_text(send, 404, 'Not Found')
+
+    params = m.groupdict()
+    # リクエストごとの状態(appId等)は複製に持たせる
+    api = eStatAPI.for_app(params.pop('appId'))
+    try:
+        if name == 'search':
+            body = await _search_id(api, args, **params)
+        elif name == 'merge':
+            body = await _merge_data(api, args, **params)
+        else:
+            body = await _get_data(api, args, **params)
+    except e_Stat_API_Adaptor_async.UpstreamUnavailable as e:
+        # 上流APIが停止中とみなしている間(サーキットブレーカーが開いている間)は503を返す
+        metrics.observe('request_seconds', time.perf_counter() - start, endpoint=name, status=503)
+        return await _send_text(send, 503, api.adaptor.msg['api-error'],
+                                [(b'retry-after', str(math.ceil(e.retry_after)).encode('latin-1'))])
+    except e_Stat_API_Adaptor_async.InvalidSelection as e:
+        # 絞り込み条件・列・集約方法等の誤り(存在しないキー等)
+        metrics.observe('request_seconds', time.perf_counter() - start, endpoint=name, status=400)
+        return await _send_text(send, 400, str(e))
+    except Exception as e:
+        logger.exception(f"Exception on {path}: {e}")
+        metrics.observe('request_seconds', time.perf_counter() - start, endpoint=name, status=500)
+        return await _send_text(send, 500, 'Internal Server Error')
+
+    metrics.observe('request_seconds', time.perf_counter() - start, endpoint=name, status=200)
+    headers = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in api.adaptor.header.items()]
+    headers.append((b'content-type', (mimetype(params['ext'], args) + '; charset=utf-8').encode('latin-1')))
+    if eStatAPI._.get('server_timing'):
+        headers.append((b'server-timing', metrics.server_timing().encode('latin-1')))
+    await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+    await _send_body(send, body)
@@ -1,12 +1,8 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import sys
-import csv
-import random
-import pandas as pd
+import math
 import os
-import tempfile
-from pathlib import Path
 from flask import Flask, request
 sys.path.append('../python/')
 
@@ -30,45 +26,77 @@ eStatAPI = e_Stat_API_Adaptor.e_Stat_API_Adaptor({
 })
 
 
+@app.before_request
+def _start_request():
+    eStatAPI.start_request()
+
+
+@app.after_request
+def _finish_request(res):
+    # 'server_timing': Trueの場合はServer-Timingヘッダーを付与
+    return eStatAPI.finish_request(res)
+
+
+# 上流APIが停止中とみなしている間(サーキットブレーカーが開いている間)は503を返す
+@app.errorhandler(e_Stat_API_Adaptor.UpstreamUnavailable)
+def _upstream_unavailable(e):
+    return eStatAPI.msg['api-error'], 503, {'Retry-After': str(math.ceil(e.retry_after))}
+
+
+# 絞り込み条件・列・集約方法等の誤り(存在しないキー等)は400を返す
+@app.errorhandler(e_Stat_API_Adaptor.InvalidSelection)
+def _invalid_selection(e):
+    return str(e), 400
+
+
+# 処理ごとの件数と所要時間(Prometheusのテキスト形式)
+@app.route(eStatAPI.path['http-public'] + 'metrics', methods=['GET'])
+def _metrics():
+    return eStatAPI.metrics_response()
+
+
 @app.route(eStatAPI.path['http-public'] + '<appId>/search/<q>.<ext>', methods=['GET'])
 def _search_id(appId, q, ext):
-    eStatAPI._['appId'] = appId
-    return eStatAPI.response(eStatAPI.get_output(eStatAPI.search_id(q, eStatAPI.path['dictionary-index']), ext), ext)
+    # リクエストごとの状態(appId等)は複製に持たせ、共有のインスタンスは変更しない
+    api = eStatAPI.for_app(appId)
+    # 調査名・組織名・カテゴリー等による絞り込み(例: ?組織名=総務省)
+    filters = {k: request.args.get(k) for k in api.csv_header['index'] if request.args.get(k)}
+    # ?top=<件数>でスコアの高い順に上位の統計表だけを返す(?offset=<開始位置>で次のページ)
+    top = request.args.get('top', type=int)
+    if top:
+        offset = request.args.get('offset', 0, type=int)
+        deps = [p for p in [api.path['dictionary-index'], api.path['dictionary-detail-index']] if os.path.exists(p)]
+        return api.cached_response(
+            ext, deps, ['search'],
+            lambda: api.get_output(api.search_ranked(q, top, offset, filters), ext))
+    return api.cached_response(
+        ext, [api.path['dictionary-index']], ['search'],
+        lambda: api.get_output(api.search_id(q, api.path['dictionary-index'], filters=filters), ext))
 
 
 @app.route(eStatAPI.path['http-public'] + '<appId>/<cmd>/<id>.<ext>', methods=['GET'])
 def _get_data(appId, cmd, id, ext):
-    eStatAPI._['appId'] = appId
-    return eStatAPI.response(eStatAPI.get_output(eStatAPI.get_csv(cmd, id), ext), ext)
+    api = eStatAPI.for_app(appId)
+    # cmdがrangeの場合は?offset=<開始行>&limit=<行数>で範囲を指定
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', type=int)
+    # 次元による絞り込みと列の選択(例: ?area=13000&time=2020000000&cols=area,$)
+    where, cols = api.selection_args(request.args)
+    return api.cached_response(
+        ext, [os.path.join(api.path['csv'], id + '.csv')], [id],
+        lambda: api.iter_table_output(cmd, id, ext, offset, limit, where, cols), tables=[id])
 
 
 @app.route(eStatAPI.path['http-public'] + '<appId>/merge/<ids>/<group_by>.<ext>', methods=['GET'])
 def _merge_data(appId, ids, group_by, ext):
-    eStatAPI._['appId'] = appId
+    api = eStatAPI.for_app(appId)
     aggregate = request.args.get('aggregate') if request.args.get('aggregate') is not None else ''
-    data = eStatAPI.merge_data(ids, group_by, aggregate)
-
-    # 一時ファイルの安全な処理
-    try:
-        # tempfileを使用して安全に一時ファイルを作成
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.csv', delete=False,
-                                         dir=eStatAPI.path['tmp'], encoding='utf-8') as tmp_file:
-            tmp_path = tmp_file.name
-            data.to_csv(tmp_file, quoting=csv.QUOTE_NONNUMERIC, index=None)
-
-        # CSVを読み込み
-        with open(tmp_path, 'r', encoding='utf-8') as f:
-            tmp_csv = f.read()
-
-        # 一時ファイルを削除
-        os.remove(tmp_path)
-
-        return eStatAPI.response(eStatAPI.get_output(tmp_csv, ext), ext)
-    except Exception as e:
-        # エラー時もファイルをクリーンアップ
-        if 'tmp_path' in locals() and os.path.exists(tmp_path):
-            os.remove(tmp_path)
-        raise
+    # 重複したIDは1つにまとめる
+    id_list = list(dict.fromkeys(i.strip() for i in ids.split(',')))
+    return api.cached_response(
+        ext, [os.path.join(api.path['csv'], i + '.csv') for i in id_list], id_list,
+        lambda: api.iter_output(api.merge_data(ids, group_by, aggregate), ext), tables=id_list)
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', debug=True)
+    # 各リクエストは共有の状態を変更しないため、スレッドで並行に処理できる
+    app.run(host='0.0.0.0', debug=True, threaded=True)